@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Idle CPU benchmark of the JKBMS BLE driver with connected packs.
+
+The packs are scraped by the shared BLE manager, as in the driver, but bleak is replaced by a fake
+BleakClient, which connects at once and sends no data. So only the cost of the idle scraping loops
+is measured, which should wait for events instead of waking up periodically.
+The dbus-python module is replaced by an empty module, if it is not installed.
+
+Fails, if the process uses more CPU than allowed while idle.
+
+Usage: python3 bench/ble_idle_cpu_benchmark.py [number of packs] [allowed CPU in percent]
+"""
+
+import importlib
+import logging
+import os
+import sys
+import threading
+import types
+from time import monotonic, process_time, sleep
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+DURATION = 5.0
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class FakeBleakClient:
+    """
+    This class holds a fake BleakClient, which is connected at once and sends no data
+    """
+
+    def __init__(self, address: str, disconnected_callback=None):
+        self.address = address
+        self.disconnected_callback = disconnected_callback
+        self.is_connected = False
+
+    async def connect(self) -> None:
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+
+    async def read_gatt_char(self, uuid) -> bytes:
+        return b"JK-BMS-Fake"
+
+    async def start_notify(self, uuid, callback) -> None:
+        pass
+
+    async def write_gatt_char(self, uuid, data, response: bool = False) -> None:
+        pass
+
+
+def main() -> int:
+    packs = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    allowed_cpu = float(sys.argv[2]) if len(sys.argv) > 2 else 1.0
+
+    # always the fake client, also if bleak is installed
+    sys.modules["bleak"] = types.ModuleType("bleak")
+    sys.modules["bleak"].__dict__.update(
+        BleakScanner=object,
+        BleakClient=FakeBleakClient,
+        exc=types.SimpleNamespace(
+            BleakError=Exception, BleakDeviceNotFoundError=LookupError
+        ),
+    )
+    stub(
+        "dbus",
+        bus=types.SimpleNamespace(BusConnection=object),
+        exceptions=types.SimpleNamespace(DBusException=Exception),
+    )
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+
+    sys.path.insert(0, DRIVER_PATH)
+    import utils
+    from bms.jkbms_brn import Jkbms_Brn
+
+    utils.logger.setLevel(logging.WARNING)
+
+    async def request_bt(rtype: str, client) -> None:
+        # the fake client does not answer
+        pass
+
+    jks = [Jkbms_Brn(f"AA:BB:CC:DD:EE:{index:02X}") for index in range(packs)]
+    for jk in jks:
+        jk.request_bt = request_bt
+        jk.start_scraping()
+
+    # wait until all packs are connected
+    sleep(0.5)
+    running = sum(jk.is_running() for jk in jks)
+
+    cpu_start = process_time()
+    time_start = monotonic()
+    sleep(DURATION)
+    cpu = (process_time() - cpu_start) / (monotonic() - time_start) * 100
+
+    # latency of a command, which wakes up the idle scraping loop
+    executed = threading.Event()
+
+    async def command(client) -> None:
+        executed.set()
+
+    command_start = monotonic()
+    jks[0].queue_command(command)
+    executed.wait(5)
+    command_latency = (monotonic() - command_start) * 1000
+
+    stop_start = monotonic()
+    stopped = all(jk.stop_scraping() for jk in jks)
+    stop_time = (monotonic() - stop_start) * 1000
+
+    print(f"{running} of {packs} packs connected, {threading.active_count()} threads")
+    print(f"idle CPU over {DURATION:.0f} s: {cpu:.2f} %")
+    print(f"queued command executed after {command_latency:.1f} ms")
+    print(f"all packs stopped after {stop_time:.1f} ms: {stopped}")
+
+    if running != packs or not executed.is_set() or not stopped:
+        print("ERROR: the fake packs were not scraped as expected")
+        return 1
+    if cpu > allowed_cpu:
+        print(f"ERROR: {cpu:.2f} % idle CPU, allowed are {allowed_cpu:.2f} %")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
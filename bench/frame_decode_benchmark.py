@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Decode cost of the BMS frames before and after the migration to FrameSchema.
+
+The JKBMS, LLT/JBD, Daly and JKBMS CAN drivers decode the replies of a 16 cell pack in the wire format
+of each BMS. The serial and CAN reads are replaced by the frames, so that only the decoding is timed.
+The drivers before the migration are loaded from the git history, the drivers after the migration
+from the working tree. Both decode the same frames and have to set the same values.
+The dbus-python and python-can modules are replaced by empty modules, if they are not installed.
+
+Fails, if the drivers before and after the migration decoded different values.
+
+Usage: python3 bench/frame_decode_benchmark.py [git revision before the migration]
+"""
+
+import contextlib
+import importlib
+import io
+import logging
+import os
+import struct
+import subprocess
+import sys
+import timeit
+import types
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+CELL_COUNT = 16
+CELL_VOLTAGES = [3300 + cell * 3 for cell in range(CELL_COUNT)]
+REPEAT = 5
+NUMBER = 2000
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+def git(*arguments: str) -> str:
+    return subprocess.run(
+        ["git", *arguments],
+        cwd=DRIVER_PATH,
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout
+
+
+def load_driver_before(revision: str, name: str) -> types.ModuleType:
+    """
+    Load a driver as it was at the given revision, next to the current one
+    """
+    path = f"etc/dbus-serialbattery/bms/{name}.py"
+    source = git("show", f"{revision}:{path}")
+    module = types.ModuleType(f"{name}_before")
+    exec(compile(source, f"{revision}:{path}", "exec"), module.__dict__)
+    return module
+
+
+def jkbms_status_frame() -> bytes:
+    """
+    Status data of a JKBMS, as returned by read_serial_data_jkbms(): ID code followed by the value
+    """
+    cells = b"".join(
+        struct.pack(">BH", cell + 1, voltage)
+        for cell, voltage in enumerate(CELL_VOLTAGES)
+    )
+    items = [
+        (0x80, struct.pack(">H", 25)),
+        (0x81, struct.pack(">H", 23)),
+        (0x82, struct.pack(">H", 102)),
+        (0x83, struct.pack(">H", 5320)),
+        (0x84, struct.pack(">H", 0x8000 + 1234)),
+        (0x85, struct.pack(">B", 81)),
+        (0x86, struct.pack(">B", 2)),
+        (0x87, struct.pack(">H", 12)),
+        (0x89, struct.pack(">L", 1234)),
+        (0x8A, struct.pack(">H", CELL_COUNT)),
+        (0x8B, struct.pack(">H", 0x0004)),
+        (0x8C, struct.pack(">H", 0x0003)),
+    ]
+    items += [(code, struct.pack(">H", 0)) for code in range(0x8E, 0x97)]
+    items += [
+        (0x97, struct.pack(">H", 150)),
+        (0x98, struct.pack(">H", 0)),
+        (0x99, struct.pack(">H", 100)),
+        (0x9A, struct.pack(">H", 0)),
+        (0x9B, struct.pack(">H", 0)),
+        (0x9C, struct.pack(">H", 0)),
+        (0x9D, struct.pack(">B", 1)),
+    ]
+    items += [(code, struct.pack(">H", 0)) for code in range(0x9E, 0xA9)]
+    items += [
+        (0xA9, struct.pack(">B", CELL_COUNT)),
+        (0xAA, struct.pack(">L", 280)),
+        (0xAB, struct.pack(">B", 1)),
+        (0xAC, struct.pack(">B", 1)),
+        (0xAD, struct.pack(">H", 1000)),
+        (0xAE, struct.pack(">B", 1)),
+        (0xAF, struct.pack(">B", 1)),
+        (0xB0, struct.pack(">H", 10)),
+        (0xB1, struct.pack(">B", 10)),
+        (0xB2, b"123456\x00\x00\x00\x00"),
+        (0xB3, struct.pack(">B", 0)),
+        (0xB4, b"Pack  1\x00"),
+        (0xB5, b"2305"),
+        (0xB6, struct.pack(">L", 3600)),
+        (0xB7, b"11.XW_S11.26___"),
+        (0xB8, struct.pack(">B", 0)),
+        (0xB9, struct.pack(">L", 280000)),
+        (0xBA, b"Input UserdaJK_B2A24S15P"),
+        (0xC0, struct.pack(">B", 1)),
+    ]
+    return (
+        bytes([0x01, 0x79, len(cells)])
+        + cells
+        + b"".join(bytes([code]) + value for code, value in items)
+    )
+
+
+def lltjbd_frames() -> dict:
+    """
+    Payloads of the LLT/JBD replies, as returned by read_serial_data_llt()
+    """
+    general = struct.pack(
+        ">HhHHHHHHHBBBBBHH",
+        5320,
+        -1234,
+        10000,
+        28000,
+        12,
+        0x2A21,
+        0x0101,
+        0,
+        0,
+        0x10,
+        55,
+        3,
+        CELL_COUNT,
+        2,
+        2981,
+        2990,
+    )
+    cells = struct.pack(">" + "H" * CELL_COUNT, *CELL_VOLTAGES)
+    return {0x03: general, 0x04: cells}
+
+
+def daly_frames() -> dict:
+    """
+    Data sections of the Daly replies, as returned by request_data()
+    """
+    cells = b""
+    for sentence in range((CELL_COUNT + 2) // 3):
+        voltages = (CELL_VOLTAGES[sentence * 3 : sentence * 3 + 3] + [0, 0])[:3]
+        cells += struct.pack(">Bhhhx", sentence + 1, *voltages)
+    return {
+        0x90: struct.pack(">hhhh", 532, 0, 30000 + 123, 805),
+        0x91: struct.pack(">hbhbx", 3345, 12, 3300, 1),
+        0x93: struct.pack(">B??BL", 0, True, True, 12, 230000),
+        0x94: struct.pack(">bb??Bhx", CELL_COUNT, 2, True, False, 0, 12),
+        0x95: cells,
+    }
+
+
+def jkbms_can_messages() -> list:
+    """
+    CAN messages of a JKBMS, the alarm message is left out, since the driver prints it
+    """
+    return [
+        types.SimpleNamespace(
+            arbitration_id=0x02F4,
+            data=bytearray(struct.pack("<HHBBH", 532, 4123, 81, 0, 100)),
+        ),
+        types.SimpleNamespace(
+            arbitration_id=0x04F4,
+            data=bytearray(struct.pack("<HBHBB", 3345, 12, 3300, 1, 0)),
+        ),
+        types.SimpleNamespace(
+            arbitration_id=0x05F4,
+            data=bytearray(struct.pack("<BBBBBBBB", 75, 0, 73, 0, 0, 0, 0, 0)),
+        ),
+    ]
+
+
+class FakeCanBus:
+    """
+    This class holds a fake CAN bus, which receives the same messages again and again
+    """
+
+    def __init__(self, messages: list):
+        self.messages = messages
+        self.index = 0
+
+    def recv(self, timeout=None):
+        self.index += 1
+        return self.messages[self.index % len(self.messages)]
+
+    def shutdown(self) -> None:
+        pass
+
+
+def setup_jkbms(module, Cell):
+    battery = module.Jkbms("/dev/null", 115200, b"\x00")
+    battery.cells = [Cell(False) for _ in range(CELL_COUNT)]
+    frame = jkbms_status_frame()
+    battery.read_serial_data_jkbms = lambda command: frame
+    return battery, [("status frame", battery.read_status_data)]
+
+
+def setup_lltjbd(module, Cell):
+    battery = module.LltJbd("/dev/null", 9600, b"\x00")
+    frames = lltjbd_frames()
+    battery.read_serial_data_llt = lambda command: frames[command[2]]
+    return battery, [
+        ("general frame", battery.read_gen_data),
+        ("cell frame", battery.read_cell_data),
+    ]
+
+
+def setup_daly(module, Cell):
+    battery = module.Daly("/dev/null", 9600, b"\x40")
+    frames = daly_frames()
+    battery.request_data = lambda ser, command, sentences_to_receive=1: frames[
+        command[0]
+    ]
+    return battery, [
+        ("status frame", lambda: battery.read_status_data(None)),
+        ("SoC frame", lambda: battery.read_soc_data(None)),
+        ("cell frames", lambda: battery.read_cells_volts(None)),
+        ("cell range frame", lambda: battery.read_cell_voltage_range_data(None)),
+        ("FET frame", lambda: battery.read_fed_data(None)),
+    ]
+
+
+def setup_jkbms_can(module, Cell):
+    # the cell count is imported from the config by the driver
+    module.JKBMS_CAN_CELL_COUNT = CELL_COUNT
+    battery = module.Jkbms_Can("can0", 250000, b"\x00")
+    battery.get_settings()
+    battery.can_bus = FakeCanBus(jkbms_can_messages())
+    return battery, [
+        (f"{battery.MESSAGES_TO_READ} messages", battery.read_serial_data_jkbms_CAN)
+    ]
+
+
+DRIVERS = [
+    ("jkbms", "Jkbms", setup_jkbms),
+    ("lltjbd", "LltJbd", setup_lltjbd),
+    ("daly", "Daly", setup_daly),
+    ("jkbms_can", "Jkbms_Can", setup_jkbms_can),
+]
+
+
+def decoded_values(battery) -> dict:
+    """
+    Return the simple attributes and the cells of a battery, to compare the decoders
+    """
+    values = {
+        name: value
+        for name, value in vars(battery).items()
+        if isinstance(value, (bool, int, float, str, type(None)))
+    }
+    values["cells"] = [(cell.voltage, cell.balance) for cell in battery.cells]
+    return values
+
+
+def main() -> int:
+    stub("dbus", bus=types.SimpleNamespace(BusConnection=object))
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+    stub("can", CanError=Exception, interface=types.SimpleNamespace(Bus=None))
+
+    sys.path.insert(0, DRIVER_PATH)
+    import utils
+    from battery import Cell
+
+    utils.logger.setLevel(logging.WARNING)
+
+    try:
+        if len(sys.argv) > 1:
+            revision = sys.argv[1]
+        else:
+            # the parent of the oldest commit, which contains FrameSchema
+            revision = (
+                git(
+                    "log",
+                    "--format=%H",
+                    "-S",
+                    "class FrameSchema",
+                    "--",
+                    "utils.py",
+                )
+                .split()[-1]
+                .strip()
+                + "^"
+            )
+        drivers_before = {
+            name: load_driver_before(revision, name) for name, _, _ in DRIVERS
+        }
+    except (subprocess.CalledProcessError, FileNotFoundError, IndexError) as e:
+        print(f"ERROR: the drivers before the migration could not be loaded: {e}")
+        return 1
+
+    print(f"drivers before the migration from {revision}, {CELL_COUNT} cells")
+    print(f"{'frame':<36} {'before':>10} {'after':>10} {'speedup':>8}")
+
+    mismatches = []
+    for name, class_name, setup in DRIVERS:
+        module_after = importlib.import_module(f"bms.{name}")
+        battery_before, decoders_before = setup(drivers_before[name], Cell)
+        battery_after, decoders_after = setup(module_after, Cell)
+
+        for (label, decode_before), (_, decode_after) in zip(
+            decoders_before, decoders_after
+        ):
+            # compare the values of the first decode, since some values are smoothed
+            initial_before = decoded_values(battery_before)
+            initial_after = decoded_values(battery_after)
+            # the LLT/JBD driver prints the cells, when it creates them on the first decode
+            with contextlib.redirect_stdout(io.StringIO()):
+                result_before = decode_before()
+                result_after = decode_after()
+            values_before = decoded_values(battery_before)
+            values_after = decoded_values(battery_after)
+            # only the values, which were set by one of the decoders
+            differences = [
+                key
+                for key in values_before.keys() & values_after.keys()
+                if values_before[key] != values_after[key]
+                and (
+                    values_before[key] != initial_before.get(key)
+                    or values_after[key] != initial_after.get(key)
+                )
+            ]
+            if result_before != result_after or len(differences) > 0:
+                mismatches.append(f"{class_name} {label}: {sorted(differences)}")
+
+            time_before = (
+                min(timeit.repeat(decode_before, repeat=REPEAT, number=NUMBER))
+                / NUMBER
+                * 1e6
+            )
+            time_after = (
+                min(timeit.repeat(decode_after, repeat=REPEAT, number=NUMBER))
+                / NUMBER
+                * 1e6
+            )
+            print(
+                f"{class_name + ' ' + label:<36} {time_before:>7.1f} us {time_after:>7.1f} us "
+                + f"{time_before / time_after:>7.2f}x"
+            )
+
+    if len(mismatches) > 0:
+        for mismatch in mismatches:
+            print(f"ERROR: different values decoded by {mismatch}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
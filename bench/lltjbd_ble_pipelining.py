@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Latency of refresh_data() of the LLT/JBD BLE driver with and without pipelined commands.
+
+bleak is replaced by a fake BleakClient, which delays every command by the link delay, handles the commands
+one after another for the BMS time and delays the notifications of the reply again by the link delay,
+sent in chunks of 20 bytes. The general and the cell command are sent sequentially, as LltJbd does it,
+or pipelined, as LltJbd_Ble does it, where the cell command is sent without waiting for the general reply.
+The dbus-python and PyGObject modules are replaced by empty modules, if they are not installed.
+
+Fails, if the pipelined refresh is not faster than the sequential refresh.
+
+Usage: python3 bench/lltjbd_ble_pipelining.py [number of refreshes] [link delay in ms]
+"""
+
+import asyncio
+import importlib
+import io
+import logging
+import os
+import struct
+import sys
+import tempfile
+import types
+from time import monotonic
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+CELL_COUNT = 16
+BMS_TIME = 0.02
+CHUNK_SIZE = 20
+CHUNK_GAP = 0.0075
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class FakeBleakClient:
+    """
+    This class holds a fake BleakClient of a LLT/JBD BMS, which delays the commands and the notifications
+    """
+
+    link_delay = 0.03
+    checksum = None
+    payloads = {}
+
+    def __init__(self, device, disconnected_callback=None):
+        self.is_connected = False
+        self.notify_callback = None
+        # the BMS handles one command after another
+        self.busy_until = 0
+        self.writes = 0
+
+    async def connect(self) -> None:
+        self.is_connected = True
+
+    async def disconnect(self) -> None:
+        self.is_connected = False
+
+    async def start_notify(self, uuid, callback) -> None:
+        self.notify_callback = callback
+
+    async def write_gatt_char(self, uuid, data, response: bool = False) -> None:
+        self.writes += 1
+        loop = asyncio.get_event_loop()
+        start = max(loop.time() + self.link_delay, self.busy_until)
+        self.busy_until = start + BMS_TIME
+
+        # reads are answered with the payload of the register, writes with an empty payload
+        register = data[2]
+        payload = self.payloads.get(register, b"\x00\x00") if data[1] == 0xA5 else b""
+        reply = bytearray([0xDD, register, 0x00, len(payload)]) + payload
+        reply += struct.pack(">HB", self.checksum(reply[2:]), 0x77)
+
+        for index, position in enumerate(range(0, len(reply), CHUNK_SIZE)):
+            loop.call_at(
+                self.busy_until + self.link_delay + index * CHUNK_GAP,
+                self.notify,
+                reply[position : position + CHUNK_SIZE],
+            )
+
+    def notify(self, chunk: bytearray) -> None:
+        if self.notify_callback is not None:
+            self.notify_callback(0, bytearray(chunk))
+
+
+class FakeBleakScanner:
+    """
+    This class holds a fake BleakScanner, which finds every device
+    """
+
+    @staticmethod
+    async def find_device_by_address(address, cb=None):
+        return types.SimpleNamespace(address=address, name="JBD-FAKE")
+
+
+def median(values: list) -> float:
+    return sorted(values)[len(values) // 2]
+
+
+def main() -> int:
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    FakeBleakClient.link_delay = (
+        float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.03
+    )
+
+    # always the fake client, also if bleak is installed
+    sys.modules["bleak"] = types.ModuleType("bleak")
+    sys.modules["bleak"].__dict__.update(
+        BleakScanner=FakeBleakScanner,
+        BleakClient=FakeBleakClient,
+        BLEDevice=object,
+    )
+    sys.modules["bleak.exc"] = types.ModuleType("bleak.exc")
+    sys.modules["bleak.exc"].__dict__.update(
+        BleakDBusError=type("BleakDBusError", (Exception,), {})
+    )
+    stub(
+        "dbus",
+        bus=types.SimpleNamespace(BusConnection=object),
+        exceptions=types.SimpleNamespace(DBusException=Exception),
+    )
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+    stub("gi")
+    stub("gi.repository", GLib=None)
+
+    sys.path.insert(0, DRIVER_PATH)
+    import utils
+    import bms.lltjbd_ble as lltjbd_ble
+    from bms.lltjbd import LltJbd, checksum
+
+    utils.logger.setLevel(logging.ERROR)
+    # do not read or write the metadata cache of an installed driver
+    utils.PATH_METADATA_CACHE = os.path.join(tempfile.mkdtemp(), "metadata-cache.json")
+    # the driver starts hciattach, if it is not running
+    lltjbd_ble.os = types.SimpleNamespace(
+        path=types.SimpleNamespace(isfile=lambda path: True),
+        popen=lambda command: io.StringIO("/usr/bin/hciattach"),
+    )
+
+    general = struct.pack(
+        ">HhHHHHHHHBBBBBHH",
+        5320,
+        -1234,
+        10000,
+        28000,
+        12,
+        0x2A21,
+        0,
+        0,
+        0,
+        0x10,
+        55,
+        3,
+        CELL_COUNT,
+        2,
+        2981,
+        2990,
+    )
+    cells = struct.pack(">" + "H" * CELL_COUNT, *[3300 + c for c in range(CELL_COUNT)])
+    FakeBleakClient.checksum = staticmethod(checksum)
+    FakeBleakClient.payloads = {0x03: general, 0x04: cells, 0x05: b"JBD-FAKE"}
+
+    battery = lltjbd_ble.LltJbd_Ble(None, None, "AA:BB:CC:DD:EE:FF")
+    if not battery.test_connection():
+        print("ERROR: the fake BMS was not detected")
+        return 1
+    # read the cells on every refresh
+    battery.poll_scheduler.tasks["read_cell_data"].interval = 0
+
+    results = {}
+    for name, refresh in [
+        ("sequential", lambda: LltJbd.refresh_data(battery)),
+        ("pipelined", battery.refresh_data),
+    ]:
+        writes = battery.bt_client.writes
+        latencies = []
+        ok = True
+        for _ in range(refreshes):
+            start = monotonic()
+            ok = refresh() and ok
+            latencies.append((monotonic() - start) * 1000)
+        results[name] = (
+            ok,
+            median(latencies),
+            (battery.bt_client.writes - writes) / refreshes,
+        )
+
+    battery.run = False
+    battery.wake_session()
+
+    print(
+        f"{refreshes} refreshes, {FakeBleakClient.link_delay * 1000:.0f} ms link delay, "
+        + f"{BMS_TIME * 1000:.0f} ms BMS time per command"
+    )
+    for name, (ok, latency, writes) in results.items():
+        print(
+            f"{name + ':':<12} median {latency:.1f} ms per refresh, "
+            + f"{writes:.1f} commands per refresh"
+        )
+
+    if not all(ok for ok, _, _ in results.values()):
+        print("ERROR: the fake BMS was not read as expected")
+        return 1
+    if results["pipelined"][1] >= results["sequential"][1]:
+        print("ERROR: the pipelined refresh is not faster than the sequential refresh")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
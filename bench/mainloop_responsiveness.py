@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Main loop responsiveness of dbus-serialbattery, while a BMS stalls on every refresh.
+
+A fake battery blocks every refresh_data() call for the stall time, like a BMS that does not answer
+and runs into its serial timeouts. The batteries are refreshed by the RefreshWorker, as in the driver,
+while a timer in the main loop measures how late it is dispatched. A dbus setting write is made during
+a stalled refresh, it has to return immediately and is applied by the worker before the next refresh.
+
+Uses the GLib main loop, if PyGObject is installed, else a minimal main loop with the same interface.
+The dbus-python and velib_python modules are replaced by empty modules, if they are not installed.
+
+Fails, if the main loop was blocked longer than the allowed latency.
+
+Usage: python3 bench/mainloop_responsiveness.py [stall seconds] [allowed latency in ms]
+"""
+
+import heapq
+import importlib
+import os
+import sys
+import threading
+import types
+from time import monotonic, sleep
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+DURATION = 10.0
+POLL_INTERVAL = 1000
+TICK_INTERVAL = 10
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class MinimalMainLoop:
+    """
+    This class holds a minimal replacement of the GLib main loop, only used, if PyGObject is not installed
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.sources = []
+        self.counter = 0
+        self.running = False
+
+    def timeout_add(self, interval: int, callback, *args) -> None:
+        self.add(monotonic() + interval / 1000, interval, callback, args)
+
+    def idle_add(self, callback, *args) -> None:
+        self.add(monotonic(), None, callback, args)
+
+    def add(self, due: float, interval: int, callback, args: tuple) -> None:
+        with self.lock:
+            self.counter += 1
+            heapq.heappush(self.sources, (due, self.counter, interval, callback, args))
+        self.wakeup.set()
+
+    def run(self) -> None:
+        self.running = True
+        while self.running:
+            with self.lock:
+                due = self.sources[0][0] if len(self.sources) > 0 else None
+            if due is None or due > monotonic():
+                self.wakeup.wait(None if due is None else due - monotonic())
+                self.wakeup.clear()
+                continue
+
+            with self.lock:
+                due, _, interval, callback, args = heapq.heappop(self.sources)
+            if callback(*args) and interval is not None:
+                self.timeout_add(interval, callback, *args)
+
+    def quit(self) -> None:
+        self.running = False
+        self.wakeup.set()
+
+
+class StallingBattery:
+    """
+    This class holds a fake battery, which blocks on every refresh
+    """
+
+    def __init__(self, stall: float):
+        self.stall = stall
+        self.refreshes = 0
+        self.trigger_force_disable_charge = None
+        # thread, which called the setting callback
+        self.callback_thread = None
+
+    def refresh_data(self) -> bool:
+        self.refreshes += 1
+        sleep(self.stall)
+        return True
+
+    def force_charging_off_callback(self, path: str, value: int) -> bool:
+        self.callback_thread = threading.current_thread().name
+        self.trigger_force_disable_charge = value == 1
+        return True
+
+
+def main() -> int:
+    stall = float(sys.argv[1]) if len(sys.argv) > 1 else 3.0
+    allowed_latency = float(sys.argv[2]) if len(sys.argv) > 2 else 100.0
+
+    stub("dbus", bus=types.SimpleNamespace(BusConnection=object))
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+    stub("vedbus", VeDbusService=object)
+    stub("settingsdevice", SettingsDevice=object)
+    try:
+        from gi.repository import GLib
+
+        loop = GLib.MainLoop()
+        loop_name = "GLib main loop"
+    except ImportError:
+        GLib = loop = MinimalMainLoop()
+        loop_name = "minimal main loop, PyGObject is not installed"
+        stub("gi")
+        stub("gi.repository", GLib=GLib)
+
+    sys.path.insert(0, DRIVER_PATH)
+    import dbushelper
+
+    # only the parts of the DbusHelper, which are used by the RefreshWorker and the setting writes
+    battery = StallingBattery(stall)
+    helper = dbushelper.DbusHelper.__new__(dbushelper.DbusHelper)
+    helper.battery = battery
+    helper.setting_writes = []
+    helper.setting_writes_lock = threading.Lock()
+    helper._dbusservice = {"/Io/ForceChargingOff": 0}
+    published = []
+    helper.failed = False
+    helper.publish_refresh_result = lambda result: published.append(result)
+
+    refresh_worker = dbushelper.RefreshWorker([helper], loop)
+    latencies = []
+    callback_times = []
+    start = monotonic()
+
+    def tick(due: float) -> bool:
+        now = monotonic()
+        latencies.append((now - due) * 1000)
+        if now - start >= DURATION:
+            loop.quit()
+            return False
+        GLib.timeout_add(TICK_INTERVAL, tick, now + TICK_INTERVAL / 1000)
+        return False
+
+    polls = []
+
+    def poll_battery() -> bool:
+        polls.append(refresh_worker.request_refresh(helper))
+        return True
+
+    def write_setting() -> bool:
+        onchangecallback = helper.queue_setting_write("force_charging_off_callback")
+        callback_start = monotonic()
+        onchangecallback("/Io/ForceChargingOff", 1)
+        callback_times.append((monotonic() - callback_start) * 1000)
+        return False
+
+    GLib.timeout_add(TICK_INTERVAL, tick, start + TICK_INTERVAL / 1000)
+    GLib.timeout_add(POLL_INTERVAL, poll_battery)
+    # during the first stalled refresh
+    GLib.timeout_add(POLL_INTERVAL + 500, write_setting)
+    poll_battery()
+    loop.run()
+
+    latencies.sort()
+    max_latency = latencies[-1]
+    print(f"{loop_name}, battery stalls {stall:.1f} s on every refresh")
+    print(
+        f"timer latency: median {latencies[len(latencies) // 2]:.1f} ms, "
+        + f"99th percentile {latencies[int(len(latencies) * 0.99)]:.1f} ms, max {max_latency:.1f} ms"
+    )
+    print(
+        f"refreshes: {battery.refreshes} started, {len(published)} published, "
+        + f"{polls.count(False)} of {len(polls)} polls skipped, since the refresh was still running"
+    )
+    print(
+        f"setting write: returned after {callback_times[0]:.2f} ms, "
+        + f"applied by thread {battery.callback_thread}"
+    )
+
+    if max_latency > allowed_latency:
+        print(f"ERROR: the main loop was blocked for {max_latency:.0f} ms")
+        return 1
+    if battery.callback_thread != refresh_worker.thread.name:
+        print("ERROR: the setting write was not applied by the RefreshWorker")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Latency of the serial reply reader against a fake BMS on a pty loopback.
+
+The fake BMS replays recorded LLT/JBD frames on the master side of a pty. Each reply starts after
+a response delay and is written in chunks, paced with the wire time of the chunk at the baud rate,
+like a USB-serial adapter delivers it. The overhead of a command is its latency minus the response
+delay and the wire time of the frame, so a reader which wakes up as soon as the last byte arrives
+has an overhead close to zero.
+The select() based read_serialport_data() is compared with the sleep polling reader it replaced.
+The dbus-python module is replaced by an empty module, if it is not installed.
+
+Fails, if the median overhead of read_serialport_data() is higher than allowed.
+
+Usage: python3 bench/serial_reader_latency.py [number of commands] [allowed overhead in ms]
+"""
+
+import importlib
+import logging
+import os
+import pty
+import struct
+import sys
+import threading
+import tty
+import types
+from struct import unpack_from
+from time import monotonic, sleep
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+BAUD_RATE = 9600
+RESPONSE_DELAY = 0.01
+CHUNK_SIZE = 16
+LENGTH_POS = 3
+LENGTH_CHECK = 6
+
+# recorded LLT/JBD replies to the general (0x03), cell (0x04) and hardware (0x05) commands
+FRAMES = {
+    0x03: bytes.fromhex(
+        "dd03001b14c8fb2e27106d60000c2a2100000000000010370310020ba50baefac077"
+    ),
+    0x04: bytes.fromhex(
+        "dd0400200ce40ce50ce60ce70ce80ce90cea0ceb0cec0ced0cee0cef0cf00cf1"
+        + "0cf20cf3f06877"
+    ),
+    0x05: bytes.fromhex("dd0500084a42442d54455354fdbb77"),
+}
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class FakeBms:
+    """
+    This class holds a fake BMS, which replays recorded frames on the master side of a pty
+    """
+
+    def __init__(self, wire_time):
+        self.wire_time = wire_time
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+
+        threading.Thread(target=self.answer, daemon=True).start()
+
+    def answer(self) -> None:
+        while True:
+            command = os.read(self.master, 64)
+            frame = FRAMES[command[2]]
+            sleep(RESPONSE_DELAY)
+            for start in range(0, len(frame), CHUNK_SIZE):
+                chunk = frame[start : start + CHUNK_SIZE]
+                sleep(self.wire_time(len(chunk), BAUD_RATE))
+                os.write(self.master, chunk)
+
+
+def read_serialport_data_polling(ser, command, length_pos, length_check):
+    """
+    The previous reader, which polled the input buffer with 5 ms sleeps.
+    The body is read with more bytes than missing, so it also waits for the port timeout.
+    """
+    ser.flushOutput()
+    ser.flushInput()
+    ser.write(command)
+
+    count = 0
+    toread = ser.inWaiting()
+    while toread < length_pos + 1:
+        sleep(0.005)
+        toread = ser.inWaiting()
+        count += 1
+        if count > 50:
+            return False
+
+    res = ser.read(toread)
+    length = unpack_from(">B", res, length_pos)[0]
+
+    count = 0
+    data = bytearray(res)
+    while len(data) <= length + length_check:
+        res = ser.read(length + length_check)
+        data.extend(res)
+        sleep(0.005)
+        count += 1
+        if count > 150:
+            return False
+
+    return data
+
+
+def measure(reader, ser, commands: int, wire_time) -> list:
+    """
+    Return the overhead of every command in milliseconds, None for a wrong reply
+    """
+    overheads = []
+    registers = list(FRAMES)
+    for index in range(commands):
+        register = registers[index % len(registers)]
+        command = bytes([0xDD, 0xA5, register, 0x00, 0xFF, 0x100 - register, 0x77])
+        start = monotonic()
+        data = reader(ser, command, LENGTH_POS, LENGTH_CHECK)
+        latency = monotonic() - start
+        if data is False or bytes(data) != FRAMES[register]:
+            overheads.append(None)
+            continue
+        expected = RESPONSE_DELAY + wire_time(len(FRAMES[register]), BAUD_RATE)
+        overheads.append((latency - expected) * 1000)
+    return overheads
+
+
+def summary(overheads: list) -> str:
+    values = sorted(overhead for overhead in overheads if overhead is not None)
+    return (
+        f"overhead median {values[len(values) // 2]:.2f} ms, "
+        + f"95th percentile {values[int(len(values) * 0.95)]:.2f} ms, "
+        + f"{overheads.count(None)} wrong replies"
+    )
+
+
+def main() -> int:
+    commands = int(sys.argv[1]) if len(sys.argv) > 1 else 60
+    allowed_overhead = float(sys.argv[2]) if len(sys.argv) > 2 else 2.0
+
+    stub("dbus", bus=types.SimpleNamespace(BusConnection=object))
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+
+    sys.path.insert(0, DRIVER_PATH)
+    import utils
+    from bms.lltjbd import checksum
+
+    utils.logger.setLevel(logging.WARNING)
+
+    # the recorded frames have to be valid, else the comparison is meaningless
+    for frame in FRAMES.values():
+        if struct.unpack_from(">H", frame, len(frame) - 3)[0] != checksum(frame[2:-3]):
+            print("ERROR: a recorded frame has an invalid checksum")
+            return 1
+
+    bms = FakeBms(utils.serial_wire_time)
+    with utils.borrow_serial_port(bms.port, BAUD_RATE) as ser:
+        select_overheads = measure(
+            utils.read_serialport_data, ser, commands, utils.serial_wire_time
+        )
+        polling_overheads = measure(
+            read_serialport_data_polling, ser, commands, utils.serial_wire_time
+        )
+    utils.close_serial_sessions(bms.port)
+
+    print(
+        f"{commands} commands at {BAUD_RATE} baud, "
+        + f"{RESPONSE_DELAY * 1000:.0f} ms response delay, {CHUNK_SIZE} byte chunks"
+    )
+    print(f"select() reader:  {summary(select_overheads)}")
+    print(f"polling reader:   {summary(polling_overheads)}")
+
+    if None in select_overheads:
+        print("ERROR: read_serialport_data() returned wrong replies")
+        return 1
+    median = sorted(select_overheads)[len(select_overheads) // 2]
+    if median > allowed_overhead:
+        print(
+            f"ERROR: {median:.2f} ms median overhead, allowed are {allowed_overhead:.2f} ms"
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Serial port opens per refresh_data() of the LLT/JBD driver against a fake BMS on a pty pair.
+
+The fake BMS answers every command on the master side of the pty with a recorded LLT/JBD frame,
+while the driver reads the slave side through its serial sessions, as it does on a real port.
+The refreshes are run once with the long-lived serial sessions and once with sessions, which are
+closed before every command, like the driver did before, when each command opened the port.
+The dbus-python module is replaced by an empty module, if it is not installed.
+
+Fails, if the serial sessions opened the port more than once.
+
+Usage: python3 bench/serial_session_opens.py [number of refreshes]
+"""
+
+import importlib
+import logging
+import os
+import pty
+import struct
+import sys
+import tempfile
+import threading
+import tty
+import types
+from time import monotonic
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+CELL_COUNT = 16
+
+
+def stub(name: str, **attributes) -> None:
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+
+class FakeLltJbd:
+    """
+    This class holds a fake LLT/JBD BMS, which answers the commands on the master side of a pty
+    """
+
+    def __init__(self, checksum):
+        self.checksum = checksum
+        self.master, self.slave = pty.openpty()
+        tty.setraw(self.slave)
+        self.port = os.ttyname(self.slave)
+        self.commands = 0
+
+        general = struct.pack(
+            ">HhHHHHHHHBBBBBHH",
+            5320,
+            -1234,
+            10000,
+            28000,
+            12,
+            0x2A21,
+            0,
+            0,
+            0,
+            0x10,
+            55,
+            3,
+            CELL_COUNT,
+            2,
+            2981,
+            2990,
+        )
+        cells = struct.pack(
+            ">" + "H" * CELL_COUNT, *[3300 + c for c in range(CELL_COUNT)]
+        )
+        self.payloads = {0x03: general, 0x04: cells, 0x05: b"JBD-FAKE"}
+
+        threading.Thread(target=self.answer, daemon=True).start()
+
+    def reply(self, register: int, payload: bytes) -> bytes:
+        frame = bytearray([0xDD, register, 0x00, len(payload)]) + payload
+        return bytes(frame + struct.pack(">HB", self.checksum(frame[2:]), 0x77))
+
+    def answer(self) -> None:
+        buffer = bytearray()
+        while True:
+            buffer += os.read(self.master, 64)
+            # command: 0xDD, operation, register, length, data, checksum, 0x77
+            while len(buffer) >= 4 and len(buffer) >= buffer[3] + 7:
+                operation, register, length = buffer[1], buffer[2], buffer[3]
+                del buffer[: length + 7]
+                self.commands += 1
+                if operation == 0xA5:
+                    payload = self.payloads.get(register, b"\x00\x00")
+                else:
+                    payload = b""
+                os.write(self.master, self.reply(register, payload))
+
+
+def run_refreshes(battery, bms: FakeLltJbd, utils, refreshes: int) -> tuple:
+    session = utils.serial_sessions[bms.port]
+    opens = session.open_count
+    commands = bms.commands
+    start = monotonic()
+    results = [battery.refresh_data() for _ in range(refreshes)]
+    duration = (monotonic() - start) / refreshes * 1000
+    return (
+        all(results),
+        (session.open_count - opens) / refreshes,
+        (bms.commands - commands) / refreshes,
+        duration,
+    )
+
+
+def main() -> int:
+    refreshes = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    stub("dbus", bus=types.SimpleNamespace(BusConnection=object))
+    stub("dbus.mainloop")
+    stub("dbus.mainloop.glib", DBusGMainLoop=None)
+
+    sys.path.insert(0, DRIVER_PATH)
+    import utils
+    from bms.lltjbd import LltJbd, checksum
+
+    utils.logger.setLevel(logging.WARNING)
+    # do not read or write the metadata cache of an installed driver
+    utils.PATH_METADATA_CACHE = os.path.join(tempfile.mkdtemp(), "metadata-cache.json")
+
+    bms = FakeLltJbd(checksum)
+    battery = LltJbd(bms.port, 9600, b"\x00")
+    if not battery.test_connection():
+        print("ERROR: the fake BMS was not detected")
+        return 1
+    # read the cells on every refresh
+    battery.poll_scheduler.tasks["read_cell_data"].interval = 0
+
+    session_opens_start = utils.serial_sessions[bms.port].open_count
+    ok_sessions, opens_sessions, commands, time_sessions = run_refreshes(
+        battery, bms, utils, refreshes
+    )
+    session_opens = utils.serial_sessions[bms.port].open_count
+
+    # a negative idle time closes the session before every command
+    idle_close = utils.SERIAL_SESSION_IDLE_CLOSE
+    utils.SERIAL_SESSION_IDLE_CLOSE = -1
+    ok_reopen, opens_reopen, _, time_reopen = run_refreshes(
+        battery, bms, utils, refreshes
+    )
+    utils.SERIAL_SESSION_IDLE_CLOSE = idle_close
+    utils.close_serial_sessions(bms.port)
+
+    print(f"{refreshes} refreshes of the LLT/JBD driver, {commands:.1f} commands each")
+    print(
+        f"serial sessions:   {opens_sessions:.2f} opens per refresh, "
+        + f"{time_sessions:.1f} ms per refresh, "
+        + f"{session_opens} opens since the start (detection included)"
+    )
+    print(
+        f"open per command:  {opens_reopen:.2f} opens per refresh, "
+        + f"{time_reopen:.1f} ms per refresh"
+    )
+
+    if not ok_sessions or not ok_reopen:
+        print("ERROR: the fake BMS was not read as expected")
+        return 1
+    if session_opens > 1 or session_opens_start > 1:
+        print(f"ERROR: the serial sessions opened the port {session_opens} times")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Startup benchmark of dbus-serialbattery: import time and RSS of the entry script and of each BMS driver module.
+
+Every measurement runs in a fresh interpreter. The system bindings dbus-python and PyGObject and the
+velib_python modules are replaced by empty modules, if they are not installed, since only the import
+cost of the driver itself is measured.
+
+Fails, if loading the entry script imports a BMS driver module, since they have to be imported
+only when their BMS type is tested.
+
+Usage: python3 bench/startup_benchmark.py
+"""
+
+import json
+import os
+import subprocess
+import sys
+
+DRIVER_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "..", "etc", "dbus-serialbattery"
+)
+
+# executed in the fresh interpreter, prints the result as JSON
+MEASURE = """
+import importlib, importlib.util, json, os, resource, sys, time, types
+
+def rss_kb():
+    # current RSS on Linux, else the peak RSS
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def stub(name, **attributes):
+    try:
+        importlib.import_module(name)
+    except ImportError:
+        module = types.ModuleType(name)
+        module.__dict__.update(attributes)
+        sys.modules[name] = module
+
+stub("dbus", bus=types.SimpleNamespace(BusConnection=object))
+stub("dbus.mainloop")
+stub("dbus.mainloop.glib", DBusGMainLoop=None)
+stub("gi")
+stub("gi.repository", GLib=None)
+stub("vedbus", VeDbusService=object)
+stub("settingsdevice", SettingsDevice=object)
+
+sys.path.insert(0, {path!r})
+rss_start = rss_kb()
+time_start = time.perf_counter()
+
+spec = importlib.util.spec_from_file_location("entry", {path!r} + "/dbus-serialbattery.py")
+entry = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(entry)
+time_entry = time.perf_counter()
+rss_entry = rss_kb()
+
+module = {module!r}
+if module is not None:
+    importlib.import_module(module)
+
+print(json.dumps({{
+    "entry_ms": (time_entry - time_start) * 1000,
+    "entry_rss_kb": rss_entry,
+    "entry_rss_delta_kb": rss_entry - rss_start,
+    "module_ms": (time.perf_counter() - time_entry) * 1000,
+    "module_rss_delta_kb": rss_kb() - rss_entry,
+    "bms_modules": sorted(name for name in sys.modules if name.startswith("bms.")) if module is None else [],
+    "modules": sorted(set(test["module"] for test in entry.supported_bms_types)),
+}}))
+"""
+
+
+def measure(module: str = None) -> dict:
+    code = MEASURE.format(path=os.path.abspath(DRIVER_PATH), module=module)
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=DRIVER_PATH,
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        universal_newlines=True,
+    ).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def main() -> int:
+    entry = measure()
+    print(
+        f"entry script: {entry['entry_ms']:.0f} ms, RSS {entry['entry_rss_kb'] / 1024:.1f} MB"
+        + f" (+{entry['entry_rss_delta_kb'] / 1024:.1f} MB for the imports)"
+    )
+
+    print("driver modules, imported only when their BMS type is tested:")
+    for module in entry["modules"]:
+        result = measure(module)
+        print(
+            f"  {module:20} {result['module_ms']:6.0f} ms, +{result['module_rss_delta_kb']} kB RSS"
+        )
+
+    if len(entry["bms_modules"]) > 0:
+        print("ERROR: the entry script imports " + ", ".join(entry["bms_modules"]))
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
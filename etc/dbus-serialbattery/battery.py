@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
-from typing import Union, Tuple, List, Callable
+from typing import Union, Tuple, List, Callable, Dict
 
 from utils import logger
 import utils
 import logging
 import math
+from array import array
+from collections import deque
 from time import time
 from abc import ABC, abstractmethod
 import sys
@@ -49,6 +51,277 @@ class Cell:
         self.balance = balance
 
 
+class CellBank:
+    """
+    This class holds the cell voltages and balancing states of one refresh in compact arrays and the values
+    calculated from them. It's created once per refresh by Battery.get_cell_bank(), so that all consumers
+    of a poll share one pass over the cells, instead of walking the list of cells again and again.
+    """
+
+    def __init__(self, cells: List[Cell], cell_count: int):
+        count = len(cells) if cell_count is None else min(len(cells), cell_count)
+
+        # missing voltages are stored as NaN, which is ignored by all comparisons
+        self.voltages: array = array("d")
+        self.balance_mask: int = 0
+        self.voltage_sum: float = 0
+        self.min_voltage: float = None
+        self.max_voltage: float = None
+        self.min_cell: int = None
+        self.max_cell: int = None
+
+        for index in range(count):
+            cell = cells[index]
+            voltage = cell.voltage
+            if cell.balance:
+                self.balance_mask |= 1 << index
+
+            if voltage is None:
+                self.voltages.append(math.nan)
+                continue
+
+            self.voltages.append(voltage)
+            self.voltage_sum += voltage
+            # keep the first cell, if multiple cells have the same voltage
+            if self.min_voltage is None or voltage < self.min_voltage:
+                self.min_voltage = voltage
+                self.min_cell = index
+            if self.max_voltage is None or voltage > self.max_voltage:
+                self.max_voltage = voltage
+                self.max_cell = index
+
+    def get_voltage_sum(self, start: int = 0, end: int = None) -> float:
+        return sum(
+            voltage for voltage in self.voltages[start:end] if not math.isnan(voltage)
+        )
+
+
+class CurrentStats:
+    """
+    This class holds the statistics of the last currents in a ring buffer of fixed size.
+    Each sample updates the running sums, the EWMA and the min/max in (amortized) O(1), so that the
+    average does not have to be recalculated over the whole window on every poll.
+    """
+
+    def __init__(self, window: int, ewma_time_constant: float):
+        self.window: int = max(1, window)
+        self.ewma_time_constant: float = ewma_time_constant
+        self.values: array = array("d", [0.0] * self.window)
+        # time in seconds represented by each sample, which is the time since the previous sample
+        self.weights: array = array("d", [0.0] * self.window)
+        # sequence numbers of the samples, which are candidates for the min/max of the window
+        self.min_candidates: deque = deque()
+        self.max_candidates: deque = deque()
+        self.reset()
+
+    def reset(self) -> None:
+        self.count: int = 0
+        self.sequence: int = 0
+        self.sum: float = 0
+        self.weighted_sum: float = 0
+        self.weight_sum: float = 0
+        self.ewma: float = None
+        self.last_timestamp: float = None
+        self.min_candidates.clear()
+        self.max_candidates.clear()
+
+    def add(self, value: float, timestamp: float = None) -> None:
+        if timestamp is None:
+            timestamp = time()
+
+        weight = (
+            max(0, timestamp - self.last_timestamp)
+            if self.last_timestamp is not None
+            else 0
+        )
+        index = self.sequence % self.window
+
+        # remove the oldest sample, if the window is full
+        if self.count == self.window:
+            self.sum -= self.values[index]
+            self.weighted_sum -= self.values[index] * self.weights[index]
+            self.weight_sum -= self.weights[index]
+        else:
+            self.count += 1
+
+        self.values[index] = value
+        self.weights[index] = weight
+        self.sum += value
+        self.weighted_sum += value * weight
+        self.weight_sum += weight
+
+        # recalculate the sums once per window, so that rounding errors do not add up
+        if index == self.window - 1:
+            self.sum = sum(self.values[: self.count])
+            self.weighted_sum = sum(
+                v * w
+                for v, w in zip(self.values[: self.count], self.weights[: self.count])
+            )
+            self.weight_sum = sum(self.weights[: self.count])
+
+        if self.ewma is None or self.ewma_time_constant <= 0:
+            self.ewma = value
+        else:
+            alpha = 1 - math.exp(-weight / self.ewma_time_constant)
+            self.ewma += alpha * (value - self.ewma)
+
+        # keep the candidates for the min/max sorted, the first one is the min/max of the window
+        oldest = self.sequence - self.window
+        while self.min_candidates and self.min_candidates[0] <= oldest:
+            self.min_candidates.popleft()
+        while (
+            self.min_candidates
+            and self.values[self.min_candidates[-1] % self.window] >= value
+        ):
+            self.min_candidates.pop()
+        self.min_candidates.append(self.sequence)
+
+        while self.max_candidates and self.max_candidates[0] <= oldest:
+            self.max_candidates.popleft()
+        while (
+            self.max_candidates
+            and self.values[self.max_candidates[-1] % self.window] <= value
+        ):
+            self.max_candidates.pop()
+        self.max_candidates.append(self.sequence)
+
+        self.last_timestamp = timestamp
+        self.sequence += 1
+
+    def get_mean(self) -> Union[float, None]:
+        return self.sum / self.count if self.count > 0 else None
+
+    def get_time_weighted_mean(self) -> Union[float, None]:
+        """
+        Get the mean weighted by the time each sample represents.
+        Falls back to the arithmetic mean, as long as there is no time span.
+        """
+        if self.weight_sum <= 0:
+            return self.get_mean()
+        return self.weighted_sum / self.weight_sum
+
+    def get_min(self) -> Union[float, None]:
+        if not self.min_candidates:
+            return None
+        return self.values[self.min_candidates[0] % self.window]
+
+    def get_max(self) -> Union[float, None]:
+        if not self.max_candidates:
+            return None
+        return self.values[self.max_candidates[0] % self.window]
+
+
+class PollTask:
+    """
+    This class holds a single reader or writer of a driver, which is executed by the PollScheduler
+    """
+
+    def __init__(
+        self,
+        name: str,
+        reader: Callable[..., bool],
+        interval: float,
+        depends_on: List[str],
+        ignore_result: bool,
+    ):
+        self.name: str = name
+        self.reader: Callable[..., bool] = reader
+        self.interval: float = interval
+        self.depends_on: List[str] = depends_on
+        self.ignore_result: bool = ignore_result
+        self.last_success: float = None
+        self.result: bool = None
+
+
+class PollScheduler:
+    """
+    This class executes the readers of a driver with individual refresh periods.
+    Volatile values like current and SoC can be read on every poll, while slowly changing
+    values like alarms or the balancing state are read less often. This keeps a poll cycle
+    short on slow connections, so that it does not overrun the poll interval.
+    """
+
+    def __init__(self, log_runtime_above: float = None):
+        self.tasks: Dict[str, PollTask] = {}
+        # log tasks which took longer than this seconds, for troubleshooting
+        self.log_runtime_above: float = log_runtime_above
+
+    def add(
+        self,
+        name: str,
+        reader: Callable[..., bool],
+        interval: float = 0,
+        depends_on: List[str] = None,
+        ignore_result: bool = False,
+    ) -> None:
+        """
+        Add a task. Tasks are executed in the order they were added.
+
+        :param name: the name of the task
+        :param reader: the function to execute, it has to return True on success
+        :param interval: seconds between two successful executions, 0 to execute it on every poll
+            and None to execute it only until it succeeded once, e.g. for static values
+        :param depends_on: names of tasks, which have to succeed before this task is executed
+        :param ignore_result: the result does not affect the result of the poll, e.g. for write commands
+        """
+        depends_on = depends_on if depends_on is not None else []
+        for dependency in depends_on:
+            if dependency not in self.tasks:
+                raise ValueError(
+                    f'Task "{name}" depends on "{dependency}", which has to be added first'
+                )
+        self.tasks[name] = PollTask(name, reader, interval, depends_on, ignore_result)
+
+    def reset(self) -> None:
+        """
+        Execute all tasks again on the next poll, e.g. after the battery was offline
+        """
+        for task in self.tasks.values():
+            task.last_success = None
+            task.result = None
+
+    def is_due(self, task: PollTask, now: float) -> bool:
+        # failed tasks are repeated on the next poll
+        if task.last_success is None or not task.result:
+            return True
+        if task.interval is None:
+            return False
+        return now - task.last_success >= task.interval
+
+    def run(self, *args) -> bool:
+        """
+        Execute all tasks which are due. The arguments are passed to every task.
+
+        :return: false if a due task failed, true if successful
+        """
+        result = True
+        now = time()
+        for task in self.tasks.values():
+            if not self.is_due(task, now):
+                continue
+
+            # skip the task, if a dependency did not succeed yet
+            if not all(self.tasks[dependency].result for dependency in task.depends_on):
+                continue
+
+            time_start = time()
+            task.result = bool(task.reader(*args))
+            runtime = time() - time_start
+
+            if task.result:
+                task.last_success = now
+            elif not task.ignore_result:
+                result = False
+
+            if self.log_runtime_above is not None and runtime > self.log_runtime_above:
+                logger.info(
+                    f"  |- refresh_data: {task.name} - result: {task.result}"
+                    + f" - runtime: {runtime:.1f}s"
+                )
+
+        return result
+
+
 class Battery(ABC):
     """
     This Class is the abstract baseclass for all batteries. For each BMS this class needs to be extended
@@ -90,6 +363,18 @@ class Battery(ABC):
         # only if available
         self.custom_field: str = None
 
+        # drivers which read their data with multiple commands can add them here with individual
+        # refresh periods (utils.POLL_INTERVAL_*) and execute the due ones in refresh_data()
+        self.poll_scheduler: PollScheduler = PollScheduler()
+
+        # names of the attributes, which hold static data of the BMS like the capacity or the serial number
+        # drivers which read them with slow commands can cache them between restarts, see load_metadata()
+        self.metadata_attributes: List[str] = []
+        self.metadata_saved: dict = None
+
+        # link state of BLE batteries (bms.ble_link_monitor.BleLinkState), which is published on the dbus
+        self.ble_link = None
+
         self.init_values()
 
     def init_values(self):
@@ -99,7 +384,9 @@ class Battery(ABC):
         self.voltage: float = None
         self.current: float = None
         self.current_avg: float = None
-        self.current_avg_lst: list = []
+        self.current_stats: CurrentStats = CurrentStats(
+            utils.CURRENT_STATS_WINDOW, utils.CURRENT_STATS_EWMA_TIME_CONSTANT
+        )
         self.current_corrected: float = None
         self.capacity_remain: float = None
         self.capacity: float = None
@@ -116,6 +403,8 @@ class Battery(ABC):
         self.temp4: float = None
         self.temp_mos: float = None
         self.cells: List[Cell] = []
+        # snapshot of the cells, created on first use after each refresh
+        self.cell_bank: CellBank = None
         self.control_voltage: float = None
         self.soc_reset_requested: bool = False
         self.soc_reset_last_reached: int = 0  # save state to preserve on restart
@@ -134,6 +423,8 @@ class Battery(ABC):
         self.linear_dcl_last_set: int = 0
         # list of available callbacks, in order to display the buttons in the GUI
         self.available_callbacks: List[str] = []
+        # read all values again, since they were reset
+        self.poll_scheduler.reset()
 
     @abstractmethod
     def test_connection(self) -> bool:
@@ -161,6 +452,59 @@ class Battery(ABC):
         string += str(self.capacity) + "Ah"
         return string
 
+    def get_metadata_cache_key(self) -> str:
+        """
+        Used to identify the BMS in the metadata cache.
+        The unique identifier can't be used, since it's usually built from the cached values.
+        """
+        address = getattr(self, "address", None)
+        return (
+            utils.get_port_identity(self.port)
+            + "_"
+            + self.type
+            + (
+                "_" + (address.hex() if isinstance(address, bytes) else str(address))
+                if address is not None
+                else ""
+            )
+        )
+
+    def load_metadata(self) -> bool:
+        """
+        Load the static data of the BMS listed in metadata_attributes from the cache.
+        If successful, the driver should read the values again in the background to update the cache,
+        e.g. with a PollScheduler task with interval None.
+
+        :return: true if all values were loaded from the cache
+        """
+        values = utils.get_metadata_cache(self.get_metadata_cache_key())
+        if values is None or not all(
+            name in values for name in self.metadata_attributes
+        ):
+            return False
+
+        for name in self.metadata_attributes:
+            setattr(self, name, values[name])
+        self.metadata_saved = values
+
+        logger.info("Static BMS data loaded from cache, it's revalidated on next polls")
+        return True
+
+    def save_metadata(self) -> None:
+        """
+        Save the static data of the BMS listed in metadata_attributes to the cache, if it changed
+        """
+        values = {name: getattr(self, name) for name in self.metadata_attributes}
+        if values == self.metadata_saved:
+            return
+
+        if self.metadata_saved is not None:
+            logger.info(
+                f"Static BMS data changed from {self.metadata_saved} to {values}"
+            )
+        utils.save_metadata_cache(self.get_metadata_cache_key(), values)
+        self.metadata_saved = values
+
     def connection_name(self) -> str:
         return "Serial " + self.port
 
@@ -246,24 +590,16 @@ class Battery(ABC):
 
     def soc_calculation(self) -> None:
         current_time = time()
-        voltage_sum = 0
         self.current_corrected = 0
         current_min_cell_voltage = self.get_min_cell_voltage()
 
         # calculate battery voltage from cell voltages
-        for i in range(self.cell_count):
-            voltage = self.get_cell_voltage(i)
-            if voltage:
-                voltage_sum += voltage
+        voltage_sum = self.get_cell_bank().voltage_sum
 
         if self.soc_calc_capacity_remain is not None:
             # calculate real current
             self.current_corrected = round(
-                utils.calcLinearRelationship(
-                    self.current,
-                    utils.SOC_CALC_CURRENT_REPORTED_BY_BMS,
-                    utils.SOC_CALC_CURRENT_MEASURED_BY_USER,
-                ),
+                utils.SOC_CALC_CURRENT_CURVE.linear(self.current),
                 2,
             )
 
@@ -406,7 +742,6 @@ class Battery(ABC):
         :return: None
         """
         found_high_cell_voltage = False
-        voltage_sum = 0
         penalty_sum = 0
         time_diff = 0
         control_voltage = 0
@@ -417,26 +752,24 @@ class Battery(ABC):
 
         try:
             # calculate battery sum and check for cell overvoltage
-            for i in range(self.cell_count):
-                voltage = self.get_cell_voltage(i)
-                if voltage:
-                    voltage_sum += voltage
-
-                    # calculate penalty sum to prevent single cell overcharge by using current cell voltage
-                    if (
-                        self.max_battery_voltage != self.soc_reset_battery_voltage
-                        and voltage > utils.MAX_CELL_VOLTAGE
-                    ):
-                        # found_high_cell_voltage: reset to False is not needed, since it is recalculated every second
-                        found_high_cell_voltage = True
-                        penalty_sum += voltage - utils.MAX_CELL_VOLTAGE
-                    elif (
-                        self.max_battery_voltage == self.soc_reset_battery_voltage
-                        and voltage > utils.SOC_RESET_VOLTAGE
-                    ):
+            cell_bank = self.get_cell_bank()
+            voltage_sum = cell_bank.voltage_sum
+
+            # calculate penalty sum to prevent single cell overcharge by using current cell voltage
+            cell_voltage_limit = (
+                utils.MAX_CELL_VOLTAGE
+                if self.max_battery_voltage != self.soc_reset_battery_voltage
+                else utils.SOC_RESET_VOLTAGE
+            )
+            if (
+                cell_bank.max_voltage is not None
+                and cell_bank.max_voltage > cell_voltage_limit
+            ):
+                for voltage in cell_bank.voltages:
+                    if voltage > cell_voltage_limit:
                         # found_high_cell_voltage: reset to False is not needed, since it is recalculated every second
                         found_high_cell_voltage = True
-                        penalty_sum += voltage - utils.SOC_RESET_VOLTAGE
+                        penalty_sum += voltage - cell_voltage_limit
 
             voltageDiff = self.get_max_cell_voltage() - self.get_min_cell_voltage()
 
@@ -681,16 +1014,12 @@ class Battery(ABC):
         manages the charge voltage using a step function by setting self.control_voltage
         :return: None
         """
-        voltage_sum = 0
         time_diff = 0
         current_time = int(time())
 
         try:
             # calculate battery sum
-            for i in range(self.cell_count):
-                voltage = self.get_cell_voltage(i)
-                if voltage:
-                    voltage_sum += voltage
+            voltage_sum = self.get_cell_bank().voltage_sum
 
             if self.max_voltage_start_time is None:
                 # check if max voltage is reached and start timer to keep max voltage
@@ -934,16 +1263,9 @@ class Battery(ABC):
     def calcMaxChargeCurrentReferringToCellVoltage(self) -> float:
         try:
             if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.get_max_cell_voltage(),
-                    utils.CELL_VOLTAGES_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_CV,
-                )
-            return utils.calcStepRelationship(
-                self.get_max_cell_voltage(),
-                utils.CELL_VOLTAGES_WHILE_CHARGING,
-                utils.MAX_CHARGE_CURRENT_CV,
-                False,
+                return utils.CHARGE_CURRENT_CV_CURVE.linear(self.get_max_cell_voltage())
+            return utils.CHARGE_CURRENT_CV_CURVE.step(
+                self.get_max_cell_voltage(), False
             )
         except Exception:
             logger.warning(
@@ -965,16 +1287,11 @@ class Battery(ABC):
     def calcMaxDischargeCurrentReferringToCellVoltage(self) -> float:
         try:
             if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.get_min_cell_voltage(),
-                    utils.CELL_VOLTAGES_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_CV,
+                return utils.DISCHARGE_CURRENT_CV_CURVE.linear(
+                    self.get_min_cell_voltage()
                 )
-            return utils.calcStepRelationship(
-                self.get_min_cell_voltage(),
-                utils.CELL_VOLTAGES_WHILE_DISCHARGING,
-                utils.MAX_DISCHARGE_CURRENT_CV,
-                True,
+            return utils.DISCHARGE_CURRENT_CV_CURVE.step(
+                self.get_min_cell_voltage(), True
             )
         except Exception:
             logger.warning(
@@ -1001,17 +1318,10 @@ class Battery(ABC):
 
         for key, currentMaxTemperature in temps.items():
             if utils.LINEAR_LIMITATION_ENABLE:
-                temps[key] = utils.calcLinearRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURES_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_T,
-                )
+                temps[key] = utils.CHARGE_CURRENT_T_CURVE.linear(currentMaxTemperature)
             else:
-                temps[key] = utils.calcStepRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURES_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_T,
-                    False,
+                temps[key] = utils.CHARGE_CURRENT_T_CURVE.step(
+                    currentMaxTemperature, False
                 )
 
         return min(temps[0], temps[1])
@@ -1024,17 +1334,12 @@ class Battery(ABC):
 
         for key, currentMaxTemperature in temps.items():
             if utils.LINEAR_LIMITATION_ENABLE:
-                temps[key] = utils.calcLinearRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURES_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_T,
+                temps[key] = utils.DISCHARGE_CURRENT_T_CURVE.linear(
+                    currentMaxTemperature
                 )
             else:
-                temps[key] = utils.calcStepRelationship(
-                    currentMaxTemperature,
-                    utils.TEMPERATURES_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_T,
-                    True,
+                temps[key] = utils.DISCHARGE_CURRENT_T_CURVE.step(
+                    currentMaxTemperature, True
                 )
 
         return min(temps[0], temps[1])
@@ -1042,17 +1347,8 @@ class Battery(ABC):
     def calcMaxChargeCurrentReferringToSoc(self) -> float:
         try:
             if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.soc_calc,
-                    utils.SOC_WHILE_CHARGING,
-                    utils.MAX_CHARGE_CURRENT_SOC,
-                )
-            return utils.calcStepRelationship(
-                self.soc_calc,
-                utils.SOC_WHILE_CHARGING,
-                utils.MAX_CHARGE_CURRENT_SOC,
-                True,
-            )
+                return utils.CHARGE_CURRENT_SOC_CURVE.linear(self.soc_calc)
+            return utils.CHARGE_CURRENT_SOC_CURVE.step(self.soc_calc, True)
         except Exception:
             logger.warning(
                 "Error while executing calcMaxChargeCurrentReferringToSoc(). Using default value instead."
@@ -1073,17 +1369,8 @@ class Battery(ABC):
     def calcMaxDischargeCurrentReferringToSoc(self) -> float:
         try:
             if utils.LINEAR_LIMITATION_ENABLE:
-                return utils.calcLinearRelationship(
-                    self.soc_calc,
-                    utils.SOC_WHILE_DISCHARGING,
-                    utils.MAX_DISCHARGE_CURRENT_SOC,
-                )
-            return utils.calcStepRelationship(
-                self.soc_calc,
-                utils.SOC_WHILE_DISCHARGING,
-                utils.MAX_DISCHARGE_CURRENT_SOC,
-                True,
-            )
+                return utils.DISCHARGE_CURRENT_SOC_CURVE.linear(self.soc_calc)
+            return utils.DISCHARGE_CURRENT_SOC_CURVE.step(self.soc_calc, True)
         except Exception:
             logger.warning(
                 "Error while executing calcMaxDischargeCurrentReferringToSoc(). Using default value instead."
@@ -1101,35 +1388,30 @@ class Battery(ABC):
             )
             return self.max_battery_discharge_current
 
+    def get_cell_bank(self) -> CellBank:
+        """
+        Get the snapshot of the cells, it's created on the first call after the cells were refreshed
+        """
+        if self.cell_bank is None:
+            self.cell_bank = CellBank(self.cells, self.cell_count)
+        return self.cell_bank
+
+    def cells_refreshed(self) -> None:
+        """
+        Has to be called after the cells were updated, so that the snapshot is created again on next use.
+        Called by DbusHelper after each refresh_data().
+        """
+        self.cell_bank = None
+
     def get_min_cell(self) -> int:
-        min_voltage = 9999
-        min_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_min_no"):
             return self.cell_min_no
-
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and min_voltage > self.cells[c].voltage
-            ):
-                min_voltage = self.cells[c].voltage
-                min_cell = c
-        return min_cell
+        return self.get_cell_bank().min_cell
 
     def get_max_cell(self) -> int:
-        max_voltage = 0
-        max_cell = None
         if len(self.cells) == 0 and hasattr(self, "cell_max_no"):
             return self.cell_max_no
-
-        for c in range(min(len(self.cells), self.cell_count)):
-            if (
-                self.cells[c].voltage is not None
-                and max_voltage < self.cells[c].voltage
-            ):
-                max_voltage = self.cells[c].voltage
-                max_cell = c
-        return max_cell
+        return self.get_cell_bank().max_cell
 
     def get_min_cell_desc(self) -> Union[str, None]:
         cell_no = self.get_min_cell()
@@ -1161,7 +1443,9 @@ class Battery(ABC):
     def get_timeToSoc(
         self, soc_target: float, percent_per_second: float, only_number: bool = False
     ) -> str:
-        if self.current > 0:
+        # use the average current, since the target is calculated from it
+        current = self.current_avg if self.current_avg is not None else self.current
+        if current > 0:
             soc_diff = soc_target - self.soc_calc
         else:
             soc_diff = self.soc_calc - soc_target
@@ -1230,12 +1514,7 @@ class Battery(ABC):
             min_voltage = self.cell_min_voltage
 
         if min_voltage is None:
-            try:
-                min_voltage = min(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
+            min_voltage = self.get_cell_bank().min_voltage
         return min_voltage
 
     def get_max_cell_voltage(self) -> Union[float, None]:
@@ -1244,12 +1523,7 @@ class Battery(ABC):
             max_voltage = self.cell_max_voltage
 
         if max_voltage is None:
-            try:
-                max_voltage = max(
-                    c.voltage for c in self.cells if c.voltage is not None
-                )
-            except ValueError:
-                pass
+            max_voltage = self.get_cell_bank().max_voltage
         return max_voltage
 
     def get_midvoltage(self) -> Tuple[Union[float, None], Union[float, None]]:
@@ -1270,22 +1544,10 @@ class Battery(ABC):
 
         halfcount = int(math.floor(self.cell_count / 2))
         uneven_cells_offset = self.cell_count % 2
-        half1voltage = 0
-        half2voltage = 0
+        cell_bank = self.get_cell_bank()
 
-        try:
-            half1voltage = sum(
-                cell.voltage
-                for cell in self.cells[:halfcount]
-                if cell.voltage is not None
-            )
-            half2voltage = sum(
-                cell.voltage
-                for cell in self.cells[halfcount + uneven_cells_offset :]
-                if cell.voltage is not None
-            )
-        except ValueError:
-            pass
+        half1voltage = cell_bank.get_voltage_sum(0, halfcount)
+        half2voltage = cell_bank.get_voltage_sum(halfcount + uneven_cells_offset)
 
         try:
             extra = 0 if self.cell_count % 2 == 0 else self.cells[halfcount].voltage / 2
@@ -1300,11 +1562,44 @@ class Battery(ABC):
         except ValueError:
             return None, None
 
+    def get_poll_interval_hint(self) -> int:
+        """
+        Get the poll interval in milliseconds, which fits the current state of the battery.
+        The poll interval of the driver is used, while the charge control has to react fast,
+        else the battery is polled every POLL_ADAPTIVE_IDLE_INTERVAL seconds.
+        """
+        if not utils.POLL_ADAPTIVE_ENABLE:
+            return self.poll_interval
+
+        cell_bank = self.get_cell_bank()
+        if (
+            # poll fast, as long as the state is unknown
+            cell_bank.min_voltage is None
+            or self.current is None
+            # cells are near their limits
+            or cell_bank.max_voltage
+            >= utils.MAX_CELL_VOLTAGE - utils.POLL_ADAPTIVE_CELL_VOLTAGE_MARGIN
+            or cell_bank.min_voltage
+            <= utils.MIN_CELL_VOLTAGE + utils.POLL_ADAPTIVE_CELL_VOLTAGE_MARGIN
+            # current is changing
+            or self.current_stats.ewma is None
+            or abs(self.current - self.current_stats.ewma)
+            > utils.POLL_ADAPTIVE_CURRENT_CHANGE
+            # charge control is adjusting the voltage
+            or (
+                self.charge_mode is not None
+                and (
+                    "Absorption" in self.charge_mode
+                    or self.charge_mode.startswith("Float Transition")
+                )
+            )
+        ):
+            return self.poll_interval
+
+        return max(self.poll_interval, int(utils.POLL_ADAPTIVE_IDLE_INTERVAL * 1000))
+
     def get_balancing(self) -> int:
-        for c in range(min(len(self.cells), self.cell_count)):
-            if self.cells[c].balance is not None and self.cells[c].balance:
-                return 1
-        return 0
+        return 1 if self.get_cell_bank().balance_mask else 0
 
     def get_temp(self) -> Union[float, None]:
         try:
@@ -77,6 +77,8 @@ class BatteryTemplate(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
+        # If the data is read with multiple commands, add the readers to self.poll_scheduler
+        # in __init__() with a refresh period (utils.POLL_INTERVAL_*) and return self.poll_scheduler.run()
         result = self.read_soc_data()
 
         return result
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+import threading
+from time import sleep, time
+from typing import Callable, Dict, List, Optional
+from utils import logger
+import dbus
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+import sys
+
+BLUEZ_SERVICE = "org.bluez"
+ADAPTER_INTERFACE = "org.bluez.Adapter1"
+DEVICE_INTERFACE = "org.bluez.Device1"
+OBJECT_MANAGER_INTERFACE = "org.freedesktop.DBus.ObjectManager"
+PROPERTIES_INTERFACE = "org.freedesktop.DBus.Properties"
+
+
+class BleLinkState:
+    """
+    This class holds the link state of a BLE device, as reported by BlueZ
+    """
+
+    def __init__(self, address: str):
+        self.address: str = address
+        # last element of the BlueZ object path, e.g. dev_AA_BB_CC_DD_EE_FF
+        self.path_name: str = "dev_" + address.upper().replace(":", "_")
+        self.adapter_path: Optional[str] = None
+        self.connected: Optional[bool] = None
+        self.rssi: Optional[int] = None
+        self.adapter_powered: Optional[bool] = None
+        # disconnects since the driver started
+        self.disconnects: int = 0
+        self.last_disconnect: Optional[float] = None
+        # called without arguments in the GLib main loop, if the device disconnected
+        self.callbacks: List[Callable] = []
+
+    def __str__(self) -> str:
+        def yes_no(value: bool) -> str:
+            return "unknown" if value is None else ("yes" if value else "no")
+
+        return (
+            f"BLE {self.address}: connected: {yes_no(self.connected)}, "
+            + f"RSSI: {'unknown' if self.rssi is None else str(self.rssi) + ' dBm'}, "
+            + f"adapter powered: {yes_no(self.adapter_powered)}, "
+            + f"disconnects: {self.disconnects}"
+        )
+
+
+class BleLinkMonitor:
+    """
+    This class holds the link state of all BLE devices of the process. It listens to the BlueZ signals
+    on the system dbus, which are dispatched by the GLib main loop, instead of polling bluetoothctl.
+    """
+
+    def __init__(self):
+        self.devices: Dict[str, BleLinkState] = {}
+        # powered state by adapter object path
+        self.adapters: Dict[str, bool] = {}
+        self.bluez_running: Optional[bool] = None
+        self.bus: Optional[dbus.bus.BusConnection] = None
+        # called without arguments in the GLib main loop, if an adapter was powered on
+        self.adapter_callbacks: List[Callable] = []
+        # notified on every change, see wait_for()
+        self.condition = threading.Condition()
+
+    @property
+    def active(self) -> bool:
+        return self.bus is not None
+
+    def start(self) -> None:
+        """
+        Connect to the system dbus and subscribe to the BlueZ signals.
+        If that fails, the link state stays unknown and the drivers fall back to their timeouts.
+        """
+        try:
+            # own connection, since the default main loop is not set yet, when the batteries are created
+            self.bus = dbus.SystemBus(mainloop=DBusGMainLoop(), private=True)
+            self.bus.add_signal_receiver(
+                self.on_properties_changed,
+                signal_name="PropertiesChanged",
+                dbus_interface=PROPERTIES_INTERFACE,
+                bus_name=BLUEZ_SERVICE,
+                path_keyword="path",
+            )
+            self.bus.add_signal_receiver(
+                self.on_interfaces_added,
+                signal_name="InterfacesAdded",
+                dbus_interface=OBJECT_MANAGER_INTERFACE,
+                bus_name=BLUEZ_SERVICE,
+            )
+            self.bus.add_signal_receiver(
+                self.on_interfaces_removed,
+                signal_name="InterfacesRemoved",
+                dbus_interface=OBJECT_MANAGER_INTERFACE,
+                bus_name=BLUEZ_SERVICE,
+            )
+            self.bus.watch_name_owner(BLUEZ_SERVICE, self.on_bluez_owner_changed)
+        except Exception:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.warning(
+                f"BLE link monitor not available: {repr(exception_object)} of type {exception_type} "
+                + f"in {file} line #{line}"
+            )
+            self.bus = None
+
+    def watch(self, address: str, callback: Callable = None) -> BleLinkState:
+        """
+        Get the link state of a device and call the callback, if the device disconnects.
+        """
+        if self.bus is None:
+            self.start()
+
+        with self.condition:
+            if address not in self.devices:
+                self.devices[address] = BleLinkState(address)
+            device = self.devices[address]
+            if callback is not None:
+                device.callbacks.append(callback)
+
+        if self.active:
+            self.load_objects()
+        return device
+
+    def on_adapter_powered(self, callback: Callable) -> None:
+        self.adapter_callbacks.append(callback)
+
+    def wait_for(self, predicate: Callable[[], bool], timeout: float) -> bool:
+        """
+        Wait until the predicate on the link state is true.
+        The BlueZ signals are dispatched by the GLib main loop, so the link state can only change while
+        the main loop runs in another thread. Without BlueZ signals, from the main thread and before the
+        main loop runs, e.g. in test_connection(), this only waits the whole timeout.
+
+        :return: True, if the predicate got true within the timeout
+        """
+        if not self.active or not self.signals_dispatched():
+            logger.debug("BLE link monitor: no BlueZ signals while waiting")
+            sleep(timeout)
+            return False
+        with self.condition:
+            return self.condition.wait_for(predicate, timeout)
+
+    def signals_dispatched(self) -> bool:
+        """
+        Check if the BlueZ signals are dispatched by a main loop in another thread.
+        """
+        if threading.current_thread() is threading.main_thread():
+            return False
+
+        # the running main loop owns the default context, else it can be acquired
+        context = GLib.MainContext.default()
+        if context.acquire():
+            context.release()
+            return False
+        return True
+
+    def is_adapter_powered(self) -> bool:
+        return any(self.adapters.values())
+
+    def load_objects(self) -> None:
+        """
+        Read the current state of the adapters and devices, the signals only report changes.
+        """
+        try:
+            objects = dbus.Interface(
+                self.bus.get_object(BLUEZ_SERVICE, "/"), OBJECT_MANAGER_INTERFACE
+            ).GetManagedObjects()
+        except dbus.exceptions.DBusException as e:
+            logger.debug(f"BLE link monitor: BlueZ objects not available: {e}")
+            return
+
+        for path, interfaces in objects.items():
+            self.on_interfaces_added(path, interfaces)
+
+    def find_device(self, path: str) -> Optional[BleLinkState]:
+        path_name = path.rsplit("/", 1)[-1]
+        for device in self.devices.values():
+            if device.path_name == path_name:
+                return device
+        return None
+
+    def on_bluez_owner_changed(self, owner: str) -> None:
+        running = owner != ""
+        if self.bluez_running and not running:
+            logger.warning("BLE link monitor: system Bluetooth daemon stopped")
+            # the adapters and devices are gone with the daemon
+            for path in list(self.adapters):
+                self.update_adapter(path, None)
+            for device in list(self.devices.values()):
+                self.update_device(device, None, {"Connected": False, "RSSI": None})
+
+        with self.condition:
+            self.bluez_running = running
+            self.condition.notify_all()
+
+    def on_interfaces_added(self, path: str, interfaces: dict) -> None:
+        if ADAPTER_INTERFACE in interfaces:
+            self.update_adapter(
+                str(path), bool(interfaces[ADAPTER_INTERFACE].get("Powered", False))
+            )
+        if DEVICE_INTERFACE in interfaces:
+            device = self.find_device(path)
+            if device is not None:
+                self.update_device(device, str(path), interfaces[DEVICE_INTERFACE])
+
+    def on_interfaces_removed(self, path: str, interfaces: list) -> None:
+        if ADAPTER_INTERFACE in interfaces:
+            self.update_adapter(str(path), None)
+        if DEVICE_INTERFACE in interfaces:
+            device = self.find_device(path)
+            if device is not None:
+                self.update_device(
+                    device, str(path), {"Connected": False, "RSSI": None}
+                )
+
+    def on_properties_changed(
+        self, interface: str, changed: dict, invalidated: list, path: str = None
+    ) -> None:
+        if interface == ADAPTER_INTERFACE and "Powered" in changed:
+            self.update_adapter(str(path), bool(changed["Powered"]))
+        elif interface == DEVICE_INTERFACE:
+            device = self.find_device(path)
+            if device is not None:
+                if "RSSI" in invalidated:
+                    # BlueZ drops the RSSI, when the device is not seen anymore
+                    changed = dict(changed, RSSI=None)
+                self.update_device(device, str(path), changed)
+
+    def update_adapter(self, path: str, powered: Optional[bool]) -> None:
+        """
+        :param powered: None, if the adapter was removed
+        """
+        with self.condition:
+            was_powered = self.adapters.get(path)
+            # a removed adapter is kept as not powered, so that it's powered on again, when it comes back
+            self.adapters[path] = bool(powered)
+            for device in self.devices.values():
+                if device.adapter_path in (path, None):
+                    device.adapter_powered = powered
+            self.condition.notify_all()
+
+        if powered and was_powered is False:
+            logger.info(f"BLE link monitor: adapter {path} powered on")
+            for callback in self.adapter_callbacks:
+                callback()
+        elif not powered and was_powered:
+            logger.warning(f"BLE link monitor: adapter {path} powered off or removed")
+
+    def update_device(
+        self, device: BleLinkState, path: Optional[str], properties: dict
+    ) -> None:
+        disconnected = False
+        with self.condition:
+            if path is not None:
+                device.adapter_path = path.rsplit("/", 1)[0]
+                device.adapter_powered = self.adapters.get(device.adapter_path)
+            if "RSSI" in properties:
+                rssi = properties["RSSI"]
+                device.rssi = int(rssi) if rssi is not None else None
+            if "Connected" in properties:
+                connected = bool(properties["Connected"])
+                disconnected = device.connected and not connected
+                device.connected = connected
+                if disconnected:
+                    device.disconnects += 1
+                    device.last_disconnect = time()
+            self.condition.notify_all()
+
+        if disconnected:
+            logger.warning(f"BLE link monitor: {device.address} disconnected")
+            for callback in device.callbacks:
+                callback()
+
+
+ble_link_monitor: Optional[BleLinkMonitor] = None
+ble_link_monitor_lock = threading.Lock()
+
+
+def get_ble_link_monitor() -> BleLinkMonitor:
+    """
+    Get the BLE link monitor, which is shared by all BLE batteries of the process.
+    """
+    global ble_link_monitor
+    with ble_link_monitor_lock:
+        if ble_link_monitor is None:
+            ble_link_monitor = BleLinkMonitor()
+        return ble_link_monitor
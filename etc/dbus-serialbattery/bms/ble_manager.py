@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import concurrent.futures
+import os
+import signal
+import threading
+from contextlib import asynccontextmanager
+from time import time
+from typing import Coroutine, Dict, Optional
+from utils import logger
+from bms.ble_link_monitor import get_ble_link_monitor
+import utils
+
+# minimum seconds between two resets of the Bluetooth adapter
+ADAPTER_RESET_INTERVAL = 300
+
+
+class BleDeviceState:
+    """
+    This class holds the connection state of a BLE device, which is used for its reconnect backoff
+    """
+
+    def __init__(self, address: str):
+        self.address: str = address
+        # failed connects or lost connections in a row
+        self.failures: int = 0
+        self.next_attempt: float = 0
+
+
+class BleManager:
+    """
+    This class holds the Bluetooth adapter, which is shared by all BLE batteries of the process.
+    All devices run on one asyncio loop in one thread, the connects are done one after another,
+    since parallel connects on the same adapter collide. Every device reconnects with its own
+    backoff and the adapter is reset only, if all devices failed.
+    """
+
+    def __init__(self):
+        self.devices: Dict[str, BleDeviceState] = {}
+        self.lock = threading.Lock()
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[threading.Thread] = None
+        self.connect_lock: Optional[asyncio.Lock] = None
+        # set to end the backoff of all waiting devices, see retry_now()
+        self.retry_event: Optional[asyncio.Event] = None
+        self.last_adapter_reset: float = 0
+        self.adapter_resetting: bool = False
+        # reconnect at once, when the adapter is back
+        get_ble_link_monitor().on_adapter_powered(self.retry_now)
+
+    def get_loop(self) -> asyncio.AbstractEventLoop:
+        """
+        Get the loop of the BLE thread, which is started on the first call.
+        """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(
+                    name="BLE-Manager-Loop", target=self.run_loop, daemon=True
+                )
+                self.thread.start()
+            return self.loop
+
+    def run_loop(self) -> None:
+        asyncio.set_event_loop(self.loop)
+        # create the lock and the event on the loop, where they are used
+        self.connect_lock = asyncio.Lock()
+        self.retry_event = asyncio.Event()
+        self.loop.run_forever()
+
+    def run_coroutine(self, coroutine: Coroutine) -> concurrent.futures.Future:
+        """
+        Run a coroutine on the BLE loop, can be called from any thread.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.get_loop())
+
+    def register(self, address: str) -> BleDeviceState:
+        with self.lock:
+            if address not in self.devices:
+                self.devices[address] = BleDeviceState(address)
+            return self.devices[address]
+
+    @asynccontextmanager
+    async def connection_attempt(self, address: str):
+        """
+        Wait for the reconnect backoff of the device and until no other device is connecting.
+        Scanning and connecting has to be done within this context.
+        """
+        device = self.register(address)
+        delay = device.next_attempt - time()
+        if delay > 0:
+            logger.info(f"BLE {address}: next connect in {delay:.0f}s")
+            try:
+                await asyncio.wait_for(self.retry_event.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+        async with self.connect_lock:
+            yield
+
+    def report_success(self, address: str) -> None:
+        """
+        The device connected, reset its backoff.
+        """
+        device = self.register(address)
+        with self.lock:
+            device.failures = 0
+            device.next_attempt = 0
+
+    def retry_now(self) -> None:
+        """
+        End the backoff of all devices, can be called from any thread.
+        """
+        with self.lock:
+            for device in self.devices.values():
+                device.next_attempt = 0
+            loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.wake_waiting_devices)
+
+    def wake_waiting_devices(self) -> None:
+        # the waiting devices hold the old event, the next backoff waits on a new one
+        self.retry_event.set()
+        self.retry_event = asyncio.Event()
+
+    def report_failure(self, address: str) -> None:
+        """
+        The device failed to connect or lost the connection, increase its backoff.
+        Reset the adapter, if all devices failed repeatedly.
+        """
+        device = self.register(address)
+        with self.lock:
+            device.failures += 1
+            delay = min(
+                utils.BLUETOOTH_RECONNECT_DELAY_MIN * 2 ** (device.failures - 1),
+                utils.BLUETOOTH_RECONNECT_DELAY_MAX,
+            )
+            device.next_attempt = time() + delay
+
+            reset_adapter = (
+                not self.adapter_resetting
+                and time() - self.last_adapter_reset > ADAPTER_RESET_INTERVAL
+                and all(
+                    state.failures >= utils.BLUETOOTH_ADAPTER_RESET_FAILURES
+                    for state in self.devices.values()
+                )
+            )
+            if reset_adapter:
+                self.adapter_resetting = True
+
+        logger.info(
+            f"BLE {address}: connection failed {device.failures} time(s) in a row, next connect in {delay:.0f}s"
+        )
+        if reset_adapter:
+            # do not block the BLE loop or the main loop with the system commands
+            threading.Thread(
+                name="BLE-Manager-Reset", target=self.reset_adapter, daemon=True
+            ).start()
+
+    def reset_adapter(self) -> None:
+        logger.error(
+            "All BLE devices failed, reset of system Bluetooth daemon triggered"
+        )
+        monitor = get_ble_link_monitor()
+        try:
+            # process kill is needed, since the service/bluetooth driver is probably freezed
+            os.system('pkill -f "bluetoothd"')
+            monitor.wait_for(lambda: monitor.bluez_running is False, 2)
+            os.system("rfkill block bluetooth")
+            os.system("rfkill unblock bluetooth")
+            os.system("/etc/init.d/bluetooth start")
+            if monitor.wait_for(monitor.is_adapter_powered, 5):
+                logger.info("System Bluetooth daemon restarted, adapter is powered")
+            else:
+                logger.info("System Bluetooth daemon should have been restarted")
+        finally:
+            with self.lock:
+                self.last_adapter_reset = time()
+                self.adapter_resetting = False
+            self.retry_now()
+
+    def reset_hci_uart(self) -> None:
+        """
+        Reload the driver of the built-in Bluetooth adapter and restart the process afterwards,
+        can be called from any thread.
+        """
+        with self.lock:
+            if self.adapter_resetting:
+                return
+            self.adapter_resetting = True
+
+        # do not block the BLE loop, which is shared by all devices, with the system commands
+        threading.Thread(
+            name="BLE-Manager-Reset", target=self.reload_hci_uart, daemon=True
+        ).start()
+
+    def reload_hci_uart(self) -> None:
+        logger.error("Reset of hci_uart stack, the driver is restarted afterwards")
+        monitor = get_ble_link_monitor()
+        os.system("pkill -f 'hciattach'")
+        # wait until the adapter is gone
+        monitor.wait_for(lambda: not monitor.is_adapter_powered(), 0.5)
+        os.system("rmmod hci_uart")
+        os.system("rmmod btbcm")
+        os.system("modprobe hci_uart")
+        os.system("modprobe btbcm")
+        # stop the whole process and not only this thread, it's started again by its service
+        os.kill(os.getpid(), signal.SIGTERM)
+
+
+ble_manager: Optional[BleManager] = None
+ble_manager_lock = threading.Lock()
+
+
+def get_ble_manager() -> BleManager:
+    """
+    Get the BLE manager, which is shared by all BLE batteries of the process.
+    """
+    global ble_manager
+    with ble_manager_lock:
+        if ble_manager is None:
+            ble_manager = BleManager()
+        return ble_manager
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from battery import Battery, Cell
-from utils import open_serial_port, logger
+from utils import (
+    borrow_serial_port,
+    read_serialport_bytes,
+    logger,
+    FrameSchema,
+    get_array_struct,
+)
 import utils
 from struct import unpack_from, pack_into
 from time import sleep, time
@@ -29,12 +35,54 @@ class Daly(Battery):
         self.trigger_force_disable_charge = None
         self.cells_volts_data_lastreadbad = False
         self.last_charge_mode = self.charge_mode
+        self.last_reply_time = 0
+        # cached between restarts, since they are read with additional commands
+        self.metadata_attributes = ["capacity", "production"]
+        # set, if the static data was loaded from the cache instead of being read on the start
+        self.static_data_cached = False
         # list of available callbacks, in order to display the buttons in the GUI
         self.available_callbacks = [
             "force_charging_off_callback",
             "force_discharging_off_callback",
         ]
 
+        # commands executed on refresh_data() with their refresh period in seconds
+        # SoC, current and the cell voltage range are needed for the charge control on every poll
+        self.poll_scheduler.log_runtime_above = 0.200
+        self.poll_scheduler.add("read_soc_data", self.read_soc_data)
+        self.poll_scheduler.add("read_fed_data", self.read_fed_data)
+        self.poll_scheduler.add(
+            "read_cell_voltage_range_data", self.read_cell_voltage_range_data
+        )
+        self.poll_scheduler.add(
+            "write_soc_and_datetime", self.write_soc_and_datetime, ignore_result=True
+        )
+        self.poll_scheduler.add(
+            "read_alarm_data", self.read_alarm_data, utils.POLL_INTERVAL_ALARMS
+        )
+        self.poll_scheduler.add(
+            "read_temperature_range_data",
+            self.read_temperature_range_data,
+            utils.POLL_INTERVAL_TEMPERATURES,
+        )
+        self.poll_scheduler.add(
+            "read_cells_volts", self.read_cells_volts, utils.POLL_INTERVAL_CELLS
+        )
+        # the balance state is stored in the cells, which are created by read_cells_volts()
+        self.poll_scheduler.add(
+            "read_balance_state",
+            self.read_balance_state,
+            utils.POLL_INTERVAL_ALARMS,
+            depends_on=["read_cells_volts"],
+        )
+        self.poll_scheduler.add(
+            "write_charge_discharge_mos",
+            self.write_charge_discharge_mos,
+            ignore_result=True,
+        )
+        if utils.AUTO_RESET_SOC:
+            self.poll_scheduler.add("update_soc", self.update_soc, ignore_result=True)
+
     # command bytes [StartFlag=A5][Address=40][Command=94][DataLength=8][8x fill bytes][checksum]
     # use 0xAA (or 0x55) as fill bytes to allow the daly's "weak" uart to sync better
     # this reduces read errors dramatically
@@ -60,6 +108,42 @@ class Daly(Battery):
     LENGTH_POS = 3
     CURRENT_ZERO_CONSTANT = 30000
     TEMP_ZERO_CONSTANT = 40
+    # pause between the last reply and the next command
+    # if you see a lot of no reply errors, try to increase in steps of 0.005
+    REQUEST_PAUSE = 0.020
+
+    # data section of the replies, voltages are returned in 0.1 V or mV
+    STATUS_SCHEMA = FrameSchema(
+        [
+            ("cell_count", 0, "b"),
+            ("temp_sensors", 1, "b"),
+            ("charger_connected", 2, "?"),
+            ("load_connected", 3, "?"),
+            ("cycles", 5, "h"),
+        ]
+    )
+    SOC_SCHEMA = FrameSchema(
+        [
+            ("voltage", 0, "h", 10),
+            ("current", 4, "h"),
+            ("soc", 6, "h", 10),
+        ]
+    )
+    CELL_VOLTAGE_RANGE_SCHEMA = FrameSchema(
+        [
+            ("cell_max_voltage", 0, "h", 1000),
+            ("cell_max_no", 2, "b"),
+            ("cell_min_voltage", 3, "h", 1000),
+            ("cell_min_no", 5, "b"),
+        ]
+    )
+    FET_SCHEMA = FrameSchema(
+        [
+            ("charge_fet", 1, "?"),
+            ("discharge_fet", 2, "?"),
+            ("capacity_remain", 4, "L", 1000),
+        ]
+    )
 
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
@@ -67,14 +151,16 @@ class Daly(Battery):
         # Return True if success, False for failure
         result = False
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
+            with borrow_serial_port(self.port, self.baud_rate) as ser:
                 result = self.read_status_data(ser)
                 # get first data to show in startup log, only if result is true
                 if result:
                     self.read_soc_data(ser)
                     self.read_battery_code(ser)
-                    self.read_capacity(ser)
-                    self.read_production_date(ser)
+                    # the capacity and the production date are read only, if they are not cached
+                    self.static_data_cached = self.load_metadata()
+                    if not self.static_data_cached:
+                        self.read_static_data(ser)
 
         except Exception:
             (
@@ -96,10 +182,14 @@ class Daly(Battery):
         return result
 
     def get_settings(self):
-        self.capacity = utils.BATTERY_CAPACITY if not None else 0.0
-        with open_serial_port(self.port, self.baud_rate) as ser:
-            self.read_capacity(ser)
-            self.read_production_date(ser)
+        # the static data was loaded or read by test_connection(), use the config, if it could not be read
+        if self.capacity is None:
+            self.capacity = utils.BATTERY_CAPACITY
+        if self.static_data_cached:
+            # read the values once on one of the next polls to update the cache
+            self.poll_scheduler.add(
+                "read_static_data", self.read_static_data, None, ignore_result=True
+            )
 
         self.max_battery_charge_current = utils.MAX_BATTERY_CHARGE_CURRENT
         self.max_battery_discharge_current = utils.MAX_BATTERY_DISCHARGE_CURRENT
@@ -108,94 +198,12 @@ class Daly(Battery):
     def refresh_data(self):
         result = False
 
-        # Open serial port to be used for all data reads instead of opening multiple times
+        # Borrow the serial port session, which stays open between the polls
         try:
-            with open_serial_port(self.port, self.baud_rate) as ser:
-                result = self.read_soc_data(ser)
+            with borrow_serial_port(self.port, self.baud_rate) as ser:
+                # execute only the commands, which are due in this poll
+                result = self.poll_scheduler.run(ser)
                 self.reset_soc = self.soc if self.soc else 0
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_soc_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_fed_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_fed_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_cell_voltage_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_cell_voltage_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                self.write_soc_and_datetime(ser)
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: write_soc_and_datetime - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_alarm_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_alarm_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_temperature_range_data(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_temperature_range_data - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_balance_state(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_balance_state - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                result = self.read_cells_volts(ser) and result
-                if self.runtime > 0.200:  # TROUBLESHOOTING for no reply errors
-                    logger.info(
-                        "  |- refresh_data: read_cells_volts - result: "
-                        + str(result)
-                        + " - runtime: "
-                        + str(f"{self.runtime:.1f}")
-                        + "s"
-                    )
-
-                self.write_charge_discharge_mos(ser)
-
-                if utils.AUTO_RESET_SOC:
-                    self.update_soc(ser)
 
         except OSError:
             logger.warning("Couldn't open serial port")
@@ -222,18 +230,16 @@ class Daly(Battery):
             logger.debug("No data received in read_status_data()")
             return False
 
-        try:
-            (
-                self.cell_count,
-                self.temp_sensors,
-                self.charger_connected,
-                self.load_connected,
-                state,
-                self.cycles,
-            ) = unpack_from(">bb??bhx", status_data)
-        except Exception:
+        status = self.STATUS_SCHEMA.decode(status_data)
+        if status is None:
             return False
 
+        self.cell_count = status["cell_count"]
+        self.temp_sensors = status["temp_sensors"]
+        self.charger_connected = status["charger_connected"]
+        self.load_connected = status["load_connected"]
+        self.cycles = status["cycles"]
+
         self.max_battery_voltage = utils.MAX_CELL_VOLTAGE * self.cell_count
         self.min_battery_voltage = utils.MIN_CELL_VOLTAGE * self.cell_count
 
@@ -258,19 +264,22 @@ class Daly(Battery):
             if soc_data is False:
                 continue
 
-            voltage, tmp, current, soc = unpack_from(">hhhh", soc_data)
+            soc_values = self.SOC_SCHEMA.decode(soc_data)
+            if soc_values is None:
+                continue
+
             current = (
-                (current - self.CURRENT_ZERO_CONSTANT)
+                (soc_values["current"] - self.CURRENT_ZERO_CONSTANT)
                 / -10
                 * utils.INVERT_CURRENT_MEASUREMENT
             )
             if crntMinValid < current < crntMaxValid:
-                self.voltage = voltage / 10
+                self.voltage = soc_values["voltage"]
                 # apply exponential smoothing on the flickering current measurement
                 self.current = (0.1 * current) + (
                     0.9 * (0 if self.current is None else self.current)
                 )
-                self.soc = soc / 10
+                self.soc = soc_values["soc"]
                 return True
 
             logger.warning("read_soc_data - triesValid " + str(triesValid))
@@ -417,9 +426,7 @@ class Daly(Battery):
             # this read was good, so reset error flag
             self.cells_volts_data_lastreadbad = False
 
-        frameCell = [0, 0, 0]
         lowMin = utils.MIN_CELL_VOLTAGE / 2
-        frame = 0
 
         if len(self.cells) != self.cell_count:
             # init the numbers of cells
@@ -429,19 +436,19 @@ class Daly(Battery):
 
         # logger.warning("data " + bytearray_to_string(cells_volts_data))
 
+        # each sentence has its frame number, up to 3 voltages and one unused byte
+        sentences = get_array_struct(">Bhhhx", sentences_expected).unpack_from(
+            cells_volts_data
+        )
+
         # from each of the received sentences, read up to 3 voltages
-        for i in range(sentences_expected):
-            (
-                frame,
-                frameCell[0],
-                frameCell[1],
-                frameCell[2],
-            ) = unpack_from(">Bhhh", cells_volts_data, 8 * i)
+        for i in range(0, len(sentences), 4):
+            frame = sentences[i]
             for idx in range(3):
                 cellnum = ((frame - 1) * 3) + idx  # daly is 1 based, driver 0 based
                 if cellnum >= self.cell_count:
                     break  # ignore possible unused bytes of last sentence
-                cellVoltage = frameCell[idx] / 1000
+                cellVoltage = sentences[i + 1 + idx] / 1000
                 self.cells[cellnum].voltage = (
                     None if cellVoltage < lowMin else cellVoltage
                 )
@@ -454,18 +461,15 @@ class Daly(Battery):
             logger.debug("No data received in read_cell_voltage_range_data()")
             return False
 
-        (
-            cell_max_voltage,
-            self.cell_max_no,
-            cell_min_voltage,
-            self.cell_min_no,
-        ) = unpack_from(">hbhb", minmax_data)
+        minmax = self.CELL_VOLTAGE_RANGE_SCHEMA.decode(minmax_data)
+        if minmax is None:
+            return False
+
         # Daly cells numbers are 1 based and not 0 based
-        self.cell_min_no -= 1
-        self.cell_max_no -= 1
-        # Voltage is returned in mV
-        self.cell_max_voltage = cell_max_voltage / 1000
-        self.cell_min_voltage = cell_min_voltage / 1000
+        self.cell_min_no = minmax["cell_min_no"] - 1
+        self.cell_max_no = minmax["cell_max_no"] - 1
+        self.cell_max_voltage = minmax["cell_max_voltage"]
+        self.cell_min_voltage = minmax["cell_min_voltage"]
         return True
 
     def read_balance_state(self, ser):
@@ -503,14 +507,13 @@ class Daly(Battery):
             logger.debug("No data received in read_fed_data()")
             return False
 
-        (
-            status,
-            self.charge_fet,
-            self.discharge_fet,
-            bms_cycles,
-            capacity_remain,
-        ) = unpack_from(">b??BL", fed_data)
-        self.capacity_remain = capacity_remain / 1000
+        fet = self.FET_SCHEMA.decode(fed_data)
+        if fet is None:
+            return False
+
+        self.charge_fet = fet["charge_fet"]
+        self.discharge_fet = fet["discharge_fet"]
+        self.capacity_remain = fet["capacity_remain"]
         return True
 
     def read_capacity(self, ser):
@@ -527,6 +530,17 @@ class Daly(Battery):
         else:
             return False
 
+    def read_static_data(self, ser):
+        capacity_read = self.read_capacity(ser)
+        production_date_read = self.read_production_date(ser)
+
+        # cache only complete data, else the defaults would be served on the next start
+        if capacity_read and production_date_read:
+            self.save_metadata()
+
+        # the values are read only once, also if a value could not be read
+        return True
+
     def read_production_date(self, ser):
         production = self.request_data(ser, self.command_batt_details)
         # check if connection success
@@ -585,9 +599,7 @@ class Daly(Battery):
         if self.soc_to_set is None:
             return False
 
-        # wait shortly, else the Daly is not ready and throws a lot of no reply errors
-        # if you see a lot of errors, try to increase in steps of 0.005
-        sleep(0.020)
+        self.wait_for_bms()
 
         cmd = bytearray(13)
         now = datetime.now()
@@ -618,6 +630,7 @@ class Daly(Battery):
         ser.write(cmd)
 
         reply = self.read_sentence(ser, self.command_set_soc)
+        self.last_reply_time = time()
         if reply is False or reply[0] != 1:
             logger.error("write soc failed")
         return True
@@ -651,19 +664,13 @@ class Daly(Battery):
         return False
 
     def write_charge_discharge_mos(self, ser):
-        # wait shortly, else the Daly is not ready and throws a lot of no reply errors
-        # if you see a lot of errors, try to increase in steps of 0.005
-        sleep(0.020)
-
         if (
             self.trigger_force_disable_charge is None
             and self.trigger_force_disable_discharge is None
         ):
             return False
 
-        # wait shortly, else the Daly is not ready and throws a lot of no reply errors
-        # if you see a lot of errors, try to increase in steps of 0.005
-        sleep(0.020)
+        self.wait_for_bms()
 
         cmd = bytearray(self.command_base)
 
@@ -680,6 +687,7 @@ class Daly(Battery):
             ser.write(cmd)
 
             reply = self.read_sentence(ser, self.command_disable_charge_mos)
+            self.last_reply_time = time()
             if reply is False or reply[0] != cmd[4]:
                 logger.error("write force disable charge/discharge failed")
                 return False
@@ -697,6 +705,7 @@ class Daly(Battery):
             ser.write(cmd)
 
             reply = self.read_sentence(ser, self.command_disable_discharge_mos)
+            self.last_reply_time = time()
             if reply is False or reply[0] != cmd[4]:
                 logger.error("write force disable charge/discharge failed")
                 return False
@@ -709,10 +718,17 @@ class Daly(Battery):
         buffer[12] = sum(buffer[:12]) & 0xFF  # checksum calc
         return buffer
 
+    def wait_for_bms(self):
+        """
+        Wait shortly after the last reply, else the Daly is not ready and throws a lot of no reply errors.
+        Only the part of the pause, which did not already pass since the last reply, is waited.
+        """
+        pause = self.REQUEST_PAUSE - (time() - self.last_reply_time)
+        if pause > 0:
+            sleep(pause)
+
     def request_data(self, ser, command, sentences_to_receive=1):
-        # wait shortly, else the Daly is not ready and throws a lot of no reply errors
-        # if you see a lot of errors, try to increase in steps of 0.005
-        sleep(0.020)
+        self.wait_for_bms()
 
         self.runtime = 0
         time_start = time()
@@ -725,9 +741,11 @@ class Daly(Battery):
             next = self.read_sentence(ser, command)
             if not next:
                 logger.debug(f"request_data: bad reply no. {i}")
+                self.last_reply_time = time()
                 return False
             reply += next
-        self.runtime = time() - time_start
+        self.last_reply_time = time()
+        self.runtime = self.last_reply_time - time_start
         return reply
 
     def read_sentence(self, ser, expected_reply, timeout=0.5):
@@ -735,29 +753,26 @@ class Daly(Battery):
         return false if less than 13 bytes received in timeout secs, or frame errors occured
         return received datasection as bytearray else
         """
-        time_start = time()
+        deadline = time() + timeout
 
-        reply = ser.read_until(b"\xA5")
-        if not reply or b"\xA5" not in reply:
+        # skip everything until the sentence start
+        reply = read_serialport_bytes(ser, 1, deadline)
+        while reply and reply[0] != 0xA5:
+            reply = read_serialport_bytes(ser, 1, deadline)
+        if not reply:
             logger.debug(
                 f"read_sentence {utils.bytearray_to_string(expected_reply)}: no sentence start received"
             )
             return False
 
-        idx = reply.index(b"\xA5")
-        reply = reply[idx:]
-        toread = ser.inWaiting()
-        while toread < 12:
-            sleep((12 - toread) * 0.001)
-            toread = ser.inWaiting()
-            time_run = time() - time_start
-            if time_run > timeout:
-                logger.debug(
-                    f"read_sentence {utils.bytearray_to_string(expected_reply)}: timeout"
-                )
-                return False
+        # block until the rest of the sentence arrived, following sentences stay in the buffer
+        reply += read_serialport_bytes(ser, 12, deadline)
+        if len(reply) < 13:
+            logger.debug(
+                f"read_sentence {utils.bytearray_to_string(expected_reply)}: timeout"
+            )
+            return False
 
-        reply += ser.read(12)
         try:
             _, id, cmd, length = unpack_from(">BBBB", reply)
         except Exception:
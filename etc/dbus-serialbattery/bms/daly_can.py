@@ -9,6 +9,9 @@ from utils import (
     MAX_BATTERY_DISCHARGE_CURRENT,
     MAX_CELL_VOLTAGE,
     MIN_CELL_VOLTAGE,
+    POLL_INTERVAL_ALARMS,
+    POLL_INTERVAL_CELLS,
+    POLL_INTERVAL_TEMPERATURES,
 )
 from struct import unpack_from
 import can
@@ -28,10 +31,43 @@ class Daly_Can(Battery):
         self.cell_min_no = None
         self.cell_max_no = None
         self.poll_interval = 1000
-        self.poll_step = 0
         self.type = self.BATTERYTYPE
         self.can_bus = None
 
+        # commands executed on refresh_data() with their refresh period in seconds
+        # the cell voltage range is needed by get_min_cell_voltage and get_max_cell_voltage in battery.py
+        # on the first cycle for publish_dbus in dbushelper.py.
+        # If the SoC can't be read the battery is offline and the other commands would only time out
+        self.poll_scheduler.add("read_soc_data", self.read_soc_data)
+        depends_on = ["read_soc_data"]
+        self.poll_scheduler.add(
+            "read_fed_data", self.read_fed_data, depends_on=depends_on
+        )
+        self.poll_scheduler.add(
+            "read_cell_voltage_range_data",
+            self.read_cell_voltage_range_data,
+            POLL_INTERVAL_CELLS,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_alarm_data",
+            self.read_alarm_data,
+            POLL_INTERVAL_ALARMS,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_cells_volts",
+            self.read_cells_volts,
+            POLL_INTERVAL_CELLS,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_temperature_range_data",
+            self.read_temperature_range_data,
+            POLL_INTERVAL_TEMPERATURES,
+            depends_on=depends_on,
+        )
+
     # command bytes [Priority=18][Command=94][BMS ID=01][Uplink ID=40]
     command_base = 0x18940140
     command_soc = 0x18900140
@@ -95,27 +131,7 @@ class Daly_Can(Battery):
         return True
 
     def refresh_data(self):
-        result = False
-
-        result = self.read_soc_data(self.can_bus)
-        result = result and self.read_fed_data(self.can_bus)
-        if self.poll_step == 0:
-            # This must be listed in step 0 as get_min_cell_voltage and get_max_cell_voltage in battery.py
-            # needs it at first cycle for publish_dbus in dbushelper.py
-            result = result and self.read_cell_voltage_range_data(self.can_bus)
-        elif self.poll_step == 1:
-            result = result and self.read_alarm_data(self.can_bus)
-        elif self.poll_step == 2:
-            result = result and self.read_cells_volts(self.can_bus)
-        elif self.poll_step == 3:
-            result = result and self.read_temperature_range_data(self.can_bus)
-            # else:          # A placeholder to remind this is the last step. Add any additional steps before here
-            # This is last step so reset poll_step
-            self.poll_step = -1
-
-        self.poll_step += 1
-
-        return result
+        return self.poll_scheduler.run(self.can_bus)
 
     def read_status_data(self, can_bus):
         status_data = self.read_bus_data_daly(can_bus, self.command_status)
@@ -31,19 +31,35 @@ class HeltecModbus(Battery):
         super(HeltecModbus, self).__init__(port, baud, address)
         self.type = "Heltec_Smart"
         self.unique_identifier_tmp = ""
+        # test only the given address, if multiple batteries share the serial port
+        self.addresses = (
+            [int.from_bytes(address, byteorder="big")]
+            if address is not None
+            else utils.HELTEC_MODBUS_ADDR
+        )
+
+        # commands executed on refresh_data() with their refresh period in seconds,
+        # if the SoC can't be read the battery is offline and the retries of the cells would only time out
+        self.poll_scheduler.add("read_soc_data", self.read_soc_data)
+        self.poll_scheduler.add(
+            "read_cell_data",
+            self.read_cell_data,
+            utils.POLL_INTERVAL_CELLS,
+            depends_on=["read_soc_data"],
+        )
 
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
         # The result or call should be unique to this BMS. Battery name or version, etc.
         # Return True if success, False for failure
-        for self.address in utils.HELTEC_MODBUS_ADDR:
+        for self.address in self.addresses:
             logger.debug("Testing on slave address " + str(self.address))
             found = False
             if self.address not in locks:
                 locks[self.address] = threading.Lock()
 
-            # TODO: We need to lock not only based on the address, but based on the port as soon as multiple BMSs
-            # are supported on the same serial interface. Then locking on the port will be enough.
+            # multiple BMSs on the same serial interface are served by one process (BATTERY_ADDRESSES),
+            # which polls them one after another, so locking on the address is enough
 
             with locks[self.address]:
                 mbdev = minimalmodbus.Instrument(
@@ -118,7 +134,7 @@ class HeltecModbus(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        return self.read_soc_data() and self.read_cell_data()
+        return self.poll_scheduler.run()
 
     def read_status_data(self):
         mbdev = mbdevs[self.address]
@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from battery import Battery, Cell
-from utils import is_bit_set, read_serial_data, logger
+from utils import (
+    is_bit_set,
+    read_serial_data,
+    logger,
+    FrameSchema,
+    get_array_struct,
+)
 import utils
 from struct import unpack_from
 from re import sub
@@ -66,13 +72,50 @@ class Jkbms(Battery):
 
         return result
 
-    def get_data(self, bytes, idcode, start, length):
-        # logger.debug("start "+str(start) + " length " + str(length))
-        # logger.debug(binascii.hexlify(bytearray(bytes[start:start + 1 + length])).decode('ascii'))
-        start = bytes.find(idcode, start, start + 1 + length)
-        if start < 0:
-            return False
-        return bytes[start + 1 : start + length + 1]
+    # fields of the status frame with the offsets relative to the number of cell bytes
+    # each value is preceded by its ID code, which is checked as marker
+    STATUS_SCHEMA = FrameSchema(
+        [
+            ("temp_mos", 4, "H"),
+            ("temp1", 7, "H"),
+            ("temp2", 10, "H"),
+            ("voltage", 13, "H", 100),
+            ("current", 16, "H"),
+            ("soc", 19, "B"),
+            ("cycles", 23, "H"),
+            ("cell_count", 31, "H"),
+            ("protection", 34, "H"),
+            ("fet", 37, "H"),
+            ("max_discharge_current", 67, "H"),
+            ("max_charge_current", 73, "H"),
+            ("balance", 85, "B"),
+            ("capacity", 122, "L"),
+            ("custom_field", 156, "8s"),
+            ("production", 165, "4s"),
+            ("version", 175, "15s"),
+            ("unique_identifier", 198, "24s"),
+        ],
+        markers={
+            3: 0x80,
+            6: 0x81,
+            9: 0x82,
+            12: 0x83,
+            15: 0x84,
+            18: 0x85,
+            22: 0x87,
+            30: 0x8A,
+            33: 0x8B,
+            36: 0x8C,
+            66: 0x97,
+            72: 0x99,
+            84: 0x9D,
+            121: 0xAA,
+            155: 0xB4,
+            164: 0xB5,
+            174: 0xB7,
+            197: 0xBA,
+        },
+    )
 
     def read_status_data(self):
         status_data = self.read_serial_data_jkbms(self.command_status)
@@ -81,44 +124,39 @@ class Jkbms(Battery):
             return False
 
         # cell voltages
-        offset = 1
-        cellbyte_count = unpack_from(
-            ">B", self.get_data(status_data, b"\x79", offset, 1)
-        )[0]
+        if status_data[1] != 0x79:
+            logger.debug("Cell voltages not found in status data")
+            return False
+        cellbyte_count = status_data[2]
 
-        offset = cellbyte_count + 30
-        self.cell_count = unpack_from(
-            ">H", self.get_data(status_data, b"\x8A", offset, 2)
-        )[0]
+        status = self.STATUS_SCHEMA.decode(status_data, cellbyte_count)
+        if status is None:
+            logger.debug("Invalid status data")
+            return False
+
+        self.cell_count = status["cell_count"]
 
         if cellbyte_count == 3 * self.cell_count and self.cell_count == len(self.cells):
-            offset = 1
-            celldata = self.get_data(status_data, b"\x79", offset, 1 + cellbyte_count)
+            # each cell has a cell number byte and the voltage
+            voltages = get_array_struct(">xH", self.cell_count).unpack_from(
+                status_data, 3
+            )
             for c in range(self.cell_count):
-                self.cells[c].voltage = (
-                    unpack_from(">xH", celldata, c * 3 + 1)[0] / 1000
-                )
+                self.cells[c].voltage = voltages[c] / 1000
 
         # MOSFET temperature
-        offset = cellbyte_count + 3
-        temp_mos = unpack_from(">H", self.get_data(status_data, b"\x80", offset, 2))[0]
+        temp_mos = status["temp_mos"]
         self.to_temp(0, temp_mos if temp_mos < 99 else (100 - temp_mos))
 
         # Temperature sensors
-        offset = cellbyte_count + 6
-        temp1 = unpack_from(">H", self.get_data(status_data, b"\x81", offset, 2))[0]
-
-        offset = cellbyte_count + 9
-        temp2 = unpack_from(">H", self.get_data(status_data, b"\x82", offset, 2))[0]
+        temp1 = status["temp1"]
+        temp2 = status["temp2"]
         self.to_temp(1, temp1 if temp1 < 99 else (100 - temp1))
         self.to_temp(2, temp2 if temp2 < 99 else (100 - temp2))
 
-        offset = cellbyte_count + 12
-        voltage = unpack_from(">H", self.get_data(status_data, b"\x83", offset, 2))[0]
-        self.voltage = voltage / 100
+        self.voltage = status["voltage"]
 
-        offset = cellbyte_count + 15
-        current = unpack_from(">H", self.get_data(status_data, b"\x84", offset, 2))[0]
+        current = status["current"]
         self.current = (
             current / -100
             if current < self.CURRENT_ZERO_CONSTANT
@@ -126,85 +164,49 @@ class Jkbms(Battery):
         )
 
         # Continued discharge current
-        offset = cellbyte_count + 66
-        self.max_battery_discharge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x97", offset, 2))[0]
-        )
+        self.max_battery_discharge_current = float(status["max_discharge_current"])
 
         # Continued charge current
-        offset = cellbyte_count + 72
-        self.max_battery_charge_current = float(
-            unpack_from(">H", self.get_data(status_data, b"\x99", offset, 2))[0]
-        )
+        self.max_battery_charge_current = float(status["max_charge_current"])
 
         # the JKBMS resets to
         # 95% SoC, if all cell voltages are above or equal to OVPR (Over Voltage Protection Recovery)
         # 100% Soc, if all cell voltages are above or equal to OVP (Over Voltage Protection)
-        offset = cellbyte_count + 18
-        self.soc = unpack_from(">B", self.get_data(status_data, b"\x85", offset, 1))[0]
-
-        offset = cellbyte_count + 22
-        self.cycles = unpack_from(">H", self.get_data(status_data, b"\x87", offset, 2))[
-            0
-        ]
-
-        # offset = cellbyte_count + 25
-        # self.capacity_remain = unpack_from('>L', self.get_data(status_data, b'\x89', offset, 4))[0]
-        offset = cellbyte_count + 121
-        self.capacity = unpack_from(
-            ">L", self.get_data(status_data, b"\xAA", offset, 4)
-        )[0]
-
-        offset = cellbyte_count + 33
-        self.to_protection_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8B", offset, 2))[0]
-        )
+        self.soc = status["soc"]
 
-        offset = cellbyte_count + 36
-        self.to_fet_bits(
-            unpack_from(">H", self.get_data(status_data, b"\x8C", offset, 2))[0]
-        )
+        self.cycles = status["cycles"]
 
-        offset = cellbyte_count + 84
-        self.to_balance_bits(
-            unpack_from(">B", self.get_data(status_data, b"\x9D", offset, 1))[0]
-        )
+        # self.capacity_remain is at offset cellbyte_count + 25 with ID code 0x89
+        self.capacity = status["capacity"]
+
+        self.to_protection_bits(status["protection"])
+
+        self.to_fet_bits(status["fet"])
+
+        self.to_balance_bits(status["balance"])
 
         # "User Private Data" field in APP
-        offset = cellbyte_count + 155
         tmp = sub(
             " +",
             " ",
-            (
-                unpack_from(">8s", self.get_data(status_data, b"\xB4", offset, 8))[0]
-                .decode()
-                .replace("\x00", " ")
-                .strip()
-            ),
+            (status["custom_field"].decode().replace("\x00", " ").strip()),
         )
         self.custom_field = tmp if tmp != "Input Us" else None
 
         # production date
         try:
-            offset = cellbyte_count + 164
-            tmp = unpack_from(">4s", self.get_data(status_data, b"\xB5", offset, 4))[
-                0
-            ].decode()
+            tmp = status["production"].decode()
             self.production = "20" + tmp + "01" if tmp and tmp != "" else None
         except UnicodeDecodeError:
             self.production = None
 
-        offset = cellbyte_count + 174
-        self.version = unpack_from(
-            ">15s", self.get_data(status_data, b"\xB7", offset, 15)
-        )[0].decode()
+        self.version = status["version"].decode()
 
-        offset = cellbyte_count + 197
         self.unique_identifier_tmp = sub(
             " +",
             "_",
             (
-                unpack_from(">24s", self.get_data(status_data, b"\xBA", offset, 24))[0]
+                status["unique_identifier"]
                 .decode()
                 .replace("\x00", " ")
                 .replace("Input Userda", "")
@@ -213,11 +215,11 @@ class Jkbms(Battery):
         )
 
         # show wich cells are balancing
-        if self.get_min_cell() is not None and self.get_max_cell() is not None:
+        min_cell = self.get_min_cell()
+        max_cell = self.get_max_cell()
+        if min_cell is not None and max_cell is not None:
             for c in range(self.cell_count):
-                if self.balancing and (
-                    self.get_min_cell() == c or self.get_max_cell() == c
-                ):
+                if self.balancing and (min_cell == c or max_cell == c):
                     self.cells[c].balance = True
                 else:
                     self.cells[c].balance = False
@@ -5,7 +5,8 @@ from utils import logger
 import utils
 from time import sleep, time
 from bms.jkbms_brn import Jkbms_Brn
-import os
+from bms.ble_manager import get_ble_manager
+from bms.ble_link_monitor import get_ble_link_monitor
 import sys
 
 # from bleak import BleakScanner, BleakError
@@ -23,8 +24,9 @@ class Jkbms_Ble(Battery):
         )
         self.address = address
         self.type = self.BATTERYTYPE
-        self.jk = Jkbms_Brn(address, lambda: self.reset_bluetooth())
+        self.jk = Jkbms_Brn(address)
         self.unique_identifier_tmp = ""
+        self.ble_link = get_ble_link_monitor().watch(address, self.on_link_lost)
 
         logger.info("Init of Jkbms_Ble at " + address)
 
@@ -137,6 +139,10 @@ class Jkbms_Ble(Battery):
         """
         return self.unique_identifier_tmp
 
+    def on_link_lost(self):
+        # end the scraping of the lost connection at once, so that it reconnects
+        self.jk.wakeup()
+
     def use_callback(self, callback: Callable) -> bool:
         self.jk.set_callback(callback)
         return callback is not None
@@ -157,18 +163,17 @@ class Jkbms_Ble(Battery):
             logger.info(
                 f"Jkbms_Ble: Bluetooth connection interrupted. Got no fresh data since {last_update}s."
             )
-            # show Bluetooth signal strength (RSSI)
-            bluetoothctl_info = os.popen(
-                "bluetoothctl info "
-                + self.address
-                + ' | grep -i -E "device|name|alias|pair|trusted|blocked|connected|rssi|power"'
-            )
-            logger.info(bluetoothctl_info.read())
-            bluetoothctl_info.close()
+            # show Bluetooth connection state and signal strength (RSSI)
+            logger.info(str(self.ble_link))
 
-            # if the thread is still alive but data too old there is something
-            # wrong with the bt-connection; restart whole stack
-            if not self.resetting and last_update >= 60:
+            # if the device is still connected but data too old there is something
+            # wrong with the bt-connection; restart whole stack.
+            # A lost connection is already reconnected by the scraping
+            if (
+                not self.resetting
+                and last_update >= 60
+                and self.ble_link.connected is not False
+            ):
                 logger.error(
                     "Jkbms_Ble: Bluetooth died. Restarting Bluetooth system driver."
                 )
@@ -258,23 +263,16 @@ class Jkbms_Ble(Battery):
         return True
 
     def reset_bluetooth(self):
-        logger.info("Reset of system Bluetooth daemon triggered")
+        logger.info("Reconnect of Bluetooth triggered")
         self.resetting = True
         if self.jk.is_running():
             if self.jk.stop_scraping():
-                logger.info("Scraping stopped, issuing sys-commands")
+                logger.info("Scraping stopped")
             else:
-                logger.warning("Scraping was unable to stop, issuing sys-commands")
-
-        # process kill is needed, since the service/bluetooth driver is probably freezed
-        os.system('pkill -f "bluetoothd"')
-        # stop will not work, if service/bluetooth driver is stuck
-        # os.system("/etc/init.d/bluetooth stop")
-        sleep(2)
-        os.system("rfkill block bluetooth")
-        os.system("rfkill unblock bluetooth")
-        os.system("/etc/init.d/bluetooth start")
-        logger.info("System Bluetooth daemon should have been restarted")
+                logger.warning("Scraping was unable to stop")
+
+        # the system Bluetooth daemon is restarted by the manager, if all BLE devices failed
+        get_ble_manager().report_failure(self.address)
 
     def get_balancing(self):
         return 1 if self.balancing else 0
@@ -282,5 +280,5 @@ class Jkbms_Ble(Battery):
     def trigger_soc_reset(self):
         if utils.AUTO_RESET_SOC:
             self.jk.max_cell_voltage = self.get_max_cell_voltage()
-            self.jk.trigger_soc_reset = True
+            self.jk.request_soc_reset()
         return
@@ -1,15 +1,17 @@
 from struct import unpack_from, calcsize
 from bleak import BleakScanner, BleakClient, exc
+from collections import deque
+from copy import deepcopy
 from time import sleep, time
 import asyncio
+import concurrent.futures
+import logging
 import threading
 import sys
 
 # if used as standalone script then use custom logger
 # else import logger from utils
 if __name__ == "__main__":
-    import logging
-
     logger = logging.basicConfig(level=logging.DEBUG)
 
     def bytearray_to_string(data):
@@ -17,9 +19,12 @@ if __name__ == "__main__":
 
 else:
     from utils import bytearray_to_string, logger
+    from bms.ble_manager import get_ble_manager
 
 # zero means parse all incoming data (every second)
 CELL_INFO_REFRESH_S = 0
+# while connected, check at this interval if the main thread is still alive
+MAIN_THREAD_CHECK_S = 1
 CHAR_HANDLE = "0000ffe1-0000-1000-8000-00805f9b34fb"
 CHAR_HANDLE_FAILOVER = 4
 MODEL_NBR_UUID = "00002a24-0000-1000-8000-00805f9b34fb"
@@ -40,6 +45,8 @@ protocol_version = PROTOCOL_VERSION_JK02
 
 MIN_RESPONSE_SIZE = 300
 MAX_RESPONSE_SIZE = 320
+# every response starts with this sequence
+RESPONSE_HEADER = b"\x55\xaa\xeb\x90"
 
 TRANSLATE_DEVICE_INFO = [
     [["device_info", "hw_rev"], 22, "8s"],
@@ -120,9 +127,6 @@ class Jkbms_Brn:
     # entries for translating the bytearray to py-object via unpack
     # [[py dict entry as list, each entry ] ]
 
-    frame_buffer = bytearray()
-    bms_status = {}
-
     waiting_for_response = ""
     last_cell_info = 0
 
@@ -141,15 +145,32 @@ class Jkbms_Brn:
     # translate info placeholder, since it depends on the bms_max_cell_count
     translate_cell_info = []
 
-    def __init__(self, addr, reset_bt_callback=None):
+    def __init__(self, addr):
         self.address = addr
-        self.bt_thread = None
-        self.bt_thread_monitor = threading.Thread(
-            target=self.monitor_scraping, name="Thread-JKBMS-Monitor"
-        )
-        self.bt_reset = reset_bt_callback
+        self.bms_status = {}
+        # the cell count is written to the translation tables, which therefore belong to the instance
+        self.translate_cell_info_24s = deepcopy(TRANSLATE_CELL_INFO_24S)
+        self.translate_cell_info_32s = deepcopy(TRANSLATE_CELL_INFO_32S)
+        # the notifications are reassembled in place, the decoders read the frame through frame_view
+        self.frame_buffer = bytearray(MAX_RESPONSE_SIZE)
+        self.frame_view = memoryview(self.frame_buffer)
+        self.frame_length = 0
+        # the latest cell info frame is only stored and decoded by get_status(),
+        # since there are a lot more frames than polls
+        self.cell_info_frame = bytearray(MAX_RESPONSE_SIZE)
+        self.cell_info_view = memoryview(self.cell_info_frame)
+        self.cell_info_length = 0
+        self.cell_info_sequence = 0
+        self.cell_info_decoded_sequence = 0
+        self.cell_info_lock = threading.Lock()
+        # the scraping runs on the loop of the BLE manager, which is shared by all BLE batteries
+        self.scraping_future = None
         self.should_be_scraping = False
-        self.trigger_soc_reset = False
+        # commands are queued from any thread and executed by the scraping coroutine,
+        # which sleeps until a command is queued, the bms disconnects or scraping is stopped
+        self.commands = deque()
+        self.loop = None
+        self.wakeup_event = None
 
     async def scanForDevices(self):
         devices = await BleakScanner.discover()
@@ -158,9 +179,7 @@ class Jkbms_Brn:
 
     # check where the bms data starts and
     # if the bms is a 24s or 32s type
-    def get_bms_max_cell_count(self):
-        fb = self.frame_buffer
-        logger.debug(self.frame_buffer)
+    def get_bms_max_cell_count(self, fb, length):
 
         # old check to recognize 32s
         # what does this check validate?
@@ -169,23 +188,25 @@ class Jkbms_Brn:
 
         # logger can be removed after releasing next stable
         # current version v1.0.20231102dev
-        logger.debug(f"fb[38]: {fb[36]}.{fb[37]}.{fb[38]}.{fb[39]}.{fb[40]}")
-        logger.debug(f"fb[54]: {fb[52]}.{fb[53]}.{fb[54]}.{fb[55]}.{fb[56]}")
-        logger.debug(f"fb[70]: {fb[68]}.{fb[69]}.{fb[70]}.{fb[71]}.{fb[72]}")
-        logger.debug(f"fb[134]: {fb[132]}.{fb[133]}.{fb[134]}.{fb[135]}.{fb[136]}")
-        logger.debug(f"fb[144]: {fb[142]}.{fb[143]}.{fb[144]}.{fb[145]}.{fb[146]}")
-        logger.debug(f"fb[289]: {fb[287]}.{fb[288]}.{fb[289]}.{fb[290]}.{fb[291]}")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(bytearray_to_string(fb[:length]))
+            logger.debug(f"fb[38]: {fb[36]}.{fb[37]}.{fb[38]}.{fb[39]}.{fb[40]}")
+            logger.debug(f"fb[54]: {fb[52]}.{fb[53]}.{fb[54]}.{fb[55]}.{fb[56]}")
+            logger.debug(f"fb[70]: {fb[68]}.{fb[69]}.{fb[70]}.{fb[71]}.{fb[72]}")
+            logger.debug(f"fb[134]: {fb[132]}.{fb[133]}.{fb[134]}.{fb[135]}.{fb[136]}")
+            logger.debug(f"fb[144]: {fb[142]}.{fb[143]}.{fb[144]}.{fb[145]}.{fb[146]}")
+            logger.debug(f"fb[289]: {fb[287]}.{fb[288]}.{fb[289]}.{fb[290]}.{fb[291]}")
 
         # if BMS has a max of 32s the data at fb[287] is not empty
         if fb[287] > 0:
             self.bms_max_cell_count = 32
-            self.translate_cell_info = TRANSLATE_CELL_INFO_32S
+            self.translate_cell_info = self.translate_cell_info_32s
         # if BMS has a max of 24s the data ends at fb[219]
         else:
             self.bms_max_cell_count = 24
-            self.translate_cell_info = TRANSLATE_CELL_INFO_24S
+            self.translate_cell_info = self.translate_cell_info_24s
 
-        logger.debug(f"bms_max_cell_count recognized: {self.bms_max_cell_count}")
+        logger.debug("bms_max_cell_count recognized: %d", self.bms_max_cell_count)
 
     # iterative implementation maybe later due to referencing
     def translate(self, fb, translation, o, f32s=False, i=0):
@@ -219,9 +240,8 @@ class Jkbms_Brn:
                     )
                     i += translation[2]
                 else:
-                    val = unpack_from(
-                        translation[2], bytearray(fb), translation[1] + i + offset
-                    )[0]
+                    position = translation[1] + i + offset
+                    val = unpack_from(translation[2], fb, position)[0]
                     # calculate stepping in case of array
                     i = i + calcsize(translation[2])
 
@@ -246,7 +266,7 @@ class Jkbms_Brn:
             self.translate(fb, translation, o[translation[0][i]], f32s=f32s, i=i + 1)
 
     def decode_warnings(self, fb):
-        val = unpack_from("<H", bytearray(fb), 136)[0]
+        val = unpack_from("<H", fb, 136)[0]
 
         self.bms_status["cell_info"]["error_bitmask_16"] = hex(val)
         self.bms_status["cell_info"]["error_bitmask_2"] = format(val, "016b")
@@ -266,39 +286,41 @@ class Jkbms_Brn:
         # bis hierhin verifiziert, rest zu testen
 
     def decode_device_info_jk02(self):
-        fb = self.frame_buffer
+        fb = self.frame_view
         for t in TRANSLATE_DEVICE_INFO:
             self.translate(fb, t, self.bms_status)
 
     def decode_cellinfo_jk02(self):
-        fb = self.frame_buffer
+        fb = self.cell_info_view
         has32s = self.bms_max_cell_count == 32
         for t in self.translate_cell_info:
             self.translate(fb, t, self.bms_status, f32s=has32s)
         self.decode_warnings(fb)
-        logger.debug("decode_cellinfo_jk02(): self.frame_buffer")
-        logger.debug(self.frame_buffer)
-        logger.debug(self.bms_status)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("decode_cellinfo_jk02(): self.cell_info_frame")
+            logger.debug(bytearray_to_string(fb[: self.cell_info_length]))
+            logger.debug(self.bms_status)
 
     def decode_settings_jk02(self):
-        fb = self.frame_buffer
+        fb = self.frame_view
         for t in TRANSLATE_SETTINGS:
             self.translate(fb, t, self.bms_status)
         logger.debug(self.bms_status)
 
     def decode(self):
         # check what kind of info the frame contains
-        info_type = self.frame_buffer[4]
-        self.get_bms_max_cell_count()
+        info_type = self.frame_view[4]
         if info_type == 0x01:
             logger.debug("Processing frame with settings info")
             if protocol_version == PROTOCOL_VERSION_JK02:
-                self.decode_settings_jk02()
-                # adapt translation table for cell array lengths
-                ccount = self.bms_status["settings"]["cell_count"]
-                for i, t in enumerate(self.translate_cell_info):
-                    if t[0][-2] == "voltages" or t[0][-2] == "voltages":
-                        self.translate_cell_info[i][0][-1] = ccount
+                with self.cell_info_lock:
+                    self.get_bms_max_cell_count(self.frame_view, self.frame_length)
+                    self.decode_settings_jk02()
+                    # adapt translation table for cell array lengths
+                    ccount = self.bms_status["settings"]["cell_count"]
+                    for i, t in enumerate(self.translate_cell_info):
+                        if t[0][-2] == "voltages" or t[0][-2] == "voltages":
+                            self.translate_cell_info[i][0][-1] = ccount
                 self.bms_status["last_update"] = time()
 
         elif info_type == 0x02:
@@ -307,16 +329,14 @@ class Jkbms_Brn:
                 or time() - self.last_cell_info > CELL_INFO_REFRESH_S
             ):
                 self.last_cell_info = time()
-                logger.debug("processing frame with battery cell info")
+                logger.debug("storing frame with battery cell info")
                 if protocol_version == PROTOCOL_VERSION_JK02:
-                    self.decode_cellinfo_jk02()
+                    with self.cell_info_lock:
+                        length = self.frame_length
+                        self.cell_info_frame[:length] = self.frame_view[:length]
+                        self.cell_info_length = length
+                        self.cell_info_sequence += 1
                     self.bms_status["last_update"] = time()
-                # power is calculated from voltage x current as
-                # register 122 contains unsigned power-value
-                self.bms_status["cell_info"]["power"] = (
-                    self.bms_status["cell_info"]["current"]
-                    * self.bms_status["cell_info"]["total_voltage"]
-                )
                 if self.waiting_for_response == "cell_info":
                     self.waiting_for_response = ""
 
@@ -334,49 +354,65 @@ class Jkbms_Brn:
         self._new_data_callback = callback
 
     def assemble_frame(self, data: bytearray):
-        logger.debug(
-            f"--> assemble_frame() -> self.frame_buffer (before extend) -> lenght:  {len(self.frame_buffer)}"
-        )
-        logger.debug(self.frame_buffer)
-        if len(self.frame_buffer) > MAX_RESPONSE_SIZE:
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
             logger.debug(
-                "data dropped because it alone was longer than max frame length"
+                f"--> assemble_frame() -> self.frame_buffer (before extend) -> lenght:  {self.frame_length}"
             )
-            self.frame_buffer = []
 
-        if data[0] == 0x55 and data[1] == 0xAA and data[2] == 0xEB and data[3] == 0x90:
+        data = memoryview(data)
+        if data[:4] == RESPONSE_HEADER:
             # beginning of new frame, clear buffer
-            self.frame_buffer = []
+            self.frame_length = 0
+        elif self.frame_length == 0:
+            # no frame started yet, resync to the next header in the data
+            start = bytes(data).find(RESPONSE_HEADER)
+            if start == -1:
+                if debug:
+                    logger.debug("data dropped because no frame header was found")
+                return
+            data = data[start:]
+
+        if self.frame_length + len(data) > MAX_RESPONSE_SIZE:
+            if debug:
+                logger.debug("data dropped because it exceeds the max frame length")
+            self.frame_length = 0
+            return
 
-        self.frame_buffer.extend(data)
+        self.frame_buffer[self.frame_length : self.frame_length + len(data)] = data
+        self.frame_length += len(data)
 
-        logger.debug(
-            f"--> assemble_frame() -> self.frame_buffer (after extend) -> lenght:  {len(self.frame_buffer)}"
-        )
-        logger.debug(self.frame_buffer)
-        if len(self.frame_buffer) >= MIN_RESPONSE_SIZE:
+        if debug:
+            logger.debug(
+                f"--> assemble_frame() -> self.frame_buffer (after extend) -> lenght:  {self.frame_length}"
+            )
+
+        if self.frame_length >= MIN_RESPONSE_SIZE:
             # check crc; always at position 300, independent of
             # actual frame-lentgh, so crc up to 299
-            ccrc = self.crc(self.frame_buffer, 300 - 1)
+            ccrc = self.crc(self.frame_view, 300 - 1)
             rcrc = self.frame_buffer[300 - 1]
-            logger.debug(f"compair recvd. crc: {rcrc} vs calc. crc: {ccrc}")
+            if debug:
+                logger.debug(f"compair recvd. crc: {rcrc} vs calc. crc: {ccrc}")
             if ccrc == rcrc:
-                logger.debug("great success! frame complete and sane, lets decode")
+                if debug:
+                    logger.debug("great success! frame complete and sane, lets decode")
                 self.decode()
-                self.frame_buffer = []
+                self.frame_length = 0
                 if self._new_data_callback is not None:
                     self._new_data_callback()
+            else:
+                # the crc does not change with more data, wait for the next header
+                self.frame_length = 0
 
     def ncallback(self, sender: int, data: bytearray):
-        logger.debug(f"--> NEW PACKAGE! lenght:  {len(data)}")
-        logger.debug("ncallback(): " + bytearray_to_string(data))
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"--> NEW PACKAGE! lenght:  {len(data)}")
+            logger.debug("ncallback(): " + bytearray_to_string(data))
         self.assemble_frame(data)
 
     def crc(self, arr: bytearray, length: int) -> int:
-        crc = 0
-        for a in arr[:length]:
-            crc = crc + a
-        return crc.to_bytes(2, "little")[0]
+        return sum(memoryview(arr)[:length]) & 0xFF
 
     async def write_register(
         self,
@@ -449,29 +485,94 @@ class Jkbms_Brn:
 
         await self.write_register(cmd, b"\0\0\0\0", 0x00, client, False)
 
+    def decode_cell_info(self):
+        """
+        Decode the latest cell info frame, if it was not decoded yet.
+        """
+        with self.cell_info_lock:
+            if self.cell_info_decoded_sequence == self.cell_info_sequence:
+                return
+
+            logger.debug("processing frame with battery cell info")
+            self.get_bms_max_cell_count(self.cell_info_view, self.cell_info_length)
+            self.decode_cellinfo_jk02()
+            # power is calculated from voltage x current as
+            # register 122 contains unsigned power-value
+            self.bms_status["cell_info"]["power"] = (
+                self.bms_status["cell_info"]["current"]
+                * self.bms_status["cell_info"]["total_voltage"]
+            )
+            self.cell_info_decoded_sequence = self.cell_info_sequence
+
     def get_status(self):
+        self.decode_cell_info()
         if "settings" in self.bms_status and "cell_info" in self.bms_status:
             return self.bms_status
         else:
             return None
 
-    def connect_and_scrape(self):
-        asyncio.run(self.asy_connect_and_scrape())
+    async def scrape(self):
+        manager = get_ble_manager()
+        while self.should_be_scraping and self.main_thread.is_alive():
+            await self.asy_connect_and_scrape()
+            if self.should_be_scraping:
+                # reconnect with the backoff of this device,
+                # the adapter is reset by the manager, if all devices failed
+                logger.debug("scraping ended: reconnecting")
+                manager.report_failure(self.address)
+
+    def wakeup(self):
+        """
+        Wake up the scraping thread, can be called from any thread.
+        """
+        loop = self.loop
+        if loop is None:
+            return
+        try:
+            loop.call_soon_threadsafe(self.wakeup_event.set)
+        except RuntimeError:
+            # the loop was closed in the meantime
+            pass
+
+    def queue_command(self, command, *args):
+        """
+        Queue a command for the scraping thread, can be called from any thread.
+        If the bms is not connected, the command is executed after the next connect.
+
+        :param command: coroutine function, which is called with the BleakClient and args
+        """
+        self.commands.append((command, args))
+        self.wakeup()
+
+    async def execute_commands(self, client):
+        while self.commands and client.is_connected:
+            command, args = self.commands.popleft()
+            await command(client, *args)
+
+    def on_disconnect(self, client):
+        logger.debug("--> on_disconnect(): bms disconnected")
+        self.wakeup_event.set()
+
+    def request_soc_reset(self):
+        self.queue_command(self.reset_soc_jk)
 
-    # self.bt_thread
     async def asy_connect_and_scrape(self):
         logger.debug(
             "--> asy_connect_and_scrape(): Connect and scrape on address: "
             + self.address
         )
         self.run = True
+        self.wakeup_event = asyncio.Event()
+        self.loop = asyncio.get_running_loop()
         while self.run and self.main_thread.is_alive():  # autoreconnect
-            client = BleakClient(self.address)
+            client = BleakClient(self.address, disconnected_callback=self.on_disconnect)
             logger.debug("--> asy_connect_and_scrape(): btloop")
 
             try:
                 logger.debug("--> asy_connect_and_scrape(): reconnect")
-                await client.connect()
+                async with get_ble_manager().connection_attempt(self.address):
+                    await client.connect()
+                get_ble_manager().report_success(self.address)
 
                 # try to get MODEL_NBR_UUID, since not all JKBMS send it
                 try:
@@ -512,10 +613,14 @@ class Jkbms_Brn:
                 # await self.enable_charging(client)
                 # last_dev_info = time()
                 while client.is_connected and self.run and self.main_thread.is_alive():
-                    if self.trigger_soc_reset:
-                        self.trigger_soc_reset = False
-                        await self.reset_soc_jk(client)
-                    await asyncio.sleep(0.01)
+                    await self.execute_commands(client)
+                    try:
+                        await asyncio.wait_for(
+                            self.wakeup_event.wait(), MAIN_THREAD_CHECK_S
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    self.wakeup_event.clear()
 
             except exc.BleakDeviceNotFoundError:
                 logger.info(
@@ -555,48 +660,34 @@ class Jkbms_Brn:
                             + f"of type {exception_type} in {file} line #{line}"
                         )
 
+        self.loop = None
         logger.info("--> asy_connect_and_scrape(): Exit")
 
-    def monitor_scraping(self):
-        while self.should_be_scraping is True:
-            self.bt_thread = threading.Thread(
-                target=self.connect_and_scrape, name="Thread-JKBMS-Connect-and-Scrape"
-            )
-            self.bt_thread.start()
-            logger.debug(
-                "scraping thread started -> main thread id: "
-                + str(self.main_thread.ident)
-                + " scraping thread: "
-                + str(self.bt_thread.ident)
-            )
-            self.bt_thread.join()
-            if self.should_be_scraping is True:
-                logger.debug("scraping thread ended: reseting bluetooth and restarting")
-                if self.bt_reset is not None:
-                    self.bt_reset()
-                sleep(2)
-
     def start_scraping(self):
         self.main_thread = threading.current_thread()
         if self.is_running():
-            logger.debug("scraping thread already running")
+            logger.debug("scraping already running")
             return
         self.should_be_scraping = True
-        self.bt_thread_monitor.start()
+        self.scraping_future = get_ble_manager().run_coroutine(self.scrape())
 
     def stop_scraping(self):
         self.run = False
         self.should_be_scraping = False
-        stop = time()
-        while self.is_running():
-            sleep(0.1)
-            if time() - stop > 10:
-                return False
-        return True
+        self.wakeup()
+        if self.scraping_future is not None:
+            try:
+                self.scraping_future.result(10)
+            except concurrent.futures.TimeoutError:
+                # e.g. waiting for the reconnect backoff
+                self.scraping_future.cancel()
+            except Exception:
+                pass
+        return not self.is_running()
 
     def is_running(self):
-        if self.bt_thread is not None:
-            return self.bt_thread.is_alive()
+        if self.scraping_future is not None:
+            return not self.scraping_future.done()
         return False
 
     async def enable_charging(self, c):
@@ -10,8 +10,8 @@ from utils import (
     MIN_CELL_VOLTAGE,
     JKBMS_CAN_CELL_COUNT,
     zero_char,
+    FrameSchema,
 )
-from struct import unpack_from
 import can
 import time
 
@@ -60,6 +60,34 @@ class Jkbms_Can(Battery):
         ALM_INFO: [0x07F4, 0x07F5],
     }
 
+    # payload of the CAN frames, decoded directly from msg.data
+    BATT_STAT_SCHEMA = FrameSchema(
+        [
+            ("voltage", 0, "H", 10),
+            ("current", 2, "H", 10),
+            ("soc", 4, "B"),
+            ("time_to_go", 6, "H"),
+        ],
+        byteorder="<",
+    )
+    CELL_VOLT_SCHEMA = FrameSchema(
+        [
+            ("max_cell_volt", 0, "H", 1000),
+            ("max_cell_nr", 2, "B"),
+            ("min_cell_volt", 3, "H", 1000),
+            ("min_cell_nr", 5, "B"),
+        ],
+        byteorder="<",
+    )
+    CELL_TEMP_SCHEMA = FrameSchema(
+        [
+            ("max_temp", 0, "B"),
+            ("min_temp", 2, "B"),
+        ],
+        byteorder="<",
+    )
+    ALM_INFO_SCHEMA = FrameSchema([("alarms", 0, "L")], byteorder="<")
+
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
         # The result or call should be unique to this BMS. Battery name or version, etc.
@@ -209,17 +237,14 @@ class Jkbms_Can(Battery):
                 messages_to_read -= 1
                 # print(messages_to_read)
                 if msg.arbitration_id in self.CAN_FRAMES[self.BATT_STAT]:
-                    voltage = unpack_from("<H", bytes([msg.data[0], msg.data[1]]))[0]
-                    self.voltage = voltage / 10
-
-                    current = unpack_from("<H", bytes([msg.data[2], msg.data[3]]))[0]
-                    self.current = (current / 10) - 400
-
-                    self.soc = unpack_from("<B", bytes([msg.data[4]]))[0]
+                    batt_stat = self.BATT_STAT_SCHEMA.decode(msg.data)
+                    if batt_stat is None:
+                        continue
 
-                    self.time_to_go = (
-                        unpack_from("<H", bytes([msg.data[6], msg.data[7]]))[0] * 36
-                    )
+                    self.voltage = batt_stat["voltage"]
+                    self.current = batt_stat["current"] - 400
+                    self.soc = batt_stat["soc"]
+                    self.time_to_go = batt_stat["time_to_go"] * 36
 
                     # print(self.voltage)
                     # print(self.current)
@@ -227,16 +252,16 @@ class Jkbms_Can(Battery):
                     # print(self.time_to_go)
 
                 elif msg.arbitration_id in self.CAN_FRAMES[self.CELL_VOLT]:
-                    max_cell_volt = (
-                        unpack_from("<H", bytes([msg.data[0], msg.data[1]]))[0] / 1000
-                    )
-                    max_cell_nr = unpack_from("<B", bytes([msg.data[2]]))[0]
+                    cell_volt = self.CELL_VOLT_SCHEMA.decode(msg.data)
+                    if cell_volt is None:
+                        continue
+
+                    max_cell_volt = cell_volt["max_cell_volt"]
+                    max_cell_nr = cell_volt["max_cell_nr"]
                     max_cell_cnt = max(max_cell_nr, self.cell_count)
 
-                    min_cell_volt = (
-                        unpack_from("<H", bytes([msg.data[3], msg.data[4]]))[0] / 1000
-                    )
-                    min_cell_nr = unpack_from("<B", bytes([msg.data[5]]))[0]
+                    min_cell_volt = cell_volt["min_cell_volt"]
+                    min_cell_nr = cell_volt["min_cell_nr"]
                     max_cell_cnt = max(min_cell_nr, max_cell_cnt)
 
                     if max_cell_cnt > self.cell_count:
@@ -254,17 +279,22 @@ class Jkbms_Can(Battery):
                         self.cells[min_cell_nr - 1].balance = True
 
                 elif msg.arbitration_id in self.CAN_FRAMES[self.CELL_TEMP]:
-                    max_temp = unpack_from("<B", bytes([msg.data[0]]))[0] - 50
-                    min_temp = unpack_from("<B", bytes([msg.data[2]]))[0] - 50
+                    cell_temp = self.CELL_TEMP_SCHEMA.decode(msg.data)
+                    if cell_temp is None:
+                        continue
+
+                    max_temp = cell_temp["max_temp"] - 50
+                    min_temp = cell_temp["min_temp"] - 50
                     self.to_temp(1, max_temp if max_temp <= 100 else 100)
                     self.to_temp(2, min_temp if min_temp <= 100 else 100)
                     # print(max_temp)
                     # print(min_temp)
                 elif msg.arbitration_id in self.CAN_FRAMES[self.ALM_INFO]:
-                    alarms = unpack_from(
-                        "<L",
-                        bytes([msg.data[0], msg.data[1], msg.data[2], msg.data[3]]),
-                    )[0]
+                    alm_info = self.ALM_INFO_SCHEMA.decode(msg.data)
+                    if alm_info is None:
+                        continue
+
+                    alarms = alm_info["alarms"]
                     print("alarms %d" % (alarms))
                     self.last_error_time = time.time()
                     self.error_active = True
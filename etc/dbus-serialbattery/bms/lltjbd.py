@@ -1,6 +1,12 @@
 # -*- coding: utf-8 -*-
 from battery import Protection, Battery, Cell
-from utils import is_bit_set, read_serial_data, logger
+from utils import (
+    is_bit_set,
+    read_serial_data,
+    logger,
+    FrameSchema,
+    get_array_struct,
+)
 import utils
 from struct import unpack_from, pack
 import struct
@@ -245,6 +251,14 @@ class LltJbd(Battery):
         self.trigger_force_disable_charge = None
         self.trigger_disable_balancer = None
         self.cycle_capacity = None
+        self.func_config = None
+        # read from the EEPROM in factory mode, which takes long, therefore cached between restarts
+        self.metadata_attributes = [
+            "cycle_capacity",
+            "max_battery_charge_current",
+            "max_battery_discharge_current",
+            "func_config",
+        ]
         # list of available callbacks, in order to display the buttons in the GUI
         self.available_callbacks = [
             "force_charging_off_callback",
@@ -252,6 +266,24 @@ class LltJbd(Battery):
             "turn_balancing_off_callback",
         ]
 
+        # commands executed on refresh_data() with their refresh period in seconds
+        # the cells are created by read_gen_data(), which also reads the balancing state
+        self.poll_scheduler.add(
+            "write_charge_discharge_mos",
+            self.write_charge_discharge_mos,
+            ignore_result=True,
+        )
+        self.poll_scheduler.add(
+            "write_balancer", self.write_balancer, ignore_result=True
+        )
+        self.poll_scheduler.add("read_gen_data", self.read_gen_data)
+        self.poll_scheduler.add(
+            "read_cell_data",
+            self.read_cell_data,
+            utils.POLL_INTERVAL_CELLS,
+            depends_on=["read_gen_data"],
+        )
+
     # degree_sign = u'\N{DEGREE SIGN}'
     BATTERYTYPE = "LLT/JBD"
     LENGTH_CHECK = 6
@@ -298,25 +330,56 @@ class LltJbd(Battery):
             return False
         self.max_battery_charge_current = utils.MAX_BATTERY_CHARGE_CURRENT
         self.max_battery_discharge_current = utils.MAX_BATTERY_DISCHARGE_CURRENT
+
+        if self.load_metadata():
+            # read the EEPROM once on one of the next polls to update the cache
+            self.poll_scheduler.add(
+                "read_eeprom_data",
+                self.read_eeprom_data,
+                None,
+                depends_on=["read_gen_data"],
+                ignore_result=True,
+            )
+        else:
+            self.read_eeprom_data()
+
+        return True
+
+    def read_eeprom_data(self):
+        # values which could not be read keep their default or cached value
+        complete = True
         with self.eeprom(writable=False):
             cycle_cap = self.read_serial_data_llt(readCmd(REG_CYCLE_CAP))
             if cycle_cap:
                 self.cycle_capacity = float(unpack_from(">H", cycle_cap)[0])
+            else:
+                complete = False
             charge_over_current = self.read_serial_data_llt(readCmd(REG_CHGOC))
             if charge_over_current:
                 self.max_battery_charge_current = abs(
                     float(unpack_from(">h", charge_over_current)[0] / 100.0)
                 )
+            else:
+                complete = False
             discharge_over_current = self.read_serial_data_llt(readCmd(REG_DSGOC))
             if discharge_over_current:
                 self.max_battery_discharge_current = abs(
                     float(unpack_from(">h", discharge_over_current)[0] / -100.0)
                 )
+            else:
+                complete = False
             func_config = self.read_serial_data_llt(readCmd(REG_FUNC_CONFIG))
             if func_config:
                 self.func_config = unpack_from(">H", func_config)[0]
                 self.balance_fet = (self.func_config & FUNC_BALANCE_EN) != 0
+            else:
+                complete = False
 
+        # cache only complete data, else the defaults would be served on the next start
+        if complete:
+            self.save_metadata()
+
+        # the EEPROM is read only once, also if a value could not be read
         return True
 
     def reset_soc_callback(self, path, value):
@@ -465,9 +528,7 @@ class LltJbd(Battery):
         return True
 
     def refresh_data(self):
-        self.write_charge_discharge_mos()
-        self.write_balancer()
-        return self.read_gen_data() and self.read_cell_data()
+        return self.poll_scheduler.run()
 
     def to_protection_bits(self, byte_data):
         tmp = bin(byte_data)[2:].rjust(13, utils.zero_char)
@@ -552,30 +613,49 @@ class LltJbd(Battery):
         self.charge_fet = is_bit_set(tmp[1])
         self.discharge_fet = is_bit_set(tmp[0])
 
+    # fields of the general data, followed by the temperatures
+    GEN_SCHEMA = FrameSchema(
+        [
+            ("voltage", 0, "H", 100),
+            ("current", 2, "h", 100),
+            ("capacity_remain", 4, "H"),
+            ("capacity", 6, "H"),
+            ("cycles", 8, "H"),
+            ("production", 10, "H"),
+            ("balance", 12, "h"),
+            ("balance2", 14, "H"),
+            ("protection", 16, "H"),
+            ("version", 18, "B"),
+            ("soc", 19, "B"),
+            ("fet", 20, "B"),
+            ("cell_count", 21, "B"),
+            ("temp_sensors", 22, "B"),
+        ]
+    )
+
     def read_gen_data(self):
         gen_data = self.read_serial_data_llt(self.command_general)
         # check if connect success
-        if gen_data is False or len(gen_data) < 23:
+        if gen_data is False:
             return False
 
-        (
-            voltage,
-            current,
-            capacity_remain,
-            capacity,
-            self.cycles,
-            self.production,
-            balance,
-            balance2,
-            protection,
-            version,
-            soc,
-            fet,
-            self.cell_count,
-            self.temp_sensors,
-        ) = unpack_from(">HhHHHHhHHBBBBB", gen_data)
-        self.voltage = voltage / 100
-        self.current = current / 100
+        gen = self.GEN_SCHEMA.decode(gen_data)
+        if gen is None:
+            return False
+
+        capacity_remain = gen["capacity_remain"]
+        capacity = gen["capacity"]
+        balance = gen["balance"]
+        balance2 = gen["balance2"]
+        protection = gen["protection"]
+        version = gen["version"]
+        fet = gen["fet"]
+        self.cycles = gen["cycles"]
+        self.production = gen["production"]
+        self.cell_count = gen["cell_count"]
+        self.temp_sensors = gen["temp_sensors"]
+        self.voltage = gen["voltage"]
+        self.current = gen["current"]
         # https://github.com/Louisvdw/dbus-serialbattery/issues/769#issuecomment-1720805325
         if not self.cycle_capacity or self.cycle_capacity < capacity_remain:
             self.cycle_capacity = capacity
@@ -592,20 +672,21 @@ class LltJbd(Battery):
         self.min_battery_voltage = utils.MIN_CELL_VOLTAGE * self.cell_count
 
         # 0 = MOS, 1 = temp 1, 2 = temp 2
-        for t in range(self.temp_sensors):
-            if len(gen_data) < 23 + (2 * t) + 2:
-                logger.warn(
-                    "Expected %d temperature sensors, but received only %d sensor readings!",
-                    self.temp_sensors,
-                    t,
-                )
-                return True
-            temperature = unpack_from(">H", gen_data, 23 + (2 * t))[0]
+        temp_count = min(self.temp_sensors, (len(gen_data) - 23) // 2)
+        temperatures = get_array_struct(">H", temp_count).unpack_from(gen_data, 23)
+        for t in range(temp_count):
             # if there is only one sensor, use it as the main temperature sensor
             if self.temp_sensors == 1:
-                self.to_temp(1, utils.kelvin_to_celsius(temperature / 10))
+                self.to_temp(1, utils.kelvin_to_celsius(temperatures[t] / 10))
             else:
-                self.to_temp(t, utils.kelvin_to_celsius(temperature / 10))
+                self.to_temp(t, utils.kelvin_to_celsius(temperatures[t] / 10))
+
+        if temp_count < self.temp_sensors:
+            logger.warn(
+                "Expected %d temperature sensors, but received only %d sensor readings!",
+                self.temp_sensors,
+                temp_count,
+            )
 
         return True
 
@@ -615,13 +696,9 @@ class LltJbd(Battery):
         if cell_data is False or len(cell_data) < self.cell_count * 2:
             return False
 
+        voltages = get_array_struct(">H", self.cell_count).unpack_from(cell_data)
         for c in range(self.cell_count):
-            try:
-                cell_volts = unpack_from(">H", cell_data, c * 2)
-                if len(cell_volts) != 0:
-                    self.cells[c].voltage = cell_volts[0] / 1000
-            except struct.error:
-                self.cells[c].voltage = 0
+            self.cells[c].voltage = voltages[c] / 1000
         return True
 
     def read_hardware_data(self):
@@ -1,24 +1,30 @@
 # -*- coding: utf-8 -*-
 import asyncio
 import atexit
-import functools
+import concurrent.futures
 import os
 import threading
 import sys
 import re
 from asyncio import CancelledError
-from time import sleep
-from typing import Union, Optional
-from utils import logger
+from time import time
+from typing import Dict, List, Tuple, Union, Optional
+from utils import bytearray_to_string, logger
 from bleak import BleakClient, BleakScanner, BLEDevice
 from bleak.exc import BleakDBusError
 from bms.lltjbd import LltJbdProtection, LltJbd
+from bms.ble_manager import get_ble_manager
+from bms.ble_link_monitor import get_ble_link_monitor
 
 BLE_SERVICE_UUID = "0000ff00-0000-1000-8000-00805f9b34fb"
 BLE_CHARACTERISTICS_TX_UUID = "0000ff02-0000-1000-8000-00805f9b34fb"
 BLE_CHARACTERISTICS_RX_UUID = "0000ff01-0000-1000-8000-00805f9b34fb"
 MIN_RESPONSE_SIZE = 6
 MAX_RESPONSE_SIZE = 256
+# seconds to wait for the replies of the commands, which were sent together
+REPLY_TIMEOUT = 20
+# while connected, check at this interval if the main thread is still alive
+MAIN_THREAD_CHECK_S = 1
 
 
 class LltJbd_Ble(LltJbd):
@@ -36,14 +42,27 @@ class LltJbd_Ble(LltJbd):
         self.main_thread = threading.current_thread()
         self.data: bytearray = bytearray()
         self.run = True
-        self.bt_thread = threading.Thread(
-            name="LltJbd_Ble_Loop", target=self.background_loop, daemon=True
-        )
+        # the connection runs on the loop of the BLE manager, which is shared by all BLE batteries
+        self.bt_future: Optional[concurrent.futures.Future] = None
         self.bt_loop: Optional[asyncio.AbstractEventLoop] = None
         self.bt_client: Optional[BleakClient] = None
         self.device: Optional[BLEDevice] = None
         self.response_queue: Optional[asyncio.Queue] = None
-        self.ready_event: Optional[asyncio.Event] = None
+        self.ready_event = threading.Event()
+        # set to drop the connection and to reconnect
+        self.reconnect = False
+        # wakes up the connected session on a disconnect, a reconnect request or a stop
+        self.session_event: Optional[asyncio.Event] = None
+        # received data of an incomplete response and the futures of the sent commands by register,
+        # together with the generation of the batch of commands, which registered them
+        self.rx_buffer: bytearray = bytearray()
+        self.pending_responses: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self.batch_generation = 0
+        # commands, which are sent together with the general data on refresh_data(), and their replies
+        self.pipelined_commands: List[bytes] = []
+        self.pipelined_replies: Dict[bytes, Union[bytearray, bool]] = {}
+
+        self.ble_link = get_ble_link_monitor().watch(address, self.on_link_lost)
 
         self.hci_uart_ok = True
         if not os.path.isfile("/tmp/dbus-blebattery-hciattach"):
@@ -69,45 +88,96 @@ class LltJbd_Ble(LltJbd):
 
     def on_disconnect(self, client):
         logger.info("BLE client disconnected")
+        self.wake_session()
 
-    async def bt_main_loop(self):
+    def on_link_lost(self):
+        # reconnect and answer the sent commands at once, instead of waiting for the REPLY_TIMEOUT
+        self.reconnect = True
+        self.wake_session()
+
+    def wake_session(self):
+        """
+        Wake up the connected session, which then checks if it has to end, can be called from any thread.
+        """
+        loop = self.bt_loop
+        if loop is None:
+            return
         try:
-            self.device = await BleakScanner.find_device_by_address(
-                self.address, cb=dict(use_bdaddr=True)
-            )
+            loop.call_soon_threadsafe(self.session_event.set)
+        except RuntimeError:
+            # the loop was closed in the meantime
+            pass
 
-        except Exception:
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            if "Bluetooth adapters" in repr(exception_object):
-                self.reset_hci_uart()
-            else:
-                logger.error(
-                    f"BleakScanner(): Exception occurred: {repr(exception_object)} of type {exception_type} "
-                    f"in {file} line #{line}"
+    def fail_pending_responses(self):
+        for _, future in self.pending_responses.values():
+            if not future.done():
+                future.set_result(False)
+        self.pending_responses.clear()
+
+    async def bt_main_loop(self):
+        manager = get_ble_manager()
+        async with manager.connection_attempt(self.address):
+            try:
+                self.device = await BleakScanner.find_device_by_address(
+                    self.address, cb=dict(use_bdaddr=True)
                 )
 
-            self.device = None
-            await asyncio.sleep(0.5)
-            # allow the bluetooth connection to recover
-            sleep(5)
+            except Exception:
+                exception_type, exception_object, exception_traceback = sys.exc_info()
+                file = exception_traceback.tb_frame.f_code.co_filename
+                line = exception_traceback.tb_lineno
+                if "Bluetooth adapters" in repr(exception_object):
+                    self.reset_hci_uart()
+                else:
+                    logger.error(
+                        f"BleakScanner(): Exception occurred: {repr(exception_object)} of type {exception_type} "
+                        f"in {file} line #{line}"
+                    )
+
+                self.device = None
 
         if not self.device:
-            self.run = False
+            # retry with the backoff of this device
+            manager.report_failure(self.address)
             return
 
         try:
-            async with BleakClient(
-                self.device, disconnected_callback=self.on_disconnect
-            ) as client:
+            client = BleakClient(self.device, disconnected_callback=self.on_disconnect)
+            async with manager.connection_attempt(self.address):
+                await client.connect()
+            manager.report_success(self.address)
+
+            try:
                 self.bt_client = client
                 self.bt_loop = asyncio.get_event_loop()
                 self.response_queue = asyncio.Queue()
+                self.session_event = asyncio.Event()
+                self.rx_buffer = bytearray()
+                self.reconnect = False
+                await client.start_notify(BLE_CHARACTERISTICS_RX_UUID, self.on_notify)
+                dispatcher = asyncio.ensure_future(self.dispatch_responses())
                 self.ready_event.set()
-                while self.run and client.is_connected and self.main_thread.is_alive():
-                    await asyncio.sleep(0.1)
-            self.bt_loop = None
+                while (
+                    self.run
+                    and not self.reconnect
+                    and client.is_connected
+                    and self.main_thread.is_alive()
+                ):
+                    # woken up by wake_session(), the timeout is only for the main thread check
+                    try:
+                        await asyncio.wait_for(
+                            self.session_event.wait(), MAIN_THREAD_CHECK_S
+                        )
+                    except asyncio.TimeoutError:
+                        pass
+                    self.session_event.clear()
+                dispatcher.cancel()
+            finally:
+                self.bt_loop = None
+                self.bt_client = None
+                self.fail_pending_responses()
+                if client.is_connected:
+                    await client.disconnect()
 
         # Exception occurred: TimeoutError() of type <class 'asyncio.exceptions.TimeoutError'>
         except asyncio.exceptions.TimeoutError:
@@ -118,9 +188,6 @@ class LltJbd_Ble(LltJbd):
                 f"BleakClient(): asyncio.exceptions.TimeoutError: {repr(exception_object)} of type {exception_type} "
                 f"in {file} line #{line}"
             )
-            # needed?
-            self.run = False
-            return
 
         except TimeoutError:
             exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -130,9 +197,6 @@ class LltJbd_Ble(LltJbd):
                 f"BleakClient(): TimeoutError: {repr(exception_object)} of type {exception_type} "
                 f"in {file} line #{line}"
             )
-            # needed?
-            self.run = False
-            return
 
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -142,32 +206,38 @@ class LltJbd_Ble(LltJbd):
                 f"BleakClient(): Exception occurred: {repr(exception_object)} of type {exception_type} "
                 f"in {file} line #{line}"
             )
-            # needed?
-            self.run = False
-            return
 
-    def background_loop(self):
+        if self.run:
+            # the connection failed or was lost, reconnect with the backoff of this device
+            manager.report_failure(self.address)
+
+    async def background_loop(self):
         while self.run and self.main_thread.is_alive():
-            asyncio.run(self.bt_main_loop())
+            await self.bt_main_loop()
+
+    def start_background_loop(self) -> bool:
+        """
+        Start the connection on the loop of the BLE manager, which is shared by all BLE batteries.
 
-    async def async_test_connection(self):
+        :return: True, if the device connected within 5 seconds
+        """
         if self.hci_uart_ok:
-            self.ready_event = asyncio.Event()
-            if not self.bt_thread.is_alive():
-                self.bt_thread.start()
+            if self.bt_future is None:
+                self.bt_future = get_ble_manager().run_coroutine(self.background_loop())
 
-                def shutdown_ble_atexit(thread):
+                def shutdown_ble_atexit(future):
                     self.run = False
-                    thread.join()
-
-                atexit.register(shutdown_ble_atexit, self.bt_thread)
-            try:
-                return await asyncio.wait_for(self.ready_event.wait(), timeout=5)
-            except asyncio.TimeoutError:
-                logger.error(">>> ERROR: Unable to connect with BLE device")
-                return False
-        else:
-            return False
+                    self.wake_session()
+                    try:
+                        future.result(5)
+                    except Exception:
+                        pass
+
+                atexit.register(shutdown_ble_atexit, self.bt_future)
+            if self.ready_event.wait(5):
+                return True
+            logger.error(">>> ERROR: Unable to connect with BLE device")
+        return False
 
     def test_connection(self):
         # call a function that will connect to the battery, send a command and retrieve the result.
@@ -178,7 +248,7 @@ class LltJbd_Ble(LltJbd):
         try:
             if self.address:
                 result = True
-            if result and asyncio.run(self.async_test_connection()):
+            if result and self.start_background_loop():
                 result = True
             if result:
                 result = super().test_connection()
@@ -205,80 +275,163 @@ class LltJbd_Ble(LltJbd):
         string = self.address.replace(":", "").lower()
         return string
 
-    async def send_command(self, command) -> Union[bytearray, bool]:
-        if not self.bt_client:
-            logger.error(">>> ERROR: No BLE client connection - returning")
-            return False
-
-        fut = self.bt_loop.create_future()
+    def on_notify(self, sender, data: bytearray):
+        """
+        Assemble the notifications to responses and queue every complete response.
+        A response is 0xDD, register, status, payload length, payload, checksum and 0x77.
+        """
+        buffer = self.rx_buffer
+        buffer.extend(data)
+        while len(buffer) >= self.LENGTH_POS + 1:
+            # resync to the start of the next response
+            if buffer[0] != 0xDD:
+                start = buffer.find(b"\xdd")
+                del buffer[: start if start != -1 else len(buffer)]
+                continue
+
+            length = buffer[self.LENGTH_POS] + self.LENGTH_POS + 4
+            if len(buffer) < length:
+                break
+
+            self.response_queue.put_nowait(buffer[:length])
+            del buffer[:length]
+
+        if len(buffer) > MAX_RESPONSE_SIZE:
+            logger.error(">>> ERROR: Response too long - dropped")
+            buffer.clear()
+
+    async def dispatch_responses(self):
+        """
+        Pass the queued responses to the futures of the commands by register.
+        """
+        while True:
+            response = await self.response_queue.get()
+            _, future = self.pending_responses.pop(response[1], (None, None))
+            if future is not None and not future.done():
+                future.set_result(response)
+            else:
+                logger.debug("unexpected response: " + bytearray_to_string(response))
 
-        def rx_callback(future: asyncio.Future, data: bytearray, sender, rx: bytearray):
-            data.extend(rx)
-            if len(data) < (self.LENGTH_POS + 1):
-                return
+    def discard_stale_responses(self):
+        """
+        Drop the received responses and the commands of previous batches before a new batch is sent.
+        A late reply to a command, which timed out, would else answer the next command of the same register.
+        """
+        while not self.response_queue.empty():
+            response = self.response_queue.get_nowait()
+            logger.debug("stale response dropped: " + bytearray_to_string(response))
+        self.rx_buffer.clear()
+        self.fail_pending_responses()
+
+    async def async_send_commands(
+        self, commands: List[bytes]
+    ) -> List[Union[bytearray, bool]]:
+        """
+        Send the commands back to back and wait for all replies.
 
-            length = data[self.LENGTH_POS]
-            if len(data) <= length + self.LENGTH_POS + 1:
-                return
-            if not future.done():
-                future.set_result(data)
+        :return: list with the reply or False for each command
+        """
+        self.discard_stale_responses()
+        self.batch_generation += 1
+        generation = self.batch_generation
 
-        rx_collector = functools.partial(rx_callback, fut, bytearray())
-        await self.bt_client.start_notify(BLE_CHARACTERISTICS_RX_UUID, rx_collector)
-        await self.bt_client.write_gatt_char(
-            BLE_CHARACTERISTICS_TX_UUID, command, False
-        )
-        result = await fut
-        await self.bt_client.stop_notify(BLE_CHARACTERISTICS_RX_UUID)
+        futures = []
+        try:
+            for command in commands:
+                # the register of the command is also the second byte of the response
+                future = self.bt_loop.create_future()
+                self.pending_responses[command[2]] = (generation, future)
+                futures.append(future)
+                await self.bt_client.write_gatt_char(
+                    BLE_CHARACTERISTICS_TX_UUID, command, False
+                )
 
-        return result
+            await asyncio.wait(futures, timeout=REPLY_TIMEOUT)
+
+            replies = []
+            for future in futures:
+                if future.done():
+                    replies.append(future.result())
+                else:
+                    logger.error(">>> ERROR: No reply - returning")
+                    replies.append(False)
+            return replies
+
+        finally:
+            # also if a write failed, the commands of this batch must not wait for a reply anymore
+            for command, future in zip(commands, futures):
+                if not future.done():
+                    future.cancel()
+                if (
+                    self.pending_responses.get(command[2], (None, None))[0]
+                    == generation
+                ):
+                    del self.pending_responses[command[2]]
+
+    def send_commands(self, commands: List[bytes]) -> List[Union[bytearray, bool]]:
+        """
+        Send the commands on the loop of the BLE thread and wait for the replies.
 
-    async def async_read_serial_data_llt(self, command):
-        if self.hci_uart_ok:
-            try:
-                bt_task = asyncio.run_coroutine_threadsafe(
-                    self.send_command(command), self.bt_loop
-                )
-                result = await asyncio.wait_for(asyncio.wrap_future(bt_task), 20)
-                return result
-            except asyncio.TimeoutError:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
-            except BleakDBusError:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error(
-                    f"BleakDBusError: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
-                )
-                self.reset_bluetooth()
-                return False
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logger.error(
-                    f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
-                )
-                self.reset_bluetooth()
-                return False
-        else:
-            return False
+        :return: list with the reply or False for each command
+        """
+        if not self.hci_uart_ok or not self.bt_loop or not self.bt_client:
+            logger.error(">>> ERROR: No BLE client connection - returning")
+            return [False] * len(commands)
 
-    def read_serial_data_llt(self, command):
-        if not self.bt_loop:
-            return False
+        future = asyncio.run_coroutine_threadsafe(
+            self.async_send_commands(commands), self.bt_loop
+        )
         try:
-            data = asyncio.run(self.async_read_serial_data_llt(command))
-            return self.validate_packet(data)
-        except CancelledError as e:
+            return future.result(REPLY_TIMEOUT + 5)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            logger.error(">>> ERROR: No reply - returning")
+        except (CancelledError, concurrent.futures.CancelledError) as e:
             logger.error(">>> ERROR: No reply - canceled - returning")
             logger.error(e)
-            return False
-        # except Exception as e:
-        #     logger.error(">>> ERROR: No reply - returning")
-        #     logger.error(e)
-        #     return False
+        except BleakDBusError:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                f"BleakDBusError: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+            self.reset_bluetooth()
+        except Exception:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+            self.reset_bluetooth()
+        return [False] * len(commands)
+
+    def refresh_data(self):
+        # send the cell command together with the general command, if the cells are due
+        cell_task = self.poll_scheduler.tasks["read_cell_data"]
+        due = self.poll_scheduler.is_due(cell_task, time())
+        self.pipelined_commands = [self.command_cell] if due else []
+        try:
+            return super().refresh_data()
+        finally:
+            self.pipelined_commands = []
+            self.pipelined_replies.clear()
+
+    def read_serial_data_llt(self, command):
+        if command in self.pipelined_replies:
+            return self.validate_packet(self.pipelined_replies.pop(command))
+
+        commands = [command]
+        if command == self.command_general:
+            commands += self.pipelined_commands
+
+        replies = self.send_commands(commands)
+        for pipelined_command, reply in zip(commands[1:], replies[1:]):
+            self.pipelined_replies[pipelined_command] = reply
+
+        try:
+            return self.validate_packet(replies[0])
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
             file = exception_traceback.tb_frame.f_code.co_filename
@@ -289,31 +442,17 @@ class LltJbd_Ble(LltJbd):
             return False
 
     def reset_bluetooth(self):
-        logger.error("Reset of system Bluetooth daemon triggered")
-        self.bt_loop = False
-
-        # process kill is needed, since the service/bluetooth driver is probably freezed
-        # os.system('pkill -f "bluetoothd"')
-        # stop will not work, if service/bluetooth driver is stuck
-        os.system("/etc/init.d/bluetooth stop")
-        sleep(2)
-        os.system("rfkill block bluetooth")
-        os.system("rfkill unblock bluetooth")
-        os.system("/etc/init.d/bluetooth start")
-        logger.error("System Bluetooth daemon should have been restarted")
-        sleep(5)
-        sys.exit(1)
+        # the system Bluetooth daemon is restarted by the manager, if all BLE devices failed
+        logger.error("Reconnect of BLE device triggered")
+        self.reconnect = True
+        self.wake_session()
+        self.bt_loop = None
 
     def reset_hci_uart(self):
         logger.error("Reset of hci_uart stack... Reconnecting to: " + self.address)
         self.run = False
-        os.system("pkill -f 'hciattach'")
-        sleep(0.5)
-        os.system("rmmod hci_uart")
-        os.system("rmmod btbcm")
-        os.system("modprobe hci_uart")
-        os.system("modprobe btbcm")
-        sys.exit(1)
+        # runs outside of the BLE loop, which is shared by all BLE batteries, and restarts the process
+        get_ble_manager().reset_hci_uart()
         # execfile = open("/tmp/dbus-blebattery-hciattach", "r")
         # sleep(5)
         # os.system(execfile.readline())
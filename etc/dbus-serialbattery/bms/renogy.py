@@ -15,6 +15,22 @@ class Renogy(Battery):
         # The RBT100LFP12SH-G1 uses 0xF7, another battery uses 0x30
         self.command_address = address
 
+        # commands executed on refresh_data() with their refresh period in seconds,
+        # if the SoC can't be read the battery is offline and the other commands would only time out
+        self.poll_scheduler.add("read_soc_data", self.read_soc_data)
+        self.poll_scheduler.add(
+            "read_cell_data",
+            self.read_cell_data,
+            utils.POLL_INTERVAL_CELLS,
+            depends_on=["read_soc_data"],
+        )
+        self.poll_scheduler.add(
+            "read_temp_data",
+            self.read_temp_data,
+            utils.POLL_INTERVAL_TEMPERATURES,
+            depends_on=["read_soc_data"],
+        )
+
     BATTERYTYPE = "Renogy"
     LENGTH_CHECK = 4
     LENGTH_POS = 2
@@ -83,11 +99,7 @@ class Renogy(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (1 second)
         # Return True if success, False for failure
-        result = self.read_soc_data()
-        result = result and self.read_cell_data()
-        result = result and self.read_temp_data()
-
-        return result
+        return self.poll_scheduler.run()
 
     def read_gen_data(self):
         model = self.read_serial_data_renogy(self.command_model)
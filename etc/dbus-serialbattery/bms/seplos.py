@@ -12,6 +12,12 @@ class Seplos(Battery):
         self.type = self.BATTERYTYPE
         self.poll_interval = 5000
 
+        # commands executed on refresh_data() with their refresh period in seconds
+        self.poll_scheduler.add("read_status_data", self.read_status_data)
+        self.poll_scheduler.add(
+            "read_alarm_data", self.read_alarm_data, utils.POLL_INTERVAL_ALARMS
+        )
+
     BATTERYTYPE = "Seplos"
 
     COMMAND_STATUS = 0x42
@@ -124,10 +130,7 @@ class Seplos(Battery):
         # call all functions that will refresh the battery data.
         # This will be called for every iteration (self.poll_interval)
         # Return True if success, False for failure
-        result_status = self.read_status_data()
-        result_alarm = self.read_alarm_data()
-
-        return result_status and result_alarm
+        return self.poll_scheduler.run()
 
     @staticmethod
     def decode_alarm_byte(data_byte: int, alarm_bit: int, warn_bit: int):
@@ -19,7 +19,7 @@ class Seplosv3(Battery):
         self.serialnumber = ""
         self.mbdev: Union[minimalmodbus.Instrument, None] = None
         if address is not None and len(address) > 0:
-            self.slaveaddress: int = int(address)
+            self.slaveaddress: int = int.from_bytes(address, byteorder="big")
             self.slaveaddresses: list[int] = [self.slaveaddress]
         else:
             self.slaveaddress: int = 0
@@ -17,6 +17,44 @@ class Sinowealth(Battery):
         self.poll_interval = 2000
         self.type = self.BATTERYTYPE
 
+        # commands executed on refresh_data() with their refresh period in seconds
+        # the cell voltages need one command per cell, so they are not read on every poll.
+        # If the SoC can't be read the battery is offline and the other commands would only time out
+        self.poll_scheduler.add("read_soc", self.read_soc)
+        depends_on = ["read_soc"]
+        self.poll_scheduler.add(
+            "read_status_data", self.read_status_data, depends_on=depends_on
+        )
+        self.poll_scheduler.add(
+            "read_battery_status", self.read_battery_status, depends_on=depends_on
+        )
+        self.poll_scheduler.add(
+            "read_pack_voltage", self.read_pack_voltage, depends_on=depends_on
+        )
+        self.poll_scheduler.add(
+            "read_pack_current", self.read_pack_current, depends_on=depends_on
+        )
+        self.poll_scheduler.add(
+            "read_cell_data",
+            self.read_cell_data,
+            utils.POLL_INTERVAL_CELLS,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_temperature_data",
+            self.read_temperature_data,
+            utils.POLL_INTERVAL_TEMPERATURES,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_remaining_capacity",
+            self.read_remaining_capacity,
+            depends_on=depends_on,
+        )
+        self.poll_scheduler.add(
+            "read_cycle_count", self.read_cycle_count, 60, depends_on=depends_on
+        )
+
     # command bytes [StartFlag=0A][Command byte][response dataLength=2 to 20 bytes][checksum]
     command_base = b"\x0A\x00\x04"
     command_cell_base = b"\x01"
@@ -85,16 +123,7 @@ class Sinowealth(Battery):
         return True
 
     def refresh_data(self):
-        result = self.read_soc()
-        result = result and self.read_status_data()
-        result = result and self.read_battery_status()
-        result = result and self.read_pack_voltage()
-        result = result and self.read_pack_current()
-        result = result and self.read_cell_data()
-        result = result and self.read_temperature_data()
-        result = result and self.read_remaining_capacity()
-        result = result and self.read_cycle_count()
-        return result
+        return self.poll_scheduler.run()
 
     def read_status_data(self):
         status_data = self.read_serial_data_sinowealth(self.command_status)
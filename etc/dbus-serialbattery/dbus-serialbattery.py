@@ -1,8 +1,10 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-from typing import Union
+from typing import Callable, List, Tuple, Union
 
 from time import sleep
+import importlib
+import signal
 from dbus.mainloop.glib import DBusGMainLoop
 
 import sys
@@ -17,60 +19,91 @@ from gi.repository import GLib as gobject
 # Victron packages
 # from ve_utils import exit_on_error
 
-from dbushelper import DbusHelper
+from dbushelper import DbusHelper, RefreshWorker
 from utils import logger
 import utils
 from battery import Battery
 
-# import battery classes
-from bms.daly import Daly
-from bms.ecs import Ecs
-from bms.heltecmodbus import HeltecModbus
-from bms.hlpdatabms4s import HLPdataBMS4S
-from bms.jkbms import Jkbms
-from bms.lifepower import Lifepower
-from bms.lltjbd import LltJbd
-from bms.renogy import Renogy
-from bms.seplos import Seplos
-from bms.seplosv3 import Seplosv3
-
-# enabled only if explicitly set in config under "BMS_TYPE"
-if "ANT" in utils.BMS_TYPE:
-    from bms.ant import ANT
-if "MNB" in utils.BMS_TYPE:
-    from bms.mnb import MNB
-if "Sinowealth" in utils.BMS_TYPE:
-    from bms.sinowealth import Sinowealth
-
+# battery classes with the module they are defined in
+# the modules are imported only when the BMS type is tested, see get_bms_class()
+# "probe" is a command and the start of the expected reply, which are used by the autodetection
+# to find out quickly, which BMS is connected, before the module is imported and test_connection() is called
 supported_bms_types = [
-    {"bms": Daly, "baud": 9600, "address": b"\x40"},
-    {"bms": Daly, "baud": 9600, "address": b"\x80"},
-    {"bms": Ecs, "baud": 19200},
-    {"bms": HeltecModbus, "baud": 9600},
-    {"bms": HLPdataBMS4S, "baud": 9600},
-    {"bms": Jkbms, "baud": 115200},
-    {"bms": Lifepower, "baud": 9600},
-    {"bms": LltJbd, "baud": 9600},
-    {"bms": Renogy, "baud": 9600, "address": b"\x30"},
-    {"bms": Renogy, "baud": 9600, "address": b"\xF7"},
-    {"bms": Seplos, "baud": 19200},
-    {"bms": Seplosv3, "baud": 19200},
+    {
+        "bms": "Daly",
+        "module": "bms.daly",
+        "baud": 9600,
+        "address": b"\x40",
+        "probe": (b"\xA5\x40\x94\x08\xAA\xAA\xAA\xAA\xAA\xAA\xAA\xAA\xD1", b"\xA5"),
+    },
+    {
+        "bms": "Daly",
+        "module": "bms.daly",
+        "baud": 9600,
+        "address": b"\x80",
+        "probe": (b"\xA5\x80\x94\x08\xAA\xAA\xAA\xAA\xAA\xAA\xAA\xAA\x11", b"\xA5"),
+    },
+    {"bms": "Ecs", "module": "bms.ecs", "baud": 19200},
+    {"bms": "HeltecModbus", "module": "bms.heltecmodbus", "baud": 9600},
+    {"bms": "HLPdataBMS4S", "module": "bms.hlpdatabms4s", "baud": 9600},
+    {
+        "bms": "Jkbms",
+        "module": "bms.jkbms",
+        "baud": 115200,
+        "probe": (
+            b"\x4E\x57\x00\x13\x00\x00\x00\x00\x06\x03\x00\x00\x00\x00\x00\x00\x68\x00\x00\x01\x29",
+            b"\x4E\x57",
+        ),
+    },
+    {"bms": "Lifepower", "module": "bms.lifepower", "baud": 9600},
+    {
+        "bms": "LltJbd",
+        "module": "bms.lltjbd",
+        "baud": 9600,
+        "probe": (b"\xDD\xA5\x05\x00\xFF\xFB\x77", b"\xDD"),
+    },
+    {"bms": "Renogy", "module": "bms.renogy", "baud": 9600, "address": b"\x30"},
+    {"bms": "Renogy", "module": "bms.renogy", "baud": 9600, "address": b"\xF7"},
+    {
+        "bms": "Seplos",
+        "module": "bms.seplos",
+        "baud": 19200,
+        "probe": (b"~20004642E00201FD36\r", b"~"),
+    },
+    {"bms": "Seplosv3", "module": "bms.seplosv3", "baud": 19200},
 ]
 
 # enabled only if explicitly set in config under "BMS_TYPE"
 if "ANT" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": ANT, "baud": 19200})
+    supported_bms_types.append({"bms": "ANT", "module": "bms.ant", "baud": 19200})
 if "MNB" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": MNB, "baud": 9600})
+    supported_bms_types.append({"bms": "MNB", "module": "bms.mnb", "baud": 9600})
 if "Sinowealth" in utils.BMS_TYPE:
-    supported_bms_types.append({"bms": Sinowealth, "baud": 9600})
+    supported_bms_types.append(
+        {"bms": "Sinowealth", "module": "bms.sinowealth", "baud": 9600}
+    )
 
 expected_bms_types = [
     battery_type
     for battery_type in supported_bms_types
-    if battery_type["bms"].__name__ in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
+    if battery_type["bms"] in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
 ]
 
+# BMS types which can share one serial port with other batteries, see BATTERY_ADDRESSES in the config
+multi_battery_bms_types = ["HeltecModbus", "Renogy", "Seplosv3"]
+
+# seconds between the searches for batteries of this process, which did not reply on the start
+MISSING_BATTERY_RETRY_INTERVAL = 60
+
+
+def get_bms_class(bms_type: dict) -> type:
+    """
+    Import the module of the BMS type on first use and return the battery class.
+    Modules of BMS types, which are never tested, are never loaded.
+    """
+    return getattr(importlib.import_module(bms_type["module"]), bms_type["bms"])
+
+
 logger.info("")
 logger.info("Starting dbus-serialbattery")
 
@@ -79,11 +112,82 @@ def main():
     # NameError: free variable 'expected_bms_types' referenced before assignment in enclosing scope
     global expected_bms_types
 
-    def poll_battery(loop):
-        helper.publish_battery(loop)
-        return True
+    def poll_battery(helper: DbusHelper) -> bool:
+        # only called by the poll timer of the battery, which reschedules itself with POLL_ADAPTIVE_ENABLE
+        # the batteries are read by the worker thread, so that a slow BMS does not block the main loop
+        refresh_worker.request_refresh(helper)
+
+        if not utils.POLL_ADAPTIVE_ENABLE:
+            return True
 
-    def get_battery(_port) -> Union[Battery, None]:
+        # schedule the next poll with the interval, that fits the state of this battery
+        gobject.timeout_add(helper.get_poll_interval(), poll_battery, helper)
+        return False
+
+    def get_bms_types(address: Union[bytes, None]) -> list:
+        if address is None:
+            return expected_bms_types
+
+        # test each BMS type only once with the given address
+        bms_types = []
+        for bms_type in expected_bms_types:
+            if bms_type["bms"] in multi_battery_bms_types and not any(
+                test["bms"] == bms_type["bms"] for test in bms_types
+            ):
+                bms_types.append({**bms_type, "address": address})
+        return bms_types
+
+    def filter_bms_types_by_probe(_port, bms_types: list, last_round: bool) -> list:
+        """
+        Send the probe command of each BMS type and check the start of the reply, before the
+        slow test_connection() of each BMS type is called. The BMS types are probed grouped by baud rate
+        and each command is sent only once per baud rate.
+
+        :param last_round: also test the BMS types, which got no matching reply, since a BMS could
+            answer test_connection() but not the probe command
+        :return: first the BMS types with a matching reply, then the ones without a probe command.
+            The BMS types with a probe command, which got no matching reply, are tested only in the last round
+        """
+        probes = {}
+        for test in sorted(bms_types, key=lambda test: test["baud"]):
+            if "probe" not in test:
+                continue
+
+            command, reply_start = test["probe"]
+            key = (test["baud"], bytes(command))
+            if key not in probes:
+                probes[key] = utils.probe_serial_port(
+                    _port, test["baud"], command, len(reply_start)
+                )
+            test["probe_match"] = probes[key].startswith(reply_start)
+
+        # release the serial port, some BMS types open it on their own
+        utils.close_serial_sessions(_port)
+
+        matched = [test for test in bms_types if test.get("probe_match") is True]
+        if len(matched) > 0:
+            logger.info(
+                "Probe reply matches " + ", ".join(test["bms"] for test in matched)
+            )
+
+        unprobed = [test for test in bms_types if "probe_match" not in test]
+        skipped = [test for test in bms_types if test.get("probe_match") is False]
+        if len(skipped) > 0:
+            logger.info(
+                "No matching probe reply, "
+                + (
+                    "testing anyway in the last round "
+                    if last_round
+                    else "not testing "
+                )
+                + ", ".join(test["bms"] for test in skipped)
+            )
+            if last_round:
+                return matched + unprobed + skipped
+
+        return matched + unprobed
+
+    def get_battery(_port, address: bytes = None) -> Union[Battery, None]:
         # all the different batteries the driver support and need to test for
         # try to establish communications with the battery 3 times, else exit
         retry = 1
@@ -92,13 +196,19 @@ def main():
             logger.info(
                 "-- Testing BMS: " + str(retry) + " of " + str(retries) + " rounds"
             )
+            # probe again in every round, the BMS could have been asleep in the last one
+            bms_types = filter_bms_types_by_probe(
+                _port,
+                [dict(test) for test in get_bms_types(address)],
+                retry == retries,
+            )
             # create a new battery object that can read the battery and run connection test
-            for test in expected_bms_types:
+            for test in bms_types:
                 # noinspection PyBroadException
                 try:
                     logger.info(
                         "Testing "
-                        + test["bms"].__name__
+                        + test["bms"]
                         + (
                             ' at address "'
                             + utils.bytearray_to_string(test["address"])
@@ -107,7 +217,7 @@ def main():
                             else ""
                         )
                     )
-                    batteryClass = test["bms"]
+                    batteryClass = get_bms_class(test)
                     baud = test["baud"]
                     battery: Battery = batteryClass(
                         port=_port, baud=baud, address=test.get("address")
@@ -116,6 +226,11 @@ def main():
                         logger.info(
                             "Connection established to " + battery.__class__.__name__
                         )
+                        # test this BMS type first on the next start
+                        if address is None:
+                            utils.save_detection_cache(
+                                _port, test["bms"], baud, test.get("address")
+                            )
                         return battery
                 except KeyboardInterrupt:
                     return None
@@ -133,11 +248,69 @@ def main():
                     )
                     # Ignore any malfunction test_function()
                     pass
+
+                # release the serial port, the next BMS type could use a different baud rate
+                utils.close_serial_sessions(_port)
             retry += 1
             sleep(0.5)
 
         return None
 
+    def get_cached_battery(_port) -> Union[Battery, None]:
+        """
+        Test only the BMS type, which was found on this port on the last start.
+        If the BMS supports a probe command, it's sent first to fail fast on a cache miss.
+        """
+        cached = utils.get_detection_cache(_port)
+        if cached is None:
+            return None
+
+        address = (
+            bytes.fromhex(cached["address"]) if cached["address"] is not None else None
+        )
+        for test in expected_bms_types:
+            if (
+                test["bms"] == cached["bms"]
+                and test["baud"] == cached["baud"]
+                and test.get("address") == address
+            ):
+                break
+        else:
+            return None
+
+        logger.info(f"Testing {cached['bms']} found on the last start")
+        # noinspection PyBroadException
+        try:
+            probe = test.get("probe")
+            if probe is None or utils.probe_serial_port(
+                _port, test["baud"], probe[0], len(probe[1])
+            ).startswith(probe[1]):
+                battery: Battery = get_bms_class(test)(
+                    port=_port, baud=test["baud"], address=test.get("address")
+                )
+                if battery.test_connection() and battery.validate_data():
+                    logger.info(
+                        "Connection established to " + battery.__class__.__name__
+                    )
+                    return battery
+        except Exception:
+            (
+                exception_type,
+                exception_object,
+                exception_traceback,
+            ) = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logger.error(
+                "Non blocking exception occurred: "
+                + f"{repr(exception_object)} of type {exception_type} in {file} line #{line}"
+            )
+
+        # release the serial port for the full detection
+        utils.close_serial_sessions(_port)
+        logger.info(f"{cached['bms']} found on the last start did not reply")
+        return None
+
     def get_port() -> str:
         # Get the port we need to use from the argument
         if len(sys.argv) > 1:
@@ -168,58 +341,120 @@ def main():
 
     port = get_port()
     battery = None
+    # all batteries served by this process with their address on the shared bus
+    batteries: List[Tuple[Battery, Union[bytes, None]]] = []
+    # batteries of this process, which did not reply on the start, with the function to search them again
+    # and their address on the shared bus. The search returns the battery or None
+    missing_batteries: List[
+        Tuple[str, Callable[[], Union[Battery, None]], Union[bytes, None]]
+    ] = []
+
+    # test the BMS found on the last start first, which skips the waiting and the full detection
+    if (
+        not port.endswith("_Ble")
+        and not port.startswith("can")
+        and len(utils.BATTERY_ADDRESSES) == 0
+    ):
+        battery = get_cached_battery(port)
 
-    # wait some seconds to be sure that the serial connection is ready
-    # else the error throw a lot of timeouts
-    sleep(16)
+    if battery is None:
+        # wait some seconds to be sure that the serial connection is ready
+        # else the error throw a lot of timeouts
+        sleep(16)
 
-    if port.endswith("_Ble") and len(sys.argv) > 2:
+    if battery is not None:
+        # the BMS found on the last start replied, no detection needed
+        pass
+
+    elif port.endswith("_Ble") and len(sys.argv) > 2:
         """
         Import ble classes only, if it's a ble port, else the driver won't start due to missing python modules
         This prevent problems when using the driver only with a serial connection
         """
-        if port == "Jkbms_Ble":
+        # the arguments are pairs of BMS type and MAC address,
+        # all BLE batteries of this process share one BLE manager
+        ble_types = sys.argv[1::2]
+        ble_addresses = sys.argv[2::2]
+
+        if "Jkbms_Ble" in ble_types:
             # noqa: F401 --> ignore flake "imported but unused" error
             from bms.jkbms_ble import Jkbms_Ble  # noqa: F401
 
-        if port == "LltJbd_Ble":
+        if "LltJbd_Ble" in ble_types:
             # noqa: F401 --> ignore flake "imported but unused" error
             from bms.lltjbd_ble import LltJbd_Ble  # noqa: F401
 
-        class_ = eval(port)
-        testbms = class_("", 9600, sys.argv[2])
-        if testbms.test_connection():
-            logger.info("Connection established to " + testbms.__class__.__name__)
-            battery = testbms
+        for ble_type, ble_address in zip(ble_types, ble_addresses):
+            class_ = eval(ble_type)
+            testbms = class_("", 9600, ble_address)
+            if testbms.test_connection():
+                logger.info(
+                    "Connection established to "
+                    + testbms.__class__.__name__
+                    + " at "
+                    + ble_address
+                )
+                batteries.append((testbms, None))
+            else:
+                logger.error(f"ERROR >>> No battery connection at {ble_address}")
+                # e.g. out of range or asleep, the same object is tested again,
+                # its reconnects are scheduled with the backoff of the BLE manager
+                missing_batteries.append(
+                    (
+                        ble_address,
+                        lambda testbms=testbms: (
+                            testbms if testbms.test_connection() else None
+                        ),
+                        None,
+                    )
+                )
 
     elif port.startswith("can"):
         """
-        Import CAN classes only, if it's a can port, else the driver won't start due to missing python modules
+        CAN classes are imported only, if it's a can port, else the driver won't start due to missing python modules
         This prevent problems when using the driver only with a serial connection
         """
-        from bms.daly_can import Daly_Can
-        from bms.jkbms_can import Jkbms_Can
-
         # only try CAN BMS on CAN port
         supported_bms_types = [
-            {"bms": Daly_Can, "baud": 250000},
-            {"bms": Jkbms_Can, "baud": 250000},
+            {"bms": "Daly_Can", "module": "bms.daly_can", "baud": 250000},
+            {"bms": "Jkbms_Can", "module": "bms.jkbms_can", "baud": 250000},
         ]
 
         expected_bms_types = [
             battery_type
             for battery_type in supported_bms_types
-            if battery_type["bms"].__name__ in utils.BMS_TYPE
-            or len(utils.BMS_TYPE) == 0
+            if battery_type["bms"] in utils.BMS_TYPE or len(utils.BMS_TYPE) == 0
         ]
 
         battery = get_battery(port)
 
+    elif len(utils.BATTERY_ADDRESSES) > 0:
+        # multiple batteries share the serial port, search one battery per address
+        for address in utils.BATTERY_ADDRESSES:
+            bms_address = bytes([address])
+            battery = get_battery(port, bms_address)
+            if battery is None:
+                logger.error(
+                    f"ERROR >>> No battery connection at {port} address 0x{bms_address.hex()}"
+                )
+                missing_batteries.append(
+                    (
+                        f"{port} address 0x{bms_address.hex()}",
+                        lambda bms_address=bms_address: get_battery(port, bms_address),
+                        bms_address,
+                    )
+                )
+            else:
+                batteries.append((battery, bms_address))
+
     else:
         battery = get_battery(port)
 
+    if battery is not None and len(batteries) == 0:
+        batteries.append((battery, None))
+
     # exit if no battery could be found
-    if battery is None:
+    if len(batteries) == 0:
         logger.error("ERROR >>> No battery connection at " + port)
         sys.exit(1)
 
@@ -229,26 +464,103 @@ def main():
         gobject.threads_init()
     mainloop = gobject.MainLoop()
 
-    # Get the initial values for the battery used by setup_vedbus
-    helper = DbusHelper(battery)
+    helpers: List[DbusHelper] = []
+    # read the batteries one after another in a separate thread, since they could share the same serial bus
+    refresh_worker = RefreshWorker(helpers, mainloop)
 
-    if not helper.setup_vedbus():
-        logger.error("ERROR >>> Problem with battery set up at " + port)
-        sys.exit(1)
+    def start_battery(battery: Battery, bms_address: Union[bytes, None]) -> bool:
+        # Get the initial values for the battery used by setup_vedbus
+        helper = DbusHelper(battery, bms_address)
+
+        if not helper.setup_vedbus():
+            logger.error("ERROR >>> Problem with battery set up at " + port)
+            return False
+
+        helpers.append(helper)
 
-    # try using active callback on this battery
-    if not battery.use_callback(lambda: poll_battery(mainloop)):
-        # if not possible, poll the battery every poll_interval milliseconds
-        gobject.timeout_add(battery.poll_interval, lambda: poll_battery(mainloop))
+        # try using active callback on this battery
+        # the callback is called by the driver on every new data, also from its own thread,
+        # so it only requests a refresh and does not start a poll timer
+        if not helper.battery.use_callback(
+            lambda helper=helper: refresh_worker.request_refresh(helper)
+        ):
+            # if not possible, poll the battery every poll_interval milliseconds
+            gobject.timeout_add(helper.get_poll_interval(), poll_battery, helper)
+        return True
+
+    for battery, bms_address in batteries:
+        if not start_battery(battery, bms_address):
+            sys.exit(1)
 
     # print log at this point, else not all data is correctly populated
-    battery.log_settings()
+    for helper in helpers:
+        helper.battery.log_settings()
+
+    # names of the missing batteries, which are searched at the moment
+    searching: List[str] = []
+
+    def search_missing_batteries() -> bool:
+        # the search runs in the worker thread, since it uses the same bus as the refreshes
+        for missing in missing_batteries:
+            name, search, _ = missing
+            if name not in searching:
+                searching.append(name)
+                refresh_worker.run_task(
+                    search,
+                    lambda battery, missing=missing: found_missing_battery(
+                        missing, battery
+                    ),
+                )
+        # stop the timer, when all batteries were found
+        return len(missing_batteries) > 0
+
+    def found_missing_battery(missing: tuple, battery: Union[Battery, None]) -> None:
+        name, _, bms_address = missing
+        searching.remove(name)
+        if battery is None:
+            logger.info(f"Battery at {name} still not found, searching again later")
+            return
+
+        logger.info(f"Battery at {name} found")
+        if start_battery(battery, bms_address):
+            missing_batteries.remove(missing)
+            battery.log_settings()
+
+    # search the batteries, which did not reply on the start, instead of serving only a part of them
+    if len(missing_batteries) > 0:
+        gobject.timeout_add(
+            MISSING_BATTERY_RETRY_INTERVAL * 1000, search_missing_batteries
+        )
+
+    # stop the main loop on SIGTERM, so that the pending settings are saved
+    def stop_mainloop():
+        logger.info("Received SIGTERM, stopping")
+        mainloop.quit()
+        return False
+
+    gobject.unix_signal_add(gobject.PRIORITY_HIGH, signal.SIGTERM, stop_mainloop)
 
     # Run the main loop
     try:
         mainloop.run()
     except KeyboardInterrupt:
         pass
+    finally:
+        # write the changes, which were not saved yet
+        for helper in helpers:
+            try:
+                helper.saveBatteryOptions(True)
+            except Exception:
+                (
+                    exception_type,
+                    exception_object,
+                    exception_traceback,
+                ) = sys.exc_info()
+                file = exception_traceback.tb_frame.f_code.co_filename
+                line = exception_traceback.tb_lineno
+                logger.error(
+                    f"Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}"
+                )
 
 
 if __name__ == "__main__":
@@ -4,10 +4,13 @@ import os
 import platform
 import dbus
 import traceback
+import re
 from time import sleep, time
 from utils import logger, publish_config_variables
 import utils
 from xml.etree import ElementTree
+from gi.repository import GLib
+import threading
 
 # Victron packages
 sys.path.insert(
@@ -23,42 +26,83 @@ from settingsdevice import (  # noqa: E402
 )
 
 
-def get_bus() -> dbus.bus.BusConnection:
+def get_bus(private: bool = False) -> dbus.bus.BusConnection:
+    """
+    :param private: get an own connection instead of the shared one,
+        e.g. for a VeDbusService, since each service registers its objects at "/"
+    """
     return (
-        dbus.SessionBus()
+        dbus.SessionBus(private=private)
         if "DBUS_SESSION_BUS_ADDRESS" in os.environ
-        else dbus.SystemBus()
+        else dbus.SystemBus(private=private)
     )
 
 
 class DbusHelper:
     EMPTY_DICT = {}
 
-    def __init__(self, battery):
+    # dbus paths with a deadband, see PUBLISH_DEADBAND_* in the config
+    DEADBAND_PATHS = [
+        (
+            re.compile(
+                r"^/(Voltages/Cell\d+|Cell/\d+/Volts|System/M(in|ax)CellVoltage|(Voltages|Cell)/Diff)$"
+            ),
+            utils.PUBLISH_DEADBAND_CELL_VOLTAGE,
+        ),
+        (
+            re.compile(r"^/(Dc/0/Voltage|Dc/0/MidVoltage|(Voltages|Cell)/Sum)$"),
+            utils.PUBLISH_DEADBAND_VOLTAGE,
+        ),
+        (re.compile(r"^/(Dc/0/Current|CurrentAvg)$"), utils.PUBLISH_DEADBAND_CURRENT),
+        (re.compile(r"^/Dc/0/Power$"), utils.PUBLISH_DEADBAND_POWER),
+        (
+            re.compile(
+                r"^/(Dc/0/Temperature|System/M(in|ax)CellTemperature|System/MOSTemperature|System/Temperature\d)$"
+            ),
+            utils.PUBLISH_DEADBAND_TEMPERATURE,
+        ),
+    ]
+
+    def __init__(self, battery, bms_address=None):
         self.battery = battery
         self.instance = 1
         self.settings = None
         self.error = {"count": 0, "timestamp_first": None, "timestamp_last": None}
         self.cell_voltages_good = False
+        # set, if the battery is assumed to be completely failed, see set_failed()
+        self.failed = False
+        # poll interval in milliseconds, which fits the last state of the battery
+        self.poll_interval_hint = self.battery.poll_interval
+        # number of dbus signals sent by the last publish_values() call
+        self.signals_per_tick = 0
+        # deadband and time of the last publishing per dbus path
+        self.deadbands = {}
+        self.published_time = {}
+        # writes to the dbus settings of the battery, which are handed to the RefreshWorker,
+        # since the battery must not be changed by the main loop while it is refreshed
+        self.setting_writes = []
+        self.setting_writes_lock = threading.Lock()
         self._dbusname = (
             "com.victronenergy.battery."
             + self.battery.port[self.battery.port.rfind("/") + 1 :]
+            # add the address, if multiple batteries share the serial port
+            + ("__0x" + bms_address.hex() if bms_address is not None else "")
         )
-        self._dbusservice = VeDbusService(self._dbusname, get_bus())
+        # each battery needs its own connection, if multiple batteries are served by one process
+        self._dbusservice = VeDbusService(self._dbusname, get_bus(private=True))
         self.bms_id = "".join(
             # remove all non alphanumeric characters from the identifier
             c if c.isalnum() else "_"
             for c in self.battery.unique_identifier()
         )
         self.path_battery = None
-        self.save_charge_details_last = {
-            "allow_max_voltage": self.battery.allow_max_voltage,
-            "max_voltage_start_time": self.battery.max_voltage_start_time,
-            "soc_reset_last_reached": self.battery.soc_reset_last_reached,
-            "soc_calc": (
-                self.battery.soc_calc if self.battery.soc_calc is not None else ""
-            ),
-        }
+        # battery options last written to the dbus settings, changed options waiting to be written
+        # and the time of the last write, see saveBatteryOptions()
+        self.settings_saved = {}
+        self.settings_pending = {}
+        self.settings_saved_time = time()
+        # cached SetValue methods of the dbus settings per path
+        self.setting_methods = {}
 
     def create_pid_file(self) -> None:
         """
@@ -151,6 +195,7 @@ class DbusHelper:
         custom_name = self.battery.custom_name()
         device_instance = "1"
         device_instances_used = []
+        settings_to_remove = []
         found_bms = False
         self.path_battery = "/Settings/Devices/serialbattery" + "_" + str(self.bms_id)
 
@@ -161,12 +206,22 @@ class DbusHelper:
         logger.debug("setup_instance(): SettingsDevice")
 
         # get all the settings from the dbus
-        settings_from_dbus = self.getSettingsWithValues(
+        settings_read_start = time()
+        settings_from_dbus = self.getSettingsBulk(
             get_bus(),
             "com.victronenergy.settings",
             "/Settings/Devices",
         )
-        logger.debug("setup_instance(): getSettingsWithValues")
+        if settings_from_dbus is None:
+            settings_from_dbus = self.getSettingsWithValues(
+                get_bus(),
+                "com.victronenergy.settings",
+                "/Settings/Devices",
+            )
+        logger.debug(
+            "setup_instance(): settings read in "
+            + f"{round((time() - settings_read_start) * 1000)} ms"
+        )
         # output:
         # {
         #     "Settings": {
@@ -320,11 +375,9 @@ class DbusHelper:
                         time()
                     ) - (60 * 60 * 24 * 30):
                         # remove entry
-                        del_return = self.removeSetting(
-                            get_bus(),
-                            "com.victronenergy.settings",
-                            "/Settings/Devices/" + key,
-                            [
+                        settings_to_remove += [
+                            key + "/" + setting
+                            for setting in [
                                 "AllowMaxVoltage",
                                 "ClassAndVrmInstance",
                                 "CustomName",
@@ -333,23 +386,15 @@ class DbusHelper:
                                 "SocCalc",
                                 "SocResetLastReached",
                                 "UniqueIdentifier",
-                            ],
-                        )
-                        logger.info(
-                            f"Remove /Settings/Devices/{key} from dbus. Delete result: {del_return}"
-                        )
+                            ]
+                        ]
+                        logger.info(f"Remove /Settings/Devices/{key} from dbus")
 
                     # check if the battery has a last seen time, if not then it's an old entry and can be removed
                     elif "LastSeen" not in value:
-                        del_return = self.removeSetting(
-                            get_bus(),
-                            "com.victronenergy.settings",
-                            "/Settings/Devices/" + key,
-                            ["ClassAndVrmInstance"],
-                        )
+                        settings_to_remove.append(key + "/ClassAndVrmInstance")
                         logger.info(
-                            f"Remove /Settings/Devices/{key} from dbus. "
-                            + f"Old entry. Delete result: {del_return}"
+                            f"Remove /Settings/Devices/{key} from dbus. Old entry"
                         )
 
                 if "ruuvi" in key:
@@ -359,19 +404,29 @@ class DbusHelper:
                         and value["Enabled"] == "0"
                         and "ClassAndVrmInstance" not in value
                     ):
-                        del_return = self.removeSetting(
-                            get_bus(),
-                            "com.victronenergy.settings",
-                            "/Settings/Devices/" + key,
-                            ["CustomName", "Enabled", "TemperatureType"],
-                        )
+                        settings_to_remove += [
+                            key + "/" + setting
+                            for setting in ["CustomName", "Enabled", "TemperatureType"]
+                        ]
                         logger.info(
                             f"Remove /Settings/Devices/{key} from dbus. "
-                            + f"Ruuvi tag was disabled and had no ClassAndVrmInstance. Delete result: {del_return}"
+                            + "Ruuvi tag was disabled and had no ClassAndVrmInstance"
                         )
 
         logger.debug("setup_instance(): for loop ended")
 
+        # remove all stale entries with one call
+        if len(settings_to_remove) > 0:
+            del_return = self.removeSetting(
+                get_bus(),
+                "com.victronenergy.settings",
+                "/Settings/Devices",
+                settings_to_remove,
+            )
+            logger.info(
+                f"Removed {len(settings_to_remove)} settings from dbus. Delete result: {del_return}"
+            )
+
         # create class and crm instance
         class_and_vrm_instance = "battery:" + str(device_instance)
 
@@ -444,6 +499,9 @@ class DbusHelper:
         self.settings.addSettings(settings)
         self.battery.role, self.instance = self.get_role_instance()
 
+        # the options were just loaded from or written to the dbus settings
+        self.settings_saved = self.get_battery_options()
+
         # create pid file
         self.create_pid_file()
 
@@ -469,6 +527,7 @@ class DbusHelper:
         # and notify of all the attributes we intend to update
         # This is only called once when a battery is initiated
         self.setup_instance()
+        self.battery.cells_refreshed()
         logger.info("%s" % (self._dbusname))
 
         # Get the settings for the battery
@@ -642,7 +701,7 @@ class DbusHelper:
                 else None
             ),
             writeable=True,
-            onchangecallback=self.battery.force_charging_off_callback,
+            onchangecallback=self.queue_setting_write("force_charging_off_callback"),
         )
         self._dbusservice.add_path(
             "/Io/ForceDischargingOff",
@@ -652,7 +711,7 @@ class DbusHelper:
                 else None
             ),
             writeable=True,
-            onchangecallback=self.battery.force_discharging_off_callback,
+            onchangecallback=self.queue_setting_write("force_discharging_off_callback"),
         )
         self._dbusservice.add_path(
             "/Io/TurnBalancingOff",
@@ -662,7 +721,7 @@ class DbusHelper:
                 else None
             ),
             writeable=True,
-            onchangecallback=self.battery.turn_balancing_off_callback,
+            onchangecallback=self.queue_setting_write("turn_balancing_off_callback"),
         )
         # self._dbusservice.add_path('/SystemSwitch', 1, writeable=True)
 
@@ -748,25 +807,51 @@ class DbusHelper:
                 "/Settings/ResetSoc",
                 0,
                 writeable=True,
-                onchangecallback=self.battery.reset_soc_callback,
+                onchangecallback=self.queue_setting_write("reset_soc_callback"),
+            )
+
+        # link state of BLE batteries, as reported by BlueZ
+        if self.battery.ble_link is not None:
+            self._dbusservice.add_path("/Bluetooth/Connected", None, writeable=False)
+            self._dbusservice.add_path(
+                "/Bluetooth/Rssi",
+                None,
+                writeable=False,
+                gettextcallback=lambda p, v: "---" if v is None else "{}dBm".format(v),
+            )
+            self._dbusservice.add_path(
+                "/Bluetooth/AdapterPowered", None, writeable=False
             )
+            self._dbusservice.add_path("/Bluetooth/Disconnects", 0, writeable=False)
 
         return True
 
-    def publish_battery(self, loop):
-        # This is called every battery.poll_interval milli second as set up per battery type to read and update the data
+    def get_poll_interval(self) -> int:
+        """
+        Get the interval in milliseconds until the next poll of this battery,
+        which fits the state of the battery after the last refresh.
+        """
+        logger.debug(f"{self._dbusname}: next poll in {self.poll_interval_hint} ms")
+        return self.poll_interval_hint
+
+    def publish_refresh_result(self, result: bool):
+        # This is called in the main loop with the result of the battery's refresh_data function,
+        # after the RefreshWorker refreshed the battery
         try:
-            # Call the battery's refresh_data function
-            result = self.battery.refresh_data()
+            self.battery.cells_refreshed()
             if result:
                 # reset error variables
                 self.error["count"] = 0
                 self.battery.online = True
 
-                # unblock charge/discharge, if it was blocked when battery went offline
-                if utils.BLOCK_ON_DISCONNECT:
+                # unblock charge/discharge, if it was blocked when battery went offline or failed
+                if utils.BLOCK_ON_DISCONNECT or self.failed:
                     self.battery.block_because_disconnect = False
 
+                if self.failed:
+                    logger.info(f"{self._dbusname}: battery is back online")
+                    self.failed = False
+
             else:
                 # update error variables
                 if self.error["count"] == 0:
@@ -801,11 +886,11 @@ class DbusHelper:
                 if time_since_first_error >= 60 and (
                     utils.BLOCK_ON_DISCONNECT or not self.cell_voltages_good
                 ):
-                    loop.quit()
+                    self.set_failed()
 
                 # if the cells are between 3.2 and 3.3 volt we can continue for some time
                 if time_since_first_error >= 60 * 20 and not utils.BLOCK_ON_DISCONNECT:
-                    loop.quit()
+                    self.set_failed()
 
             # This is to mannage CVCL
             self.battery.manage_charge_voltage()
@@ -813,44 +898,63 @@ class DbusHelper:
             # This is to mannage CCL\DCL
             self.battery.manage_charge_current()
 
+            # get the poll interval for the next refresh
+            self.poll_interval_hint = self.battery.get_poll_interval_hint()
+
             # publish all the data from the battery object to dbus
             self.publish_dbus()
 
         except Exception:
             traceback.print_exc()
-            loop.quit()
+            self.set_failed()
+
+    def set_failed(self) -> None:
+        """
+        The battery is assumed to be completely failed, reset its values and block charge/discharge.
+        The RefreshWorker stops the driver, if all batteries of the process failed,
+        else the other batteries are served further and this one is still polled, until it's back.
+        """
+        if not self.failed:
+            logger.error(f"{self._dbusname}: battery failed")
+        self.failed = True
+        self.battery.online = False
+        self.battery.init_values()
+        self.battery.block_because_disconnect = True
 
     def publish_dbus(self):
+        # collect the values of this tick, they are published at once by publish_values()
+        values = {}
+
         # Update SOC, DC and System items
-        self._dbusservice["/System/NrOfCellsPerBattery"] = self.battery.cell_count
+        values["/System/NrOfCellsPerBattery"] = self.battery.cell_count
         if utils.SOC_CALCULATION:
-            self._dbusservice["/Soc"] = (
+            values["/Soc"] = (
                 round(self.battery.soc_calc, 2)
                 if self.battery.soc_calc is not None
                 else None
             )
             # add original SOC for comparing
-            self._dbusservice["/SocBms"] = (
+            values["/SocBms"] = (
                 round(self.battery.soc, 2) if self.battery.soc is not None else None
             )
         else:
-            self._dbusservice["/Soc"] = (
+            values["/Soc"] = (
                 round(self.battery.soc, 2) if self.battery.soc is not None else None
             )
-        self._dbusservice["/Dc/0/Voltage"] = (
+        values["/Dc/0/Voltage"] = (
             round(self.battery.voltage, 2) if self.battery.voltage is not None else None
         )
-        self._dbusservice["/Dc/0/Current"] = (
+        values["/Dc/0/Current"] = (
             round(self.battery.current, 2) if self.battery.current is not None else None
         )
-        self._dbusservice["/Dc/0/Power"] = (
+        values["/Dc/0/Power"] = (
             round(self.battery.voltage * self.battery.current, 2)
-            if self.battery.current is not None and self.battery.current is not None
+            if self.battery.voltage is not None and self.battery.current is not None
             else None
         )
-        self._dbusservice["/Dc/0/Temperature"] = self.battery.get_temp()
-        self._dbusservice["/Capacity"] = self.battery.get_capacity_remain()
-        self._dbusservice["/ConsumedAmphours"] = (
+        values["/Dc/0/Temperature"] = self.battery.get_temp()
+        values["/Capacity"] = self.battery.get_capacity_remain()
+        values["/ConsumedAmphours"] = (
             None
             if self.battery.capacity is None
             or self.battery.get_capacity_remain() is None
@@ -859,90 +963,68 @@ class DbusHelper:
 
         midpoint, deviation = self.battery.get_midvoltage()
         if midpoint is not None:
-            self._dbusservice["/Dc/0/MidVoltage"] = midpoint
-            self._dbusservice["/Dc/0/MidVoltageDeviation"] = deviation
+            values["/Dc/0/MidVoltage"] = midpoint
+            values["/Dc/0/MidVoltageDeviation"] = deviation
 
         # Update battery extras
-        self._dbusservice["/History/ChargeCycles"] = self.battery.cycles
-        self._dbusservice["/History/TotalAhDrawn"] = self.battery.total_ah_drawn
-        self._dbusservice["/Io/AllowToCharge"] = (
-            1 if self.battery.get_allow_to_charge() else 0
-        )
-        self._dbusservice["/Io/AllowToDischarge"] = (
+        values["/History/ChargeCycles"] = self.battery.cycles
+        values["/History/TotalAhDrawn"] = self.battery.total_ah_drawn
+        values["/Io/AllowToCharge"] = 1 if self.battery.get_allow_to_charge() else 0
+        values["/Io/AllowToDischarge"] = (
             1 if self.battery.get_allow_to_discharge() else 0
         )
-        self._dbusservice["/Io/AllowToBalance"] = (
-            1 if self.battery.get_allow_to_balance() else 0
-        )
-        self._dbusservice["/System/NrOfModulesBlockingCharge"] = (
+        values["/Io/AllowToBalance"] = 1 if self.battery.get_allow_to_balance() else 0
+        values["/System/NrOfModulesBlockingCharge"] = (
             0 if self.battery.get_allow_to_charge() else 1
         )
-        self._dbusservice["/System/NrOfModulesBlockingDischarge"] = (
+        values["/System/NrOfModulesBlockingDischarge"] = (
             0 if self.battery.get_allow_to_discharge() else 1
         )
-        self._dbusservice["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
-        self._dbusservice["/System/NrOfModulesOffline"] = (
-            0 if self.battery.online else 1
-        )
-        self._dbusservice["/System/MinCellTemperature"] = self.battery.get_min_temp()
-        self._dbusservice["/System/MinTemperatureCellId"] = (
-            self.battery.get_min_temp_id()
-        )
-        self._dbusservice["/System/MaxCellTemperature"] = self.battery.get_max_temp()
-        self._dbusservice["/System/MaxTemperatureCellId"] = (
-            self.battery.get_max_temp_id()
-        )
-        self._dbusservice["/System/MOSTemperature"] = self.battery.get_mos_temp()
-        self._dbusservice["/System/Temperature1"] = self.battery.temp1
-        self._dbusservice["/System/Temperature1Name"] = utils.TEMP_1_NAME
-        self._dbusservice["/System/Temperature2"] = self.battery.temp2
-        self._dbusservice["/System/Temperature2Name"] = utils.TEMP_2_NAME
-        self._dbusservice["/System/Temperature3"] = self.battery.temp3
-        self._dbusservice["/System/Temperature3Name"] = utils.TEMP_3_NAME
-        self._dbusservice["/System/Temperature4"] = self.battery.temp4
-        self._dbusservice["/System/Temperature4Name"] = utils.TEMP_4_NAME
+        values["/System/NrOfModulesOnline"] = 1 if self.battery.online else 0
+        values["/System/NrOfModulesOffline"] = 0 if self.battery.online else 1
+        values["/System/MinCellTemperature"] = self.battery.get_min_temp()
+        values["/System/MinTemperatureCellId"] = self.battery.get_min_temp_id()
+        values["/System/MaxCellTemperature"] = self.battery.get_max_temp()
+        values["/System/MaxTemperatureCellId"] = self.battery.get_max_temp_id()
+        values["/System/MOSTemperature"] = self.battery.get_mos_temp()
+        values["/System/Temperature1"] = self.battery.temp1
+        values["/System/Temperature1Name"] = utils.TEMP_1_NAME
+        values["/System/Temperature2"] = self.battery.temp2
+        values["/System/Temperature2Name"] = utils.TEMP_2_NAME
+        values["/System/Temperature3"] = self.battery.temp3
+        values["/System/Temperature3Name"] = utils.TEMP_3_NAME
+        values["/System/Temperature4"] = self.battery.temp4
+        values["/System/Temperature4Name"] = utils.TEMP_4_NAME
 
         # Voltage control
-        self._dbusservice["/Info/MaxChargeVoltage"] = (
+        values["/Info/MaxChargeVoltage"] = (
             round(self.battery.control_voltage + utils.VOLTAGE_DROP, 2)
             if self.battery.control_voltage is not None
             else None
         )
 
         # Charge control
-        self._dbusservice["/Info/MaxChargeCurrent"] = (
-            self.battery.control_charge_current
-        )
-        self._dbusservice["/Info/MaxDischargeCurrent"] = (
-            self.battery.control_discharge_current
-        )
+        values["/Info/MaxChargeCurrent"] = self.battery.control_charge_current
+        values["/Info/MaxDischargeCurrent"] = self.battery.control_discharge_current
 
         # Voltage and charge control info (custom dbus paths)
-        self._dbusservice["/Info/ChargeMode"] = self.battery.charge_mode
-        self._dbusservice["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
-        self._dbusservice["/Info/ChargeLimitation"] = self.battery.charge_limitation
-        self._dbusservice["/Info/DischargeLimitation"] = (
-            self.battery.discharge_limitation
-        )
+        values["/Info/ChargeMode"] = self.battery.charge_mode
+        values["/Info/ChargeModeDebug"] = self.battery.charge_mode_debug
+        values["/Info/ChargeLimitation"] = self.battery.charge_limitation
+        values["/Info/DischargeLimitation"] = self.battery.discharge_limitation
 
         # Updates from cells
-        self._dbusservice["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
-        self._dbusservice["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
-        self._dbusservice["/System/MinCellVoltage"] = (
-            self.battery.get_min_cell_voltage()
-        )
-        self._dbusservice["/System/MaxCellVoltage"] = (
-            self.battery.get_max_cell_voltage()
-        )
-        self._dbusservice["/Balancing"] = self.battery.get_balancing()
+        values["/System/MinVoltageCellId"] = self.battery.get_min_cell_desc()
+        values["/System/MaxVoltageCellId"] = self.battery.get_max_cell_desc()
+        values["/System/MinCellVoltage"] = self.battery.get_min_cell_voltage()
+        values["/System/MaxCellVoltage"] = self.battery.get_max_cell_voltage()
+        values["/Balancing"] = self.battery.get_balancing()
 
         # Update the alarms
-        self._dbusservice["/Alarms/LowVoltage"] = self.battery.protection.voltage_low
-        self._dbusservice["/Alarms/LowCellVoltage"] = (
-            self.battery.protection.voltage_cell_low
-        )
+        values["/Alarms/LowVoltage"] = self.battery.protection.voltage_low
+        values["/Alarms/LowCellVoltage"] = self.battery.protection.voltage_cell_low
         # disable high voltage warning temporarly, if loading to bulk voltage and bulk voltage reached is 30 minutes ago
-        self._dbusservice["/Alarms/HighVoltage"] = (
+        values["/Alarms/HighVoltage"] = (
             self.battery.protection.voltage_high
             if (
                 self.battery.soc_reset_requested is False
@@ -950,42 +1032,25 @@ class DbusHelper:
             )
             else 0
         )
-        self._dbusservice["/Alarms/LowSoc"] = self.battery.protection.soc_low
-        self._dbusservice["/Alarms/HighChargeCurrent"] = (
-            self.battery.protection.current_over
-        )
-        self._dbusservice["/Alarms/HighDischargeCurrent"] = (
-            self.battery.protection.current_under
-        )
-        self._dbusservice["/Alarms/CellImbalance"] = (
-            self.battery.protection.cell_imbalance
-        )
-        self._dbusservice["/Alarms/InternalFailure"] = (
-            self.battery.protection.internal_failure
-        )
-        self._dbusservice["/Alarms/HighChargeTemperature"] = (
+        values["/Alarms/LowSoc"] = self.battery.protection.soc_low
+        values["/Alarms/HighChargeCurrent"] = self.battery.protection.current_over
+        values["/Alarms/HighDischargeCurrent"] = self.battery.protection.current_under
+        values["/Alarms/CellImbalance"] = self.battery.protection.cell_imbalance
+        values["/Alarms/InternalFailure"] = self.battery.protection.internal_failure
+        values["/Alarms/HighChargeTemperature"] = (
             self.battery.protection.temp_high_charge
         )
-        self._dbusservice["/Alarms/LowChargeTemperature"] = (
-            self.battery.protection.temp_low_charge
-        )
-        self._dbusservice["/Alarms/HighTemperature"] = (
-            self.battery.protection.temp_high_discharge
-        )
-        self._dbusservice["/Alarms/LowTemperature"] = (
-            self.battery.protection.temp_low_discharge
-        )
-        self._dbusservice["/Alarms/BmsCable"] = (
-            2 if self.battery.block_because_disconnect else 0
-        )
-        self._dbusservice["/Alarms/HighInternalTemperature"] = (
+        values["/Alarms/LowChargeTemperature"] = self.battery.protection.temp_low_charge
+        values["/Alarms/HighTemperature"] = self.battery.protection.temp_high_discharge
+        values["/Alarms/LowTemperature"] = self.battery.protection.temp_low_discharge
+        values["/Alarms/BmsCable"] = 2 if self.battery.block_because_disconnect else 0
+        values["/Alarms/HighInternalTemperature"] = (
             self.battery.protection.temp_high_internal
         )
 
         # cell voltages
         if utils.BATTERY_CELL_DATA_FORMAT > 0:
             try:
-                voltage_sum = 0
                 for i in range(self.battery.cell_count):
                     voltage = self.battery.get_cell_voltage(i)
                     cellpath = (
@@ -993,18 +1058,18 @@ class DbusHelper:
                         if (utils.BATTERY_CELL_DATA_FORMAT & 2)
                         else "/Voltages/Cell%s"
                     )
-                    self._dbusservice[cellpath % (str(i + 1))] = voltage
+                    values[cellpath % (str(i + 1))] = voltage
                     if utils.BATTERY_CELL_DATA_FORMAT & 1:
-                        self._dbusservice["/Balances/Cell%s" % (str(i + 1))] = (
+                        values["/Balances/Cell%s" % (str(i + 1))] = (
                             self.battery.get_cell_balancing(i)
                         )
-                    if voltage:
-                        voltage_sum += voltage
                 pathbase = (
                     "Cell" if (utils.BATTERY_CELL_DATA_FORMAT & 2) else "Voltages"
                 )
-                self._dbusservice["/%s/Sum" % pathbase] = round(voltage_sum, 2)
-                self._dbusservice["/%s/Diff" % pathbase] = round(
+                values["/%s/Sum" % pathbase] = round(
+                    self.battery.get_cell_bank().voltage_sum, 2
+                )
+                values["/%s/Diff" % pathbase] = round(
                     self.battery.get_max_cell_voltage()
                     - self.battery.get_min_cell_voltage(),
                     3,
@@ -1021,15 +1086,9 @@ class DbusHelper:
 
         # Update TimeToGo and/or TimeToSoC
         try:
-            # calculate current average for the last 300 cycles
-            # if Time-To-Go or Time-To-SoC is enabled
-            if utils.TIME_TO_GO_ENABLE or len(utils.TIME_TO_SOC_POINTS) > 0:
-                if self.battery.current is not None:
-                    self.battery.current_avg_lst.append(self.battery.current)
-
-                # delete oldest value
-                if len(self.battery.current_avg_lst) > 300:
-                    del self.battery.current_avg_lst[0]
+            # add the current to the statistics of the last CURRENT_STATS_WINDOW cycles
+            if self.battery.current is not None:
+                self.battery.current_stats.add(self.battery.current)
 
             if (
                 self.battery.capacity is not None
@@ -1042,12 +1101,12 @@ class DbusHelper:
                 self.battery.time_to_soc_update = int(time())
 
                 self.battery.current_avg = round(
-                    sum(self.battery.current_avg_lst)
-                    / len(self.battery.current_avg_lst),
-                    2,
+                    self.battery.current_stats.get_time_weighted_mean(), 2
                 )
 
-                self._dbusservice["/CurrentAvg"] = self.battery.current_avg
+                # the path is only added with TIME_TO_GO_ENABLE
+                if utils.TIME_TO_GO_ENABLE:
+                    values["/CurrentAvg"] = self.battery.current_avg
 
                 percent_per_seconds = (
                     abs(self.battery.current_avg / (self.battery.capacity / 100)) / 3600
@@ -1068,7 +1127,7 @@ class DbusHelper:
                     )
 
                     # Check that time_to_go is not None and current is not near zero
-                    self._dbusservice["/TimeToGo"] = (
+                    values["/TimeToGo"] = (
                         abs(int(time_to_go))
                         if time_to_go is not None
                         and abs(self.battery.current_avg) > 0.1
@@ -1078,7 +1137,7 @@ class DbusHelper:
                 # Update TimeToSoc items
                 if len(utils.TIME_TO_SOC_POINTS) > 0:
                     for num in utils.TIME_TO_SOC_POINTS:
-                        self._dbusservice["/TimeToSoC/" + str(num)] = (
+                        values["/TimeToSoC/" + str(num)] = (
                             self.battery.get_timeToSoc(num, percent_per_seconds)
                             if self.battery.current_avg
                             else None
@@ -1094,16 +1153,99 @@ class DbusHelper:
             )
             pass
 
-        # save settings every 15 seconds to dbus
-        if int(time()) % 15:
-            self.saveBatteryOptions()
+        # save changed settings to dbus, they are written in intervals or on significant changes
+        self.saveBatteryOptions()
 
         if self.battery.soc is not None:
             logger.debug("logged to dbus [%s]" % str(round(self.battery.soc, 2)))
             self.battery.log_cell_data()
 
         if self.battery.has_settings:
-            self._dbusservice["/Settings/ResetSoc"] = self.battery.reset_soc
+            values["/Settings/ResetSoc"] = self.battery.reset_soc
+
+        if self.battery.ble_link is not None:
+            link = self.battery.ble_link
+            values["/Bluetooth/Connected"] = (
+                int(link.connected) if link.connected is not None else None
+            )
+            values["/Bluetooth/Rssi"] = link.rssi
+            values["/Bluetooth/AdapterPowered"] = (
+                int(link.adapter_powered) if link.adapter_powered is not None else None
+            )
+            values["/Bluetooth/Disconnects"] = link.disconnects
+
+        self.publish_values(values)
+
+    def publish_values(self, values: dict) -> None:
+        """
+        Publish only the values, which changed since the last tick.
+        If supported by velib_python, all changes are sent as one ItemsChanged signal,
+        else each changed path sends its own PropertiesChanged signal.
+        """
+        now = time()
+        changes = {}
+        for path, value in values.items():
+            try:
+                published = self._dbusservice[path]
+            except KeyError:
+                # the path was not added by setup_vedbus(), e.g. since its feature is disabled
+                logger.debug(f"publish_values: {path} is not registered, skipped")
+                continue
+
+            if published == value:
+                continue
+
+            if utils.PUBLISH_DEADBAND_ENABLE and self.is_within_deadband(
+                path, published, value, now
+            ):
+                continue
+
+            changes[path] = value
+            self.published_time[path] = now
+
+        if len(changes) == 0:
+            self.signals_per_tick = 0
+
+        # VeDbusService collects the changes in a context and flushes them on exit
+        elif hasattr(self._dbusservice, "__enter__"):
+            with self._dbusservice as service:
+                for path, value in changes.items():
+                    service[path] = value
+            self.signals_per_tick = 1
+
+        else:
+            for path, value in changes.items():
+                self._dbusservice[path] = value
+            self.signals_per_tick = len(changes)
+
+        logger.debug(
+            f"publish_values: {len(changes)} of {len(values)} values changed, "
+            + f"{self.signals_per_tick} signal(s) sent"
+        )
+
+    def is_within_deadband(self, path: str, published, value, now: float) -> bool:
+        """
+        Check if the value changed less than the deadband of the path since it was published
+        and if it was published within PUBLISH_MAX_SILENCE seconds.
+        """
+        if path not in self.deadbands:
+            self.deadbands[path] = next(
+                (
+                    deadband
+                    for pattern, deadband in self.DEADBAND_PATHS
+                    if pattern.match(path)
+                ),
+                0,
+            )
+
+        return (
+            self.deadbands[path] > 0
+            and isinstance(published, (int, float))
+            and isinstance(value, (int, float))
+            # round to remove floating point errors, e.g. 3.302 - 3.300 = 0.00199...
+            and round(abs(value - published), 6) < self.deadbands[path]
+            and now - self.published_time.get(path, 0) < utils.PUBLISH_MAX_SILENCE
+        )
 
     def getSettingsWithValues(
         self, bus, service: str, object_path: str, recursive: bool = True
@@ -1144,6 +1286,34 @@ class DbusHelper:
 
         return result
 
+    def getSettingsBulk(self, bus, service: str, object_path: str) -> dict:
+        """
+        Get all settings below the object path with one GetValue call on the subtree.
+        Returns None, if the settings service does not support it, so that the settings
+        can be read with getSettingsWithValues() instead.
+        """
+        try:
+            obj = bus.get_object(service, object_path)
+            settings_iface = dbus.Interface(obj, "com.victronenergy.BusItem")
+            values = settings_iface.get_dbus_method("GetValue")()
+        except dbus.exceptions.DBusException as e:
+            logger.debug(f"getSettingsBulk(): Failed to get values: {e}")
+            return None
+
+        if type(values) is not dbus.Dictionary:
+            return None
+
+        result = {}
+        for path, value in values.items():
+            self.merge_dicts(
+                result,
+                self.create_nested_dict(
+                    object_path + "/" + str(path).strip("/"), str(value)
+                ),
+            )
+
+        return result
+
     def setSetting(
         self, bus, service: str, object_path: str, setting_name: str, value
     ) -> bool:
@@ -1151,17 +1321,23 @@ class DbusHelper:
         if value is None:
             return False
 
-        obj = bus.get_object(service, object_path + "/" + setting_name)
-        # iface = dbus.Interface(obj, "org.freedesktop.DBus.Introspectable")
-        # xml_string = iface.Introspect()
-        # print(xml_string)
-        settings_iface = dbus.Interface(obj, "com.victronenergy.BusItem")
-        method = settings_iface.get_dbus_method("SetValue")
+        # reuse the BusItem proxy, instead of creating it on every write
+        key = service + object_path + "/" + setting_name
+        if key not in self.setting_methods:
+            obj = bus.get_object(service, object_path + "/" + setting_name)
+            # iface = dbus.Interface(obj, "org.freedesktop.DBus.Introspectable")
+            # xml_string = iface.Introspect()
+            # print(xml_string)
+            settings_iface = dbus.Interface(obj, "com.victronenergy.BusItem")
+            self.setting_methods[key] = settings_iface.get_dbus_method("SetValue")
+        method = self.setting_methods[key]
         try:
             logger.debug(f"Setted setting {object_path}/{setting_name} to {value}")
             return True if method(value) == 0 else False
         except dbus.exceptions.DBusException as e:
             logger.error(f"Failed to set setting: {e}")
+            # get a new proxy on the next write, e.g. if the settings service was restarted
+            del self.setting_methods[key]
 
     def removeSetting(
         self, bus, service: str, object_path: str, setting_name: list
@@ -1198,6 +1374,55 @@ class DbusHelper:
             else:
                 dict1[key] = dict2[key]
 
+    def queue_setting_write(self, callback_name: str):
+        """
+        Get the onchangecallback of a dbus path, which hands the write to the RefreshWorker.
+        The battery callback is called by the worker before the next refresh of the battery,
+        if it rejects the value, the dbus path is reset to its previous value.
+        """
+
+        def onchangecallback(path, value) -> bool:
+            with self.setting_writes_lock:
+                self.setting_writes.append(
+                    (callback_name, path, value, self._dbusservice[path])
+                )
+            return True
+
+        return onchangecallback
+
+    def apply_setting_writes(self) -> None:
+        """
+        Call the battery callbacks of the queued dbus writes, runs in the RefreshWorker
+        """
+        with self.setting_writes_lock:
+            setting_writes = self.setting_writes
+            self.setting_writes = []
+
+        rejected = []
+        for callback_name, path, value, previous_value in setting_writes:
+            try:
+                result = getattr(self.battery, callback_name)(path, value)
+            except Exception:
+                traceback.print_exc()
+                result = False
+
+            if not result:
+                logger.warning(f"{path}: value {value} rejected by the BMS driver")
+                rejected.append((path, previous_value))
+
+        if len(rejected) > 0:
+            GLib.idle_add(self.reset_setting_paths, rejected)
+
+    def reset_setting_paths(self, rejected: list) -> bool:
+        """
+        Reset the dbus paths of rejected writes, runs in the main loop
+        """
+        for path, previous_value in rejected:
+            self._dbusservice[path] = previous_value
+
+        # remove the idle callback
+        return False
+
     # save custom name to dbus
     def custom_name_callback(self, path, value) -> str:
         result = self.setSetting(
@@ -1212,80 +1437,211 @@ class DbusHelper:
         )
         return value if result else None
 
+    def get_battery_options(self) -> dict:
+        """
+        Get the battery options, which are saved to the dbus settings, as they are written to dbus
+        """
+        return {
+            "AllowMaxVoltage": 1 if self.battery.allow_max_voltage else 0,
+            "MaxVoltageStartTime": (
+                self.battery.max_voltage_start_time
+                if self.battery.max_voltage_start_time is not None
+                else ""
+            ),
+            "SocCalc": self.battery.soc_calc,
+            "SocResetLastReached": self.battery.soc_reset_last_reached,
+        }
+
     # save battery options to dbus
-    def saveBatteryOptions(self) -> bool:
-        result = True
+    def saveBatteryOptions(self, force: bool = False) -> bool:
+        """
+        Collect the changed battery options and write them to the dbus settings.
+        Since every write is saved to flash by localsettings, the changes are coalesced and written
+        only every SAVE_SETTINGS_INTERVAL seconds, if the SoC changed by SAVE_SETTINGS_SOC_CALC_THRESHOLD
+        or if one of the other options changed. Use force to write all pending changes immediately,
+        e.g. on shutdown.
+        """
+        now = time()
+        flush = force or now - self.settings_saved_time >= utils.SAVE_SETTINGS_INTERVAL
 
-        if (
-            self.battery.allow_max_voltage
-            != self.save_charge_details_last["allow_max_voltage"]
-        ):
-            result = result + self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "AllowMaxVoltage",
-                1 if self.battery.allow_max_voltage else 0,
-            )
-            logger.debug(
-                f"Saved AllowMaxVoltage. Before {self.save_charge_details_last['allow_max_voltage']}, "
-                + f"after {self.battery.allow_max_voltage}"
-            )
-            self.save_charge_details_last["allow_max_voltage"] = (
-                self.battery.allow_max_voltage
-            )
+        for name, value in self.get_battery_options().items():
+            if value is None or value == self.settings_saved.get(name):
+                self.settings_pending.pop(name, None)
+                continue
 
-        if (
-            self.battery.max_voltage_start_time
-            != self.save_charge_details_last["max_voltage_start_time"]
-        ):
-            result = result and self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "MaxVoltageStartTime",
-                (
-                    self.battery.max_voltage_start_time
-                    if self.battery.max_voltage_start_time is not None
-                    else ""
-                ),
-            )
-            logger.debug(
-                f"Saved MaxVoltageStartTime. Before {self.save_charge_details_last['max_voltage_start_time']}, "
-                + f"after {self.battery.max_voltage_start_time}"
-            )
-            self.save_charge_details_last["max_voltage_start_time"] = (
-                self.battery.max_voltage_start_time
-            )
+            self.settings_pending[name] = value
 
-        if self.battery.soc_calc != self.save_charge_details_last["soc_calc"]:
-            result = result and self.setSetting(
-                get_bus(),
-                "com.victronenergy.settings",
-                self.path_battery,
-                "SocCalc",
-                self.battery.soc_calc,
-            )
-            logger.debug(f"soc_calc written to dbus: {self.battery.soc_calc}")
-            self.save_charge_details_last["soc_calc"] = self.battery.soc_calc
+            # the SoC changes on almost every poll, the other options only on state changes
+            if (
+                name != "SocCalc"
+                or not isinstance(self.settings_saved.get(name), (int, float))
+                or abs(value - self.settings_saved[name])
+                >= utils.SAVE_SETTINGS_SOC_CALC_THRESHOLD
+            ):
+                flush = True
 
-        if (
-            self.battery.soc_reset_last_reached
-            != self.save_charge_details_last["soc_reset_last_reached"]
-        ):
-            result = result and self.setSetting(
+        if not flush or len(self.settings_pending) == 0:
+            return True
+
+        return self.flush_settings()
+
+    def flush_settings(self) -> bool:
+        """
+        Write the pending battery options to the dbus settings
+        """
+        if self.path_battery is None:
+            return False
+
+        result = True
+        for name, value in list(self.settings_pending.items()):
+            if self.setSetting(
                 get_bus(),
                 "com.victronenergy.settings",
                 self.path_battery,
-                "SocResetLastReached",
-                self.battery.soc_reset_last_reached,
-            )
-            logger.debug(
-                f"Saved SocResetLastReached. Before {self.save_charge_details_last['soc_reset_last_reached']}, "
-                + f"after {self.battery.soc_reset_last_reached}",
-            )
-            self.save_charge_details_last["soc_reset_last_reached"] = (
-                self.battery.soc_reset_last_reached
-            )
+                name,
+                value,
+            ):
+                logger.debug(
+                    f"Saved {name}. Before {self.settings_saved.get(name)}, after {value}"
+                )
+                self.settings_saved[name] = value
+                del self.settings_pending[name]
+            else:
+                result = False
 
+        self.settings_saved_time = time()
         return result
+
+
+class RefreshWorker:
+    """
+    This class holds the thread, which reads the data from the batteries.
+    Reading a BMS can block for seconds on timeouts and retries, which would stall the main loop
+    and with it all dbus requests to the driver. The worker refreshes the requested batteries one after
+    another, since they could share the same serial bus, and hands the results to the main loop with
+    GLib.idle_add(). The battery objects are only changed by the worker while a refresh is running and
+    only read by the main loop after the results were handed over, so a new refresh of a battery is not
+    started before its previous one was published. Writes to the dbus settings of a battery are queued
+    by the main loop and applied by the worker before the next refresh, see DbusHelper.queue_setting_write().
+    Other tasks, which use the bus, like the search for batteries, which did not reply on the start,
+    are run by the worker after the refreshes, see run_task().
+    """
+
+    def __init__(self, helpers: list, loop):
+        self.helpers: list = helpers
+        self.loop = loop
+        # helpers from the request of a refresh until its results are published
+        self.busy: set = set()
+        # helpers waiting for the worker
+        self.requested: list = []
+        # number of requests skipped, since the previous refresh was still running
+        self.skipped: int = 0
+        # tasks with their callbacks waiting for the worker, see run_task()
+        self.tasks: list = []
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="RefreshWorker", daemon=True
+        )
+        self.thread.start()
+
+    def request_refresh(self, helper=None) -> bool:
+        """
+        Request a refresh of a battery or of all batteries, returns immediately.
+        Can be called from the main loop or from a thread of a driver.
+        """
+        with self.lock:
+            for requested in self.helpers if helper is None else [helper]:
+                if requested in self.busy:
+                    self.skipped += 1
+                    logger.debug(
+                        f"Previous refresh still running, skipped {self.skipped} request(s)"
+                    )
+                    continue
+                self.busy.add(requested)
+                self.requested.append(requested)
+
+            if len(self.requested) == 0:
+                return False
+
+        self.wakeup.set()
+        return True
+
+    def run_task(self, task, callback) -> None:
+        """
+        Run a task in the worker thread after the pending refreshes, returns immediately.
+        The callback is called in the main loop with the result of the task, or None if it raised an exception.
+        """
+        with self.lock:
+            self.tasks.append((task, callback))
+        self.wakeup.set()
+
+    def run(self) -> None:
+        while True:
+            self.wakeup.wait()
+            self.wakeup.clear()
+
+            with self.lock:
+                helpers = self.requested
+                self.requested = []
+                tasks = self.tasks
+                self.tasks = []
+
+            results = []
+            for helper in helpers:
+                try:
+                    helper.apply_setting_writes()
+                    results.append(helper.battery.refresh_data())
+                except Exception:
+                    traceback.print_exc()
+                    # the battery is set to failed by publish_results()
+                    results.append(None)
+
+            if len(helpers) > 0:
+                GLib.idle_add(self.publish_results, helpers, results)
+
+            for task, callback in tasks:
+                try:
+                    result = task()
+                except Exception:
+                    traceback.print_exc()
+                    result = None
+                GLib.idle_add(self.call_task_callback, callback, result)
+
+    def call_task_callback(self, callback, result) -> bool:
+        """
+        Call the callback of a task with its result, runs in the main loop
+        """
+        try:
+            callback(result)
+        except Exception:
+            traceback.print_exc()
+
+        # remove the idle callback
+        return False
+
+    def publish_results(self, helpers: list, results: list) -> bool:
+        """
+        Publish the results of a refresh, runs in the main loop
+        """
+        try:
+            for helper, result in zip(helpers, results):
+                if result is None:
+                    # refresh_data() raised an exception, publish the reset values
+                    helper.set_failed()
+                    result = False
+                helper.publish_refresh_result(result)
+
+            # stop the driver only, if all batteries of the process failed, else serve the other batteries
+            if all(helper.failed for helper in self.helpers):
+                logger.error("All batteries failed, stopping the driver")
+                self.loop.quit()
+                return False
+        finally:
+            with self.lock:
+                self.busy.difference_update(helpers)
+                if len(self.busy) == 0:
+                    self.skipped = 0
+
+        # remove the idle callback
+        return False
@@ -333,16 +333,68 @@ if [ "$bluetooth_length" -gt 0 ]; then
         chmod 755 "/service/dbus-blebattery.$1/run"
     }
 
+    # function to install all ble batteries as one service, which shares one BLE manager
+    # the arguments are pairs of BMS type and MAC address
+    install_blebattery_service_single_process() {
+        echo "Installing \"$*\" as dbus-blebattery.0"
+
+        mkdir -p "/service/dbus-blebattery.0/log"
+        {
+            echo "#!/bin/sh"
+            echo "exec multilog t s25000 n4 /var/log/dbus-blebattery.0"
+        } > "/service/dbus-blebattery.0/log/run"
+        chmod 755 "/service/dbus-blebattery.0/log/run"
+
+        {
+            echo "#!/bin/sh"
+            echo "exec 2>&1"
+            echo "echo"
+            echo "echo \"INFO:Bluetooth details\""
+            # close all open connections, else the driver can't connect
+            for (( j=2; j<=$#; j+=2 )); do
+                echo "bluetoothctl disconnect ${!j}"
+            done
+
+            # enable bluetoothctl scan in background to display signal strength (RSSI), else it's missing
+            echo "bluetoothctl scan on | grep \"RSSI\" &"
+
+            # wait 5 seconds to finish the scan
+            echo "sleep 5"
+            # display some Bluetooth device details
+            for (( j=2; j<=$#; j+=2 )); do
+                echo "bluetoothctl info ${!j} | grep -E \"Device|Alias|Pair|Trusted|Blocked|Connected|RSSI|Power\""
+            done
+            echo "echo"
+            echo "python /opt/victronenergy/dbus-serialbattery/dbus-serialbattery.py $*"
+            echo "pkill -f \"bluetoothctl scan on\""
+        } > "/service/dbus-blebattery.0/run"
+        chmod 755 "/service/dbus-blebattery.0/run"
+    }
+
     # Example
     # install_blebattery_service 0 Jkbms_Ble C8:47:8C:00:00:00
     # install_blebattery_service 1 Jkbms_Ble C8:47:8C:00:00:11
-
-    for (( i=0; i<bluetooth_length; i++ ));
-    do
-        # split BMS type and MAC address
-        IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
-        install_blebattery_service $i "${bms[0]}" "${bms[1]}"
-    done
+    # install_blebattery_service_single_process Jkbms_Ble C8:47:8C:00:00:00 Jkbms_Ble C8:47:8C:00:00:11
+
+    bluetooth_single_process=$(awk -F "=" '/^BLUETOOTH_SINGLE_PROCESS/ {print $2}' /data/etc/dbus-serialbattery/config.ini)
+
+    if [[ $bluetooth_single_process == *"True"* ]]; then
+        bms_arguments=()
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            bms_arguments+=("${bms[0]}" "${bms[1]}")
+        done
+        install_blebattery_service_single_process "${bms_arguments[@]}"
+    else
+        for (( i=0; i<bluetooth_length; i++ ));
+        do
+            # split BMS type and MAC address
+            IFS=' ' read -r -a bms <<< "${bms_array[$i]}"
+            install_blebattery_service $i "${bms[0]}" "${bms[1]}"
+        done
+    fi
 
     echo
 
@@ -3,12 +3,21 @@ import logging
 
 import configparser
 from pathlib import Path
-from typing import List, Any, Callable
+from typing import List, Any, Callable, Dict, Iterable, Union
 
 import serial
-from time import sleep
+from serial.tools import list_ports
+from time import sleep, time
 from struct import unpack_from
+from functools import lru_cache
+from operator import itemgetter
+import struct
+from contextlib import contextmanager
 import bisect
+import select
+import threading
+import fcntl
+import json
 
 # Logging
 logging.basicConfig()
@@ -88,6 +97,17 @@ SOC_RESET_AFTER_DAYS = (
     else False
 )
 
+# --------- Bluetooth single process ---------
+BLUETOOTH_RECONNECT_DELAY_MIN = float(
+    config["DEFAULT"]["BLUETOOTH_RECONNECT_DELAY_MIN"]
+)
+BLUETOOTH_RECONNECT_DELAY_MAX = float(
+    config["DEFAULT"]["BLUETOOTH_RECONNECT_DELAY_MAX"]
+)
+BLUETOOTH_ADAPTER_RESET_FAILURES = int(
+    config["DEFAULT"]["BLUETOOTH_ADAPTER_RESET_FAILURES"]
+)
+
 # --------- BMS disconnect behaviour ---------
 BLOCK_ON_DISCONNECT = "True" == config["DEFAULT"]["BLOCK_ON_DISCONNECT"]
 
@@ -193,6 +213,31 @@ MAX_DISCHARGE_CURRENT_SOC = _get_list_from_config(
     lambda v: MAX_BATTERY_DISCHARGE_CURRENT * float(v),
 )
 
+# --------- Tiered polling ---------
+POLL_INTERVAL_CELLS = float(config["DEFAULT"]["POLL_INTERVAL_CELLS"])
+POLL_INTERVAL_TEMPERATURES = float(config["DEFAULT"]["POLL_INTERVAL_TEMPERATURES"])
+POLL_INTERVAL_ALARMS = float(config["DEFAULT"]["POLL_INTERVAL_ALARMS"])
+
+# --------- Adaptive polling ---------
+POLL_ADAPTIVE_ENABLE = "True" == config["DEFAULT"]["POLL_ADAPTIVE_ENABLE"]
+POLL_ADAPTIVE_IDLE_INTERVAL = float(config["DEFAULT"]["POLL_ADAPTIVE_IDLE_INTERVAL"])
+POLL_ADAPTIVE_CELL_VOLTAGE_MARGIN = float(
+    config["DEFAULT"]["POLL_ADAPTIVE_CELL_VOLTAGE_MARGIN"]
+)
+POLL_ADAPTIVE_CURRENT_CHANGE = float(config["DEFAULT"]["POLL_ADAPTIVE_CURRENT_CHANGE"])
+
+# --------- Current statistics ---------
+CURRENT_STATS_WINDOW = int(config["DEFAULT"]["CURRENT_STATS_WINDOW"])
+CURRENT_STATS_EWMA_TIME_CONSTANT = float(
+    config["DEFAULT"]["CURRENT_STATS_EWMA_TIME_CONSTANT"]
+)
+
+# --------- Settings persistence ---------
+SAVE_SETTINGS_INTERVAL = int(config["DEFAULT"]["SAVE_SETTINGS_INTERVAL"])
+SAVE_SETTINGS_SOC_CALC_THRESHOLD = float(
+    config["DEFAULT"]["SAVE_SETTINGS_SOC_CALC_THRESHOLD"]
+)
+
 # --------- Time-To-Go ---------
 TIME_TO_GO_ENABLE = "True" == config["DEFAULT"]["TIME_TO_GO_ENABLE"]
 
@@ -226,6 +271,10 @@ EXCLUDED_DEVICES = _get_list_from_config(
     "DEFAULT", "EXCLUDED_DEVICES", lambda v: str(v)
 )
 
+BATTERY_ADDRESSES = _get_list_from_config(
+    "DEFAULT", "BATTERY_ADDRESSES", lambda v: int(v, 0)
+)
+
 # Auto reset SoC
 AUTO_RESET_SOC = "True" == config["DEFAULT"]["AUTO_RESET_SOC"]
 
@@ -243,6 +292,17 @@ TEMP_2_NAME = config["DEFAULT"]["TEMP_2_NAME"]
 TEMP_3_NAME = config["DEFAULT"]["TEMP_3_NAME"]
 TEMP_4_NAME = config["DEFAULT"]["TEMP_4_NAME"]
 
+# Publishing deadband
+PUBLISH_DEADBAND_ENABLE = "True" == config["DEFAULT"]["PUBLISH_DEADBAND_ENABLE"]
+PUBLISH_DEADBAND_CELL_VOLTAGE = float(
+    config["DEFAULT"]["PUBLISH_DEADBAND_CELL_VOLTAGE"]
+)
+PUBLISH_DEADBAND_VOLTAGE = float(config["DEFAULT"]["PUBLISH_DEADBAND_VOLTAGE"])
+PUBLISH_DEADBAND_CURRENT = float(config["DEFAULT"]["PUBLISH_DEADBAND_CURRENT"])
+PUBLISH_DEADBAND_POWER = float(config["DEFAULT"]["PUBLISH_DEADBAND_POWER"])
+PUBLISH_DEADBAND_TEMPERATURE = float(config["DEFAULT"]["PUBLISH_DEADBAND_TEMPERATURE"])
+PUBLISH_MAX_SILENCE = int(config["DEFAULT"]["PUBLISH_MAX_SILENCE"])
+
 # --------- BMS specific settings ---------
 SOC_LOW_WARNING = float(config["DEFAULT"]["SOC_LOW_WARNING"])
 SOC_LOW_ALARM = float(config["DEFAULT"]["SOC_LOW_ALARM"])
@@ -284,39 +344,224 @@ def mapRangeConstrain(inValue, inMin, inMax, outMin, outMax):
     return constrain(mapRange(inValue, inMin, inMax, outMin, outMax), outMin, outMax)
 
 
+class LimitCurve:
+    """
+    This class holds a piecewise-linear curve, which is compiled once from two lists of the config.
+    The breakpoints are stored in ascending order and the slopes of the segments are precalculated,
+    so that a value can be looked up with a binary search and without copying the lists.
+    """
+
+    def __init__(self, in_array: List[float], out_array: List[float]):
+        self.error: str = None
+        if len(in_array) == 0 or len(in_array) != len(out_array):
+            # raise the error on lookup, so that the callers can fall back to their default values
+            self.error = f"the lists have to be of the same length and not empty: {in_array} • {out_array}"
+
+        # change compare-direction in array
+        if len(in_array) > 0 and in_array[0] > in_array[-1]:
+            in_array = in_array[::-1]
+            out_array = out_array[::-1]
+
+        self.in_values: tuple = tuple(in_array)
+        self.out_values: tuple = tuple(out_array)
+        # slope of the segment that ends at the index
+        self.slopes: tuple = tuple(
+            (
+                (self.out_values[i] - self.out_values[i - 1])
+                / (self.in_values[i] - self.in_values[i - 1])
+                if i > 0 and self.in_values[i] != self.in_values[i - 1]
+                else 0
+            )
+            for i in range(min(len(self.in_values), len(self.out_values)))
+        )
+
+    def _get_index(self, value: float) -> Union[int, None]:
+        """
+        Get the index of the upper breakpoint of the segment, or None if the value is out of bounds
+        """
+        if self.error is not None:
+            raise ValueError(self.error)
+
+        if value <= self.in_values[0] or value >= self.in_values[-1]:
+            return None
+
+        return bisect.bisect(self.in_values, value)
+
+    def linear(self, value: float) -> float:
+        idx = self._get_index(value)
+        if idx is None:
+            return (
+                self.out_values[0]
+                if value <= self.in_values[0]
+                else self.out_values[-1]
+            )
+
+        # calculate linear current between the setpoints
+        return self.out_values[idx] + (value - self.in_values[idx]) * self.slopes[idx]
+
+    def step(self, value: float, return_lower: bool) -> float:
+        idx = self._get_index(value)
+        if idx is None:
+            return (
+                self.out_values[0]
+                if value <= self.in_values[0]
+                else self.out_values[-1]
+            )
+
+        return self.out_values[idx] if return_lower else self.out_values[idx - 1]
+
+    def linear_many(self, values: Iterable[float]) -> List[float]:
+        """
+        Evaluate the curve for a whole series of values, e.g. logged samples
+        """
+        return [self.linear(value) for value in values]
+
+    def step_many(self, values: Iterable[float], return_lower: bool) -> List[float]:
+        """
+        Evaluate the curve as steps for a whole series of values, e.g. logged samples
+        """
+        return [self.step(value, return_lower) for value in values]
+
+
+@lru_cache(maxsize=None)
+def get_limit_curve(in_values: tuple, out_values: tuple) -> LimitCurve:
+    """
+    Get the compiled curve of two lists, it's compiled only on the first call with the same values
+    """
+    return LimitCurve(list(in_values), list(out_values))
+
+
 def calcLinearRelationship(inValue, inArray, outArray):
-    if inArray[0] > inArray[-1]:  # change compare-direction in array
-        return calcLinearRelationship(inValue, inArray[::-1], outArray[::-1])
-    else:
-        # Handle out of bounds
-        if inValue <= inArray[0]:
-            return outArray[0]
-        if inValue >= inArray[-1]:
-            return outArray[-1]
-
-        # else calculate linear current between the setpoints
-        idx = bisect.bisect(inArray, inValue)
-        upperIN = inArray[idx - 1]  # begin with idx 0 as max value
-        upperOUT = outArray[idx - 1]
-        lowerIN = inArray[idx]
-        lowerOUT = outArray[idx]
-        return mapRangeConstrain(inValue, lowerIN, upperIN, lowerOUT, upperOUT)
+    return get_limit_curve(tuple(inArray), tuple(outArray)).linear(inValue)
 
 
 def calcStepRelationship(inValue, inArray, outArray, returnLower):
-    if inArray[0] > inArray[-1]:  # change compare-direction in array
-        return calcStepRelationship(inValue, inArray[::-1], outArray[::-1], returnLower)
+    return get_limit_curve(tuple(inArray), tuple(outArray)).step(inValue, returnLower)
+
+
+# --------- Compiled limit curves ---------
+# compiled once at load, since the lists do not change while the driver is running
+CHARGE_CURRENT_CV_CURVE = get_limit_curve(
+    tuple(CELL_VOLTAGES_WHILE_CHARGING), tuple(MAX_CHARGE_CURRENT_CV)
+)
+DISCHARGE_CURRENT_CV_CURVE = get_limit_curve(
+    tuple(CELL_VOLTAGES_WHILE_DISCHARGING), tuple(MAX_DISCHARGE_CURRENT_CV)
+)
+CHARGE_CURRENT_T_CURVE = get_limit_curve(
+    tuple(TEMPERATURES_WHILE_CHARGING), tuple(MAX_CHARGE_CURRENT_T)
+)
+DISCHARGE_CURRENT_T_CURVE = get_limit_curve(
+    tuple(TEMPERATURES_WHILE_DISCHARGING), tuple(MAX_DISCHARGE_CURRENT_T)
+)
+CHARGE_CURRENT_SOC_CURVE = get_limit_curve(
+    tuple(SOC_WHILE_CHARGING), tuple(MAX_CHARGE_CURRENT_SOC)
+)
+DISCHARGE_CURRENT_SOC_CURVE = get_limit_curve(
+    tuple(SOC_WHILE_DISCHARGING), tuple(MAX_DISCHARGE_CURRENT_SOC)
+)
+SOC_CALC_CURRENT_CURVE = get_limit_curve(
+    tuple(SOC_CALC_CURRENT_REPORTED_BY_BMS), tuple(SOC_CALC_CURRENT_MEASURED_BY_USER)
+)
+
+
+class FrameSchema:
+    """
+    This class holds the layout of a frame received from a BMS. Each field is declared once with its name,
+    offset, struct format and an optional divisor. All fields are compiled into one struct.Struct,
+    so that a frame is decoded with a single call, instead of one unpack_from() per field.
+    Markers are bytes at fixed offsets, e.g. ID codes, which have to match for the frame to be valid.
+    """
+
+    def __init__(
+        self,
+        fields: List[tuple],
+        byteorder: str = ">",
+        markers: Dict[int, int] = None,
+    ):
+        """
+        :param fields: list of (name, offset, format) or (name, offset, format, divisor),
+            each format has to describe a single value, e.g. "H", "b", "?" or "8s"
+        :param byteorder: the struct byte order character
+        :param markers: dict with offset and expected byte value
+        """
+        markers = markers if markers is not None else {}
+        entries = [
+            (field[0], field[1], field[2], field[3] if len(field) > 3 else None)
+            for field in fields
+        ] + [(None, offset, "B", value) for offset, value in markers.items()]
+        entries.sort(key=lambda entry: entry[1])
+
+        self.start: int = entries[0][1]
+        position = self.start
+        struct_format = byteorder
+        for name, offset, fmt, _ in entries:
+            if offset < position:
+                raise ValueError(
+                    f"Field at offset {offset} overlaps the previous field"
+                )
+            if offset > position:
+                struct_format += f"{offset - position}x"
+            struct_format += fmt
+            position = offset + struct.calcsize(byteorder + fmt)
+
+        self.struct: struct.Struct = struct.Struct(struct_format)
+        # names of the fields, (index, value) of the markers and (name, divisor) of the scaled fields
+        self.names: tuple = tuple(entry[0] for entry in entries if entry[0] is not None)
+        self.markers: List[tuple] = [
+            (index, entry[3]) for index, entry in enumerate(entries) if entry[0] is None
+        ]
+        self.divisors: List[tuple] = [
+            (entry[0], entry[3])
+            for entry in entries
+            if entry[0] is not None and entry[3] is not None
+        ]
+        # picks the values of the fields, if the struct also contains markers
+        self.get_field_values: Callable = (
+            itemgetter(
+                *[index for index, entry in enumerate(entries) if entry[0] is not None]
+            )
+            if len(self.markers) > 0
+            else None
+        )
+
+    def decode(
+        self, data: Union[bytes, bytearray, memoryview], offset: int = 0
+    ) -> Union[Dict[str, Any], None]:
+        """
+        Decode all fields of the frame.
+
+        :param data: the frame, it's not copied
+        :param offset: added to the offsets of all fields
+        :return: dict with the values of the fields or None, if the data is too short or a marker does not match
+        """
+        if len(data) < offset + self.start + self.struct.size:
+            return None
+
+        values = self.struct.unpack_from(data, offset + self.start)
+        for index, expected in self.markers:
+            if values[index] != expected:
+                return None
+
+        if self.get_field_values is not None:
+            values = self.get_field_values(values)
+            if len(self.names) == 1:
+                values = (values,)
+
+        result = dict(zip(self.names, values))
+        for name, divisor in self.divisors:
+            result[name] /= divisor
+        return result
 
-    # Handle out of bounds
-    if inValue <= inArray[0]:
-        return outArray[0]
-    if inValue >= inArray[-1]:
-        return outArray[-1]
 
-    # else get index between the setpoints
-    idx = bisect.bisect(inArray, inValue)
+@lru_cache(maxsize=None)
+def get_array_struct(fmt: str, count: int) -> struct.Struct:
+    """
+    Get a compiled struct for an array of count items, e.g. the cell voltages of a frame.
 
-    return outArray[idx] if returnLower else outArray[idx - 1]
+    :param fmt: byte order character and format of one item, e.g. ">H" or ">xH"
+    :param count: number of items
+    """
+    return struct.Struct(fmt[0] + fmt[1:] * count)
 
 
 def is_bit_set(tmp):
@@ -341,11 +586,130 @@ def format_value(value, prefix, suffix):
     )
 
 
+class SerialSession:
+    """
+    This class holds a serial port, which is kept open between the reads of a driver.
+    Opening a port for every single command costs a lot of time, especially on USB-serial
+    adapters, since the adapter driver is reinitialized on every open.
+    The port is opened on the first use, reopened after an error and closed if it was
+    not used for SERIAL_SESSION_IDLE_CLOSE seconds.
+    """
+
+    def __init__(self, port: str):
+        self.port: str = port
+        self.ser: serial.Serial = None
+        # number of readers, which are currently borrowing the port
+        self.users: int = 0
+        self.last_used: float = 0
+        # number of times the port was opened, useful for troubleshooting
+        self.open_count: int = 0
+        self.lock = threading.RLock()
+
+    def open(self, baud: int) -> serial.Serial:
+        if self.ser is None or not self.ser.is_open:
+            self.ser = serial.Serial(self.port, baudrate=baud, timeout=0.1)
+            self.open_count += 1
+            logger.debug(f"Serial port {self.port} opened ({self.open_count} times)")
+        elif self.ser.baudrate != baud:
+            # the same port is probed with different baud rates during the BMS detection
+            self.ser.baudrate = baud
+        return self.ser
+
+    def close(self) -> None:
+        if self.ser is not None:
+            try:
+                self.ser.close()
+            except serial.SerialException as e:
+                logger.error(e)
+            self.ser = None
+
+
+# Seconds after which a serial port, that is not used anymore, is closed
+SERIAL_SESSION_IDLE_CLOSE = 60
+
+serial_sessions: Dict[str, SerialSession] = {}
+# lock order: a session.lock can be held while taking serial_sessions_lock, but never
+# wait for a session.lock while holding serial_sessions_lock
+serial_sessions_lock = threading.Lock()
+
+
+@contextmanager
+def borrow_serial_port(port: str, baud: int):
+    """
+    Borrow the long-lived serial port session of a port.
+    The port stays open after the block and is reused by the next read.
+    On errors the port is closed and reopened on the next borrow.
+
+    :param port: the serial port, e.g. /dev/ttyUSB0
+    :param baud: the baud rate to use
+    :return: the opened serial.Serial object
+    """
+    with serial_sessions_lock:
+        close_idle_serial_sessions()
+        session = serial_sessions.get(port)
+        if session is None:
+            session = SerialSession(port)
+            serial_sessions[port] = session
+        session.users += 1
+
+    try:
+        with session.lock:
+            try:
+                yield session.open(baud)
+            except serial.SerialException:
+                session.close()
+                raise
+            finally:
+                session.last_used = time()
+    finally:
+        with serial_sessions_lock:
+            session.users -= 1
+
+
+def close_idle_serial_sessions() -> None:
+    """
+    Close all serial ports, which are not borrowed and were not used for SERIAL_SESSION_IDLE_CLOSE seconds.
+    Has to be called while holding serial_sessions_lock.
+    """
+    for session in serial_sessions.values():
+        if (
+            session.ser is not None
+            and session.users == 0
+            and time() - session.last_used > SERIAL_SESSION_IDLE_CLOSE
+        ):
+            # skip the session, if it's in use, waiting here would break the lock order
+            if not session.lock.acquire(blocking=False):
+                continue
+            try:
+                logger.debug(f"Serial port {session.port} closed after being idle")
+                session.close()
+            finally:
+                session.lock.release()
+
+
+def close_serial_sessions(port: str = None) -> None:
+    """
+    Close the serial port session of a port or of all ports, if no port is specified.
+    The port is opened again on the next borrow.
+    """
+    with serial_sessions_lock:
+        sessions = [
+            session
+            for session in serial_sessions.values()
+            if port is None or session.port == port
+        ]
+
+    # wait for the readers without holding serial_sessions_lock, see the lock order
+    for session in sessions:
+        with session.lock:
+            session.close()
+
+
 def read_serial_data(
     command, port, baud, length_pos, length_check, length_fixed=None, length_size=None
 ):
     try:
-        with serial.Serial(port, baudrate=baud, timeout=0.1) as ser:
+        with borrow_serial_port(port, baud) as ser:
             return read_serialport_data(
                 ser, command, length_pos, length_check, length_fixed, length_size
             )
@@ -355,6 +719,167 @@ def read_serial_data(
         return False
 
 
+# Seconds the autodetection waits for the reply to a probe command
+SERIAL_PROBE_TIMEOUT = 0.5
+# Seconds of silence on the line after which a reply is considered complete
+SERIAL_PROBE_SILENCE = 0.02
+
+
+def probe_serial_port(port: str, baud: int, command: bytes, size: int) -> bytearray:
+    """
+    Send a command and return the first size bytes of whatever arrives within one response window.
+    The rest of the reply is discarded, so that it does not disturb the next probe.
+    """
+    try:
+        with borrow_serial_port(port, baud) as ser:
+            ser.reset_input_buffer()
+            ser.write(command)
+            deadline = time() + SERIAL_PROBE_TIMEOUT
+            reply = read_serialport_bytes(ser, size, deadline)
+
+            # drain the rest of the reply until the line is silent
+            while len(reply) > 0 and wait_for_serialport_data(
+                ser, min(deadline, time() + SERIAL_PROBE_SILENCE)
+            ):
+                ser.read(max(ser.in_waiting, 1))
+
+            return reply
+
+    except serial.SerialException as e:
+        logger.error(e)
+        return bytearray()
+
+
+# the file is removed on a driver update, since a new driver version could detect the BMS differently
+PATH_DETECTION_CACHE = "/data/etc/dbus-serialbattery/detection-cache.json"
+
+
+def get_port_identity(port: str) -> str:
+    """
+    Get an identity of the serial port, which does not change on a reboot or when the USB devices
+    are enumerated in a different order. For USB adapters vendor id, product id and serial number
+    are used, for adapters without serial number the USB path. Other ports are identified by their name.
+    """
+    try:
+        for port_info in list_ports.comports():
+            if port_info.device == port and port_info.vid is not None:
+                return f"{port_info.vid:04x}:{port_info.pid:04x}:" + (
+                    port_info.serial_number
+                    if port_info.serial_number
+                    else str(port_info.location)
+                )
+    except Exception as e:
+        logger.debug(f"USB identity of {port} not available: {e}")
+
+    return port
+
+
+def get_detection_cache(port: str) -> Union[Dict[str, Any], None]:
+    """
+    Get the BMS type, which was found on this serial port on the last start.
+
+    :return: dict with "bms", "baud" and "address" or None, if the port is not cached
+    """
+    try:
+        with open(PATH_DETECTION_CACHE, "r") as f:
+            return json.load(f).get(get_port_identity(port))
+    except (OSError, ValueError):
+        return None
+
+
+def save_detection_cache(port: str, bms: str, baud: int, address: bytes) -> None:
+    """
+    Save the BMS type found on this serial port, so that it can be tested first on the next start.
+    """
+    identity = get_port_identity(port)
+    if update_json_cache(
+        PATH_DETECTION_CACHE,
+        identity,
+        {
+            "bms": bms,
+            "baud": baud,
+            "address": address.hex() if address is not None else None,
+        },
+    ):
+        logger.debug(f"Detection cache saved for {port} ({identity})")
+
+
+PATH_METADATA_CACHE = "/data/etc/dbus-serialbattery/metadata-cache.json"
+
+# increase, if the cached values of a driver change their meaning
+METADATA_CACHE_VERSION = 1
+
+
+def get_metadata_cache(key: str) -> Union[Dict[str, Any], None]:
+    """
+    Get the static BMS data, which was read on the last start.
+
+    :param key: identifies the BMS, see Battery.get_metadata_cache_key()
+    :return: dict with the cached values or None, if nothing valid is cached
+    """
+    try:
+        with open(PATH_METADATA_CACHE, "r") as f:
+            entry = json.load(f).get(key)
+    except (OSError, ValueError):
+        return None
+
+    # ignore values cached by another driver version
+    if (
+        entry is None
+        or entry.get("version") != METADATA_CACHE_VERSION
+        or entry.get("driver_version") != DRIVER_VERSION
+    ):
+        return None
+
+    return entry.get("values")
+
+
+def save_metadata_cache(key: str, values: Dict[str, Any]) -> None:
+    """
+    Save the static BMS data, so that it does not have to be read again on the next start.
+    """
+    if update_json_cache(
+        PATH_METADATA_CACHE,
+        key,
+        {
+            "version": METADATA_CACHE_VERSION,
+            "driver_version": DRIVER_VERSION,
+            "values": values,
+        },
+    ):
+        logger.debug(f"Metadata cache saved for {key}")
+
+
+def update_json_cache(path: str, key: str, value: Any) -> bool:
+    """
+    Update one entry of a JSON cache file, which is shared by all driver instances.
+
+    :return: true if the file was saved
+    """
+    try:
+        # open in append mode to not flush the content of other ports, before the file is locked
+        with open(path, "a+") as f:
+            # one driver instance is running for each serial port
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            try:
+                cache = json.load(f)
+            except ValueError:
+                cache = {}
+
+            cache[key] = value
+
+            f.seek(0)
+            f.truncate()
+            json.dump(cache, f, indent=4)
+
+        return True
+
+    except OSError as e:
+        logger.debug(f"{path} not saved: {e}")
+        return False
+
+
 # Open the serial port
 # Return variable for the openned port
 def open_serial_port(port, baud):
@@ -371,6 +896,58 @@ def open_serial_port(port, baud):
     return ser
 
 
+# Seconds the BMS gets to start its reply after a command was sent
+SERIAL_REPLY_TIMEOUT = 0.25
+
+
+def serial_wire_time(size: int, baud: int) -> float:
+    """
+    Calculate the time needed to transfer a number of bytes over the serial line.
+    One byte needs 10 bits on the wire (start bit, 8 data bits, stop bit).
+    """
+    return size * 10 / baud
+
+
+def wait_for_serialport_data(ser: serial.Serial, deadline: float) -> bool:
+    """
+    Block until data can be read from the serial port or the deadline is reached.
+    Instead of polling inWaiting() with short sleeps, the process sleeps in select()
+    and wakes up as soon as the first byte arrives.
+
+    :return: False, if the deadline was reached without receiving data
+    """
+    remaining = deadline - time()
+    if remaining <= 0:
+        return False
+
+    try:
+        fd = ser.fileno()
+    except AttributeError:
+        # the port does not provide a file descriptor, fall back to polling
+        sleep(min(remaining, 0.005))
+        return True
+
+    readable, _, _ = select.select([fd], [], [], remaining)
+    return len(readable) > 0
+
+
+def read_serialport_bytes(ser: serial.Serial, size: int, deadline: float) -> bytearray:
+    """
+    Read exactly size bytes from the serial port or less, if the deadline is reached.
+    Bytes after the requested size stay in the input buffer for the next read.
+    """
+    data = bytearray()
+    while len(data) < size:
+        waiting = ser.in_waiting
+        if waiting == 0:
+            if not wait_for_serialport_data(ser, deadline):
+                break
+            # read at least one byte, which also detects a disconnected device
+            waiting = 1
+        data += ser.read(min(waiting, size - len(data)))
+    return data
+
+
 # Read data from previously opened serial port
 def read_serialport_data(
     ser: serial.Serial,
@@ -392,54 +969,51 @@ def read_serialport_data(
             elif length_size.upper() == "I" or length_size.upper() == "L":
                 length_byte_size = 4
 
-        count = 0
-        toread = ser.inWaiting()
-
-        while toread < (length_pos + length_byte_size):
-            sleep(0.005)
-            toread = ser.inWaiting()
-            count += 1
-            if count > 50:
-                logger.error(">>> ERROR: No reply - returning")
-                return False
+        # wait until the header including the length field is received
+        header_size = length_pos + length_byte_size
+        data = read_serialport_bytes(ser, header_size, time() + SERIAL_REPLY_TIMEOUT)
+        if len(data) < header_size:
+            logger.error(">>> ERROR: No reply - returning [len:" + str(len(data)) + "]")
+            return False
 
-        # logger.info('serial data toread ' + str(toread))
-        res = ser.read(toread)
         if length_fixed is not None:
             length = length_fixed
         else:
-            if len(res) < (length_pos + length_byte_size):
-                logger.error(
-                    ">>> ERROR: No reply - returning [len:" + str(len(res)) + "]"
-                )
-                return False
             length_size = length_size if length_size is not None else "B"
-            length = unpack_from(">" + length_size, res, length_pos)[0]
+            length = unpack_from(">" + length_size, data, length_pos)[0]
 
         # logger.info('serial data length ' + str(length))
 
-        count = 0
-        data = bytearray(res)
-        while len(data) <= length + length_check:
-            res = ser.read(length + length_check)
-            data.extend(res)
-            # logger.info('serial data length ' + str(len(data)))
-            sleep(0.005)
-            count += 1
-            if count > 150:
+        # the rest of the frame follows the header, so the deadline is computed from the wire time
+        frame_size = length + length_check + 1
+        missing = frame_size - len(data)
+        if missing > 0:
+            data += read_serialport_bytes(
+                ser,
+                missing,
+                time() + SERIAL_REPLY_TIMEOUT + serial_wire_time(missing, ser.baudrate),
+            )
+            if len(data) < frame_size:
                 logger.error(
                     ">>> ERROR: No reply - returning [len:"
                     + str(len(data))
                     + "/"
-                    + str(length + length_check)
+                    + str(frame_size)
                     + "]"
                 )
                 return False
 
+        # also return bytes, which already arrived after the frame
+        waiting = ser.in_waiting
+        if waiting > 0:
+            data += ser.read(waiting)
+
         return data
 
     except serial.SerialException as e:
         logger.error(e)
+        # close the port, so that it gets reopened on the next read
+        ser.close()
         return False
 
 